@@ -2,6 +2,10 @@
 import json, os, subprocess, sys, pathlib
 
 APP_PREFIX = "app/"
+EMPTY_TREE = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"  # git hash-object -t tree /dev/null
+CACHE_DIR = os.getenv("CHANGED_CACHE_DIR", ".cache/ai-ci/changed")
+CACHE_MAX = 64
+CACHE_VERSION = 2  # formato/parseo de las entradas de la caché de diffs
 
 def sh(cmd):
     return subprocess.run(cmd, check=True, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -9,78 +13,166 @@ def sh(cmd):
 def safe_sh(cmd):
     return subprocess.run(cmd, check=False, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
-def get_changed_files():
-    event_name = os.getenv("GITHUB_EVENT_NAME", "")
+def is_sha(ref):
+    return len(ref) == 40 and all(c in "0123456789abcdef" for c in ref)
+
+def load_event():
+    # el JSON del evento se lee una sola vez
     event_path = os.getenv("GITHUB_EVENT_PATH", "")
-    head = os.getenv("GITHUB_SHA", "").strip()
-    changed = []
-
-    # Trae refs remotas por si el checkout fue shallow
-    safe_sh(["git", "fetch", "--no-tags", "--prune", "--depth=1000", "origin", "+refs/heads/*:refs/remotes/origin/*"])
-
-    def diff_names(a, b):
-        r = safe_sh(["git", "diff", "--name-only", f"{a}..{b}"])
-        return [ln.strip() for ln in r.stdout.splitlines() if ln.strip()]
-
-    # 1) pull_request: compara base.sha vs HEAD
-    if event_name == "pull_request" and event_path and os.path.exists(event_path):
-        import json as _json
-        ev = _json.load(open(event_path))
-        base_sha = ev.get("pull_request", {}).get("base", {}).get("sha", "")
-        if not base_sha:
-            # fallback a la rama base
-            base_ref = os.getenv("GITHUB_BASE_REF", "")
-            if base_ref:
-                base_sha = safe_sh(["git", "rev-parse", f"origin/{base_ref}"]).stdout.strip()
+    if event_path and os.path.exists(event_path):
+        with open(event_path) as f:
+            return json.load(f)
+    return {}
+
+def resolve_ranges(event):
+    """(base, head, three_dot) candidates for the current event, best first.
+
+    The first one whose diff is non-empty wins, as before: a PR whose merge-base diff
+    is empty falls back to the push range, then to the last commit.
+    """
+    event_name = os.getenv("GITHUB_EVENT_NAME", "")
+    head = os.getenv("GITHUB_SHA", "").strip() or "HEAD"
+    ranges = []
+
+    # 1) pull_request: diff contra el merge-base con la rama base (base...head)
+    if event_name == "pull_request":
+        base_sha = event.get("pull_request", {}).get("base", {}).get("sha", "")
+        base_ref = os.getenv("GITHUB_BASE_REF", "")
+        if not base_sha and base_ref:
+            r = safe_sh(["git", "rev-parse", "--verify", "-q", f"origin/{base_ref}"])
+            if r.returncode != 0:
+                safe_sh(["git", "fetch", "--no-tags", "origin", f"+refs/heads/{base_ref}:refs/remotes/origin/{base_ref}"])
+                r = safe_sh(["git", "rev-parse", "--verify", "-q", f"origin/{base_ref}"])
+            base_sha = r.stdout.strip()
         if base_sha:
-            changed = diff_names(base_sha, head)
-            if changed:
-                return changed
+            ranges.append((base_sha, head, True))
 
-    # 2) push: usa el SHA anterior del evento
+    # 2) push: SHA anterior del evento
     before = os.getenv("GITHUB_EVENT_BEFORE", os.getenv("BEFORE_SHA", "")).strip()
-    if not before and event_path and os.path.exists(event_path):
-        import json as _json
-        ev = _json.load(open(event_path))
-        before = ev.get("before", "") or ev.get("commits", [{}])[0].get("id", "")
-
-    # Caso “initial push” (before == 0000…)
-    if before and set(before) == {"0"}:
-        # compara contra árbol vacío
-        r = safe_sh(["git", "ls-tree", "--name-only", "-r", head])
-        changed = [ln.strip() for ln in r.stdout.splitlines() if ln.strip()]
-        return changed
-
+    if not before:
+        before = event.get("before", "") or (event.get("commits") or [{}])[0].get("id", "")
     if before:
-        changed = diff_names(before, head)
-        if changed:
-            return changed
+        # Caso “initial push” (before == 0000…): todo el árbol es nuevo
+        ranges.append(((EMPTY_TREE if set(before) == {"0"} else before), head, False))
 
     # 3) Fallback general: último commit vs su padre
-    r = safe_sh(["git", "rev-parse", "HEAD~1"])
-    if r.returncode == 0:
-        parent = r.stdout.strip()
-        changed = diff_names(parent, head)
+    ranges.append((f"{head}~1", head, False))
+    return ranges
+
+def ensure_commit(sha):
+    # sólo se trae el commit base concreto si falta (nada de fetch de todas las ramas)
+    if not is_sha(sha) or safe_sh(["git", "cat-file", "-e", f"{sha}^{{commit}}"]).returncode == 0:
+        return False
+    r = safe_sh(["git", "fetch", "--no-tags", "--depth=1", "origin", sha])
+    return r.returncode == 0
+
+def parse_diff(out):
+    """Names (``--raw``) and old-side hunk ranges (``-p -U0``) from one ``git diff`` output.
+
+    ``---``/``+++`` are only file headers between a ``diff --git`` line and its first
+    ``@@``: inside a hunk they are removed/added lines (e.g. ``-- comment`` in SQL or Lua).
+    A pure insertion after line N maps to [N, N+1] so the enclosing code still matches.
+    """
+    changed, hunks, current, in_header, in_patch = [], {}, None, False, False
+    for ln in out.splitlines():
+        if ln.startswith("diff --git "):
+            current, in_header, in_patch = None, True, True
+        elif in_header and ln.startswith("--- "):
+            current = ln[6:] if ln.startswith("--- a/") else None
+        elif ln.startswith("@@"):
+            in_header = False
+            if current:
+                start, _, count = ln.split()[1][1:].partition(",")
+                start, count = int(start), int(count or 1)
+                end = start + count - 1 if count else start + 1
+                hunks.setdefault(current, []).append([max(start, 1), max(end, 1)])
+        elif ln.startswith(":") and not in_patch:  # --raw va antes del primer parche
+            changed.append(ln.split("\t", 1)[1].strip())
+    return changed, hunks
+
+def git_diff(base, head, three_dot):
+    spec = f"{base}...{head}" if three_dot else f"{base}..{head}"
+    if base == EMPTY_TREE:
+        spec = [base, head]
+    cmd = ["git", "diff", "--raw", "-p", "-U0", "--no-color", "--no-ext-diff", "--no-renames"]
+    return safe_sh(cmd + (spec if isinstance(spec, list) else [spec]))
+
+def diff_range(base, head, three_dot):
+    """((changed files, hunks), three_dot actually used) with the fewest git calls, or (None, three_dot)."""
+    r = git_diff(base, head, three_dot)
+    if r.returncode != 0 and ensure_commit(base):
+        r = git_diff(base, head, three_dot)
+    if r.returncode != 0 and three_dot:
+        # sin merge-base (historia superficial): diff directo
+        three_dot = False
+        r = git_diff(base, head, False)
+    if r.returncode != 0:
+        return None, three_dot
+    return parse_diff(r.stdout), three_dot
+
+def cache_path(base, head, three_dot):
+    return pathlib.Path(CACHE_DIR) / f"v{CACHE_VERSION}_{base}{'...' if three_dot else '..'}{head}.json"
+
+def cached_diff(base, head, three_dot):
+    # (base_sha, head_sha, modo) inmutables ⇒ el resultado también
+    cacheable = is_sha(base) and is_sha(head)
+    path = cache_path(base, head, three_dot)
+    if cacheable and path.exists():
+        data = json.loads(path.read_text())
+        os.utime(path)
+        return data["changed"], data["hunks"]
+    result, used_three_dot = diff_range(base, head, three_dot)
+    # un diff directo por falta de merge-base no es el resultado de base...head: no se memoiza
+    if result is not None and cacheable and used_three_dot == three_dot:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({"changed": result[0], "hunks": result[1]}))
+        entries = sorted(path.parent.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+        for stale in entries[CACHE_MAX:]:
+            stale.unlink(missing_ok=True)
+    return result
+
+def get_changed_range():
+    """(changed files, hunks, base, head) of the first candidate range with changes; base None if none."""
+    for base, head, three_dot in resolve_ranges(load_event()):
+        if not is_sha(head) or not is_sha(base):
+            # refs simbólicas (HEAD, HEAD~1…) → SHAs, en una sola llamada
+            r = safe_sh(["git", "rev-parse", head, base])
+            if r.returncode == 0:
+                head, base = r.stdout.split()
+        result = cached_diff(base, head, three_dot)
+        if result is None:
+            continue
+        changed, hunks = result
         if changed:
-            return changed
+            return changed, hunks, (None if base == EMPTY_TREE else base), head
+    return [], {}, None, head
 
-    # 4) Último recurso: nada
-    return []
+def get_changed_files():
+    return get_changed_range()[0]
 
 def main():
     # Permitir override manual
     env = os.getenv('CHANGED_FILES')
+    hunks, base, head = {}, None, None
     if env:
         changed = [s.strip() for s in env.split(',') if s.strip()]
     else:
-        changed = get_changed_files()
+        changed, hunks, base, head = get_changed_range()
 
     print("Changed files (all):", changed)
     changed_app = [f for f in changed if f.startswith(APP_PREFIX)]
     print("Changed files (app/ only):", changed_app)
 
+    # Rangos de líneas del diff (lado base) para la selección por nodo (ci/coverage_map.py)
+    data = {
+        'base': base,
+        'head': head,
+        'files': changed_app,
+        'hunks': {p: r for p, r in hunks.items() if p in changed_app},
+    }
     with open('files/changed_files.json', 'w') as f:
-        json.dump(changed_app, f, indent=2)
+        json.dump(data, f, indent=2)
+    return data
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,212 @@
+# ci/coverage_map.py
+"""Per-test-node line coverage map and node-level test selection.
+
+Recording is a pytest plugin: every test (setup + call + teardown) runs under
+a ``sys.settrace`` tracer that only follows frames in ``COVERAGE_ROOTS``. The
+map stores, per source file, its git blob id and the executed line ranges of
+each node ID:
+
+    pytest -p coverage_map --coverage-map files/coverage_map.json tests/
+
+Selection intersects the map with the diff hunks of the changed files (old
+side, i.e. line numbers of the base revision the map was recorded on).
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+COVERAGE_MAP_PATH = os.getenv('COVERAGE_MAP_PATH', 'files/coverage_map.json')
+COVERAGE_ROOTS = tuple(r.strip() for r in os.getenv('COVERAGE_ROOTS', 'app').split(',') if r.strip())
+MAP_VERSION = 1
+
+
+def git_blob_id(data):
+    """Same id as ``git hash-object``: lets the map be checked against any revision."""
+    import hashlib
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
+
+
+def executable_lines(source):
+    lines, stack = set(), [compile(source, '<map>', 'exec')]
+    while stack:
+        code = stack.pop()
+        lines.update(ln for _, _, ln in code.co_lines() if ln is not None)
+        stack.extend(c for c in code.co_consts if hasattr(c, 'co_lines'))
+    return lines
+
+
+def to_ranges(hit, executable):
+    """Executed lines → ``[[start, end], ...]``; gaps made only of non-code lines are bridged."""
+    ranges = []
+    for ln in sorted(hit):
+        if ranges and all(g not in executable for g in range(ranges[-1][1] + 1, ln)):
+            ranges[-1][1] = ln
+        else:
+            ranges.append([ln, ln])
+    return ranges
+
+
+class CoverageRecorder:
+    def __init__(self, roots=COVERAGE_ROOTS, rootdir='.'):
+        self.rootdir = Path(rootdir).resolve()
+        self.roots = [(self.rootdir / r).as_posix().rstrip('/') + '/' for r in roots]
+        self._rel = {}          # co_filename → repo-relative path, or None when not tracked
+        self.current = None     # set of (path, line) for the running node
+        self.nodes = {}         # node id → set of (path, line)
+
+    def _relpath(self, filename):
+        rel = self._rel.get(filename, False)
+        if rel is False:
+            absolute = Path(filename).resolve().as_posix() if filename and not filename.startswith('<') else ''
+            rel = None
+            if any(absolute.startswith(r) for r in self.roots):
+                rel = Path(absolute).relative_to(self.rootdir).as_posix()
+            self._rel[filename] = rel
+        return rel
+
+    def _trace(self, frame, event, arg):
+        # global tracer: only called on 'call'; returns a local tracer for tracked files only
+        rel = self._relpath(frame.f_code.co_filename)
+        if rel is None:
+            return None
+        hits = self.current
+        hits.add((rel, frame.f_lineno))
+
+        def local(frame, event, arg):
+            if event == 'line':
+                hits.add((rel, frame.f_lineno))
+            return local
+        return local
+
+    def start(self, nodeid):
+        self.current = self.nodes.setdefault(nodeid, set())
+        threading.settrace(self._trace)
+        sys.settrace(self._trace)
+
+    def stop(self):
+        sys.settrace(None)
+        threading.settrace(None)
+        self.current = None
+
+    def build_map(self):
+        nodes = sorted(self.nodes)
+        per_file = {}
+        for i, nodeid in enumerate(nodes):
+            by_file = {}
+            for path, line in self.nodes[nodeid]:
+                by_file.setdefault(path, set()).add(line)
+            for path, lines in by_file.items():
+                per_file.setdefault(path, {})[i] = lines
+        files = {}
+        for path, node_lines in sorted(per_file.items()):
+            data = (self.rootdir / path).read_bytes()
+            executable = executable_lines(data)
+            files[path] = {
+                'blob': git_blob_id(data),
+                'nodes': {str(i): to_ranges(lines, executable) for i, lines in sorted(node_lines.items())},
+            }
+        return {'version': MAP_VERSION, 'roots': list(COVERAGE_ROOTS), 'nodes': nodes, 'files': files}
+
+
+# ---- pytest plugin --------------------------------------------------------
+
+def pytest_addoption(parser):
+    parser.addoption('--coverage-map', default=None, metavar='PATH',
+                     help='record per-test-node line coverage of COVERAGE_ROOTS into PATH')
+
+
+def pytest_configure(config):
+    path = config.getoption('--coverage-map')
+    if path:
+        config._coverage_map = (path, CoverageRecorder(rootdir=config.rootpath))
+
+
+def _recorder(item):
+    entry = getattr(item.config, '_coverage_map', None)
+    return entry[1] if entry else None
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_protocol(item, nextitem):
+    recorder = _recorder(item)
+    if recorder is None:
+        yield
+        return
+    recorder.start(item.nodeid)
+    try:
+        yield
+    finally:
+        recorder.stop()
+
+
+def pytest_sessionfinish(session, exitstatus):
+    entry = getattr(session.config, '_coverage_map', None)
+    if not entry:
+        return
+    path, recorder = entry
+    cov_map = recorder.build_map()
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(cov_map, f, separators=(',', ':'))
+    print(f"\nCoverage map: {len(cov_map['nodes'])} nodes, {len(cov_map['files'])} files → {path}")
+
+
+# ---- selection -------------------------------------------------------------
+
+def load_map(path=COVERAGE_MAP_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        cov_map = json.load(f)
+    return cov_map if cov_map.get('version') == MAP_VERSION else None
+
+
+def base_blobs(base, paths):
+    """Blob id of each path at revision ``base`` (one ``git ls-tree`` call)."""
+    r = subprocess.run(['git', 'ls-tree', '-r', base, '--', *paths], text=True,
+                       stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    blobs = {}
+    for line in r.stdout.splitlines():
+        meta, _, path = line.partition('\t')
+        blobs[path] = meta.split()[2]
+    return blobs
+
+
+def _overlaps(ranges, hunk):
+    return any(s <= hunk[1] and hunk[0] <= e for s, e in ranges)
+
+
+def select_nodes(test_files, hunks, cov_map, blobs):
+    """Node IDs of ``test_files`` that execute a changed line, or None if the map cannot tell.
+
+    ``hunks`` maps changed files to old-side line ranges; ``blobs`` maps them to their
+    blob id at the base revision. None (⇒ run whole files) when a changed file is not in
+    the map or the map was recorded on other content, or when a hunk touches lines no test
+    executes (module-level code). Test files with no covering node run whole.
+    """
+    if not cov_map or not hunks:
+        return None
+    hit = set()
+    for path, ranges in hunks.items():
+        entry = cov_map['files'].get(path)
+        if entry is None or entry['blob'] != blobs.get(path):
+            return None
+        for hunk in ranges:
+            covering = {int(i) for i, node_ranges in entry['nodes'].items() if _overlaps(node_ranges, hunk)}
+            if not covering:
+                return None
+            hit |= covering
+
+    by_file = {}
+    for i in hit:
+        nodeid = cov_map['nodes'][i]
+        by_file.setdefault(nodeid.split('::', 1)[0], []).append(nodeid)
+    selected = []
+    for test_file in test_files:
+        selected.extend(sorted(by_file.get(test_file, [test_file])))
+    return selected
@@ -0,0 +1,188 @@
+# ci/diagnose_async.py
+"""Per-failure LLM diagnosis: concurrent, bounded in time, never blocking CI.
+
+Every failing/erroring test case of ``files/report.xml`` is diagnosed on its
+own. Cases with the same normalized traceback (``ci/diagnosis_cache.py``) share
+one request, and cached diagnoses are served without one. The rest run through
+``AsyncOpenAI`` with at most ``LLM_CONCURRENCY`` requests in flight. Each
+attempt is cut at ``LLM_TIMEOUT_S``. Timeouts, connection errors, 429 and 5xx
+are retried up to ``LLM_RETRIES`` times with jittered exponential backoff
+(``LLM_BACKOFF_S``, doubled each attempt). Whatever is unfinished when
+``LLM_DEADLINE_S`` expires is cancelled and falls back to the rules. So do
+failed requests and cases beyond ``LLM_MAX_CASES``.
+
+``OPENAI_BASE_URL`` points the client at another OpenAI-compatible backend,
+e.g. the offline stub in ``ci/llm_stub_server.py``.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+
+from diagnosis_cache import traceback_signature
+from junit_report import iter_cases
+from log_condenser import CHARS_PER_TOKEN, TOKEN_BUDGET
+
+CONCURRENCY = int(os.getenv('LLM_CONCURRENCY', '4'))
+TIMEOUT_S = float(os.getenv('LLM_TIMEOUT_S', '20'))
+RETRIES = int(os.getenv('LLM_RETRIES', '2'))
+BACKOFF_S = float(os.getenv('LLM_BACKOFF_S', '0.5'))
+DEADLINE_S = float(os.getenv('LLM_DEADLINE_S', '60'))
+MAX_CASES = int(os.getenv('LLM_MAX_CASES', '20'))
+CASES_PATH = 'files/diagnosis_cases.json'
+
+
+def failing_cases(report_path):
+    """[{nodeid, name, kind, message, text}] for the failed/errored test cases of a JUnit report."""
+    return [
+        {'nodeid': c['nodeid'], 'name': c['name'], 'kind': c['outcome'], 'message': c['message'],
+         'text': c['traceback'] or c['message']}
+        for c in iter_cases(report_path, traceback_chars=TOKEN_BUDGET * CHARS_PER_TOKEN)
+        if c['outcome'] in ('failure', 'error')
+    ]
+
+
+def case_prompt(case):
+    limit = TOKEN_BUDGET * CHARS_PER_TOKEN
+    # el final del traceback (líneas E, excepción) es lo que más informa
+    text = case['text'] if len(case['text']) <= limit else '...\n' + case['text'][-limit:]
+    return f"""You are a senior DevOps assistant. Diagnose this single failing pytest test and suggest the next step.
+- Keep it under 60 words.
+- Bullet points preferred.
+- If you see arithmetic mistakes in discounts, mention checking percentage math.
+
+Test: {case['nodeid']} ({case['kind']})
+Traceback:
+{text}
+"""
+
+
+def case_key(case, context=''):
+    sig = traceback_signature(case['text'].splitlines(), case['name'])
+    return hashlib.sha256(f'{context}\n{sig}'.encode()).hexdigest()[:32]
+
+
+def retryable(exc):
+    if isinstance(exc, asyncio.TimeoutError):
+        return True
+    status = getattr(exc, 'status_code', None)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    return type(exc).__name__ in ('APIConnectionError', 'APITimeoutError')
+
+
+async def ask(client, model, prompt, sem, timeout=TIMEOUT_S, retries=RETRIES, backoff=BACKOFF_S):
+    """(answer, attempts, seconds) for one prompt; raises the last error when retries run out."""
+    t0 = time.perf_counter()
+    for attempt in range(retries + 1):
+        async with sem:  # el hueco se libera durante el backoff
+            try:
+                resp = await asyncio.wait_for(client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {'role': 'system', 'content': 'You are a concise DevOps incident diagnostician.'},
+                        {'role': 'user', 'content': prompt},
+                    ],
+                    temperature=0.2,
+                    max_tokens=160,
+                ), timeout)
+                return resp.choices[0].message.content.strip(), attempt + 1, time.perf_counter() - t0
+            except Exception as e:
+                if attempt == retries or not retryable(e):
+                    raise
+        await asyncio.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+async def diagnose_cases(cases, model, fallback, cache=None, context='', api_key=None,
+                         concurrency=CONCURRENCY, deadline=DEADLINE_S, max_cases=MAX_CASES,
+                         timeout=TIMEOUT_S, retries=RETRIES, backoff=BACKOFF_S):
+    """One result dict per case: ``status`` is ``llm``, ``cached`` or ``rules`` (with a ``reason``)."""
+    t0 = time.perf_counter()
+    groups = {}
+    for case in cases:
+        groups.setdefault(case_key(case, context), []).append(case)
+
+    outcome, todo = {}, []
+    for key, group in groups.items():
+        entry = cache.get(key) if cache else None
+        if entry:
+            outcome[key] = {'status': 'cached', 'diagnosis': entry['diagnosis']}
+        elif not api_key:
+            outcome[key] = {'status': 'rules', 'reason': 'no OPENAI_API_KEY'}
+        elif len(todo) >= max_cases:
+            outcome[key] = {'status': 'rules', 'reason': 'over LLM_MAX_CASES'}
+        else:
+            todo.append(key)
+
+    if todo:
+        from openai import AsyncOpenAI
+
+        sem = asyncio.Semaphore(concurrency)
+        # reintentos y timeouts propios: el cliente no reintenta por su cuenta
+        async with AsyncOpenAI(api_key=api_key, max_retries=0, timeout=timeout) as client:
+            tasks = {asyncio.create_task(ask(client, model, case_prompt(groups[key][0]), sem,
+                                             timeout, retries, backoff)): key
+                     for key in todo}
+            # el plazo cuenta desde el principio (import del SDK incluido)
+            done, pending = await asyncio.wait(tasks, timeout=max(deadline - (time.perf_counter() - t0), 0))
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        for task, key in tasks.items():
+            if task in pending:
+                outcome[key] = {'status': 'rules', 'reason': 'deadline'}
+            elif task.exception() is not None:
+                e = task.exception()
+                outcome[key] = {'status': 'rules', 'reason': f"{type(e).__name__}{f': {e}' if str(e) else ''}"[:200]}
+            else:
+                answer, attempts, seconds = task.result()
+                outcome[key] = {'status': 'llm', 'diagnosis': answer, 'attempts': attempts,
+                                'seconds': round(seconds, 3)}
+                if cache:
+                    cache.put(key, answer, model=model)
+
+    results = []
+    for key, group in groups.items():
+        for case in group:
+            result = {'nodeid': case['nodeid'], 'key': key, **outcome[key]}
+            if result['status'] == 'rules':
+                result['diagnosis'] = fallback(case['text'])
+            results.append(result)
+    return results
+
+
+def run(report_path, model, fallback, cache=None, context='', api_key=None):
+    """Synchronous entry point: diagnose every failing case of ``report_path``; writes ``CASES_PATH``."""
+    cases = failing_cases(report_path)
+    if not cases:
+        return []
+    t0 = time.perf_counter()
+    results = asyncio.run(diagnose_cases(cases, model, fallback, cache, context, api_key))
+    with open(CASES_PATH, 'w') as f:
+        json.dump({'elapsed_s': round(time.perf_counter() - t0, 3), 'cases': results}, f, indent=2)
+    return results
+
+
+def format_results(results):
+    """Markdown, one section per distinct failure (cases with the same signature are listed together)."""
+    groups = {}
+    for r in results:
+        # el fallback de reglas depende del texto de cada caso: sólo se agrupan LLM/caché
+        groups.setdefault(r['key'] if r['status'] != 'rules' else (r['key'], r['nodeid']), []).append(r)
+    blocks = []
+    for group in groups.values():
+        r = group[0]
+        if r['status'] == 'llm':
+            how = f"LLM, {r['seconds']:.2f} s, {r['attempts']} attempt{'s' if r['attempts'] > 1 else ''}"
+        elif r['status'] == 'cached':
+            how = 'cached'
+        else:
+            how = f"rules — {r['reason']}"
+        also = ''
+        if len(group) > 1:
+            names = ', '.join(g['nodeid'].split('::')[-1] for g in group[1:4])
+            also = f"\n_Same failure in {len(group) - 1} more: {names}{'…' if len(group) > 4 else ''}_"
+        blocks.append(f"### {r['nodeid']} ({how}){also}\n{r['diagnosis']}")
+    return '\n\n'.join(blocks)
@@ -1,46 +1,46 @@
+import io
 import json
 import os
 import re
+import time
 from pathlib import Path
-import xml.etree.ElementTree as ET
-
-
-def simple_rules_based_summary(log_text: str) -> str:
-    lines = log_text.lower().splitlines()
-    hints = []
-    if 'assert' in log_text.lower():
-        hints.append('- Parece un fallo de aserción: revisa la expectativa del test vs el cálculo real.')
-    if 'importerror' in log_text.lower() or 'module not found' in log_text.lower():
-        hints.append('- Error de importación: dependencia o ruta faltante.')
-    if 'connection' in log_text.lower() and 'refused' in log_text.lower():
-        hints.append('- Error de conexión: revisa variables de entorno y puertos abiertos.')
-    if 'timeout' in log_text.lower():
-        hints.append('- Timeout: prioriza retry/backoff o sube límites de tiempo.')
-    # Look for our demo payment function
-    if 'test_payment' in log_text.lower():
-        hints.append('- Los fallos provienen de test_payment: revisa cálculo de descuentos en app/payment.py (posible bug intencional para demo).')
-    return "\n".join(hints) if hints else "- No se detectaron patrones comunes; revisa el log y el diff del commit."
-
-def make_prompt(log_text: str) -> str:
+
+import diagnose_async
+from diagnosis_cache import DiagnosisCache, run_key
+from junit_report import summarize
+from log_condenser import extract_failures_file, pack
+from log_rules import RuleSet, load_rules
+
+RULE_HITS_PATH = 'files/rule_hits.json'
+LLM_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+LLM_ASYNC = os.getenv('LLM_ASYNC', '0') == '1'
+
+
+def simple_rules_based_summary(log_text: str, ruleset=None) -> str:
+    """Rule hints (ci/log_rules.py) for a log or one failure's traceback."""
+    ruleset = ruleset or RuleSet(load_rules())
+    return ruleset.summary(ruleset.scan(io.BytesIO(log_text.encode('utf-8', errors='ignore'))))
+
+def make_prompt(log_excerpt: str) -> str:
     return f"""You are a senior DevOps assistant. Read the following pytest log and produce a concise root-cause analysis and next steps.
 - Keep it under 120 words.
 - Bullet points preferred.
 - If you see arithmetic mistakes in discounts, mention checking percentage math.
 
-Pytest log:
-{log_text[:8000]}
+Pytest failures (condensed log):
+{log_excerpt}
 """
 
-def diagnose_with_llm(log_text: str) -> str:
+def diagnose_with_llm(log_excerpt: str) -> str:
     api_key = os.getenv('OPENAI_API_KEY')
     if not api_key:
         return None
     try:
         from openai import OpenAI
-        client = OpenAI(api_key=api_key)
-        prompt = make_prompt(log_text)
+        client = OpenAI(api_key=api_key, timeout=diagnose_async.TIMEOUT_S, max_retries=diagnose_async.RETRIES)
+        prompt = make_prompt(log_excerpt)
         resp = client.chat.completions.create(
-            model=os.getenv('OPENAI_MODEL', 'gpt-4o-mini'),
+            model=LLM_MODEL,
             messages=[
                 { 'role': 'system', 'content': 'You are a concise DevOps incident diagnostician.'},
                 { 'role': 'user', 'content': prompt}
@@ -52,23 +52,42 @@ def diagnose_with_llm(log_text: str) -> str:
     except Exception as e:
         return f"[LLM call failed, falling back to rules] {e}"
 
+def diagnose_whole_log(log_path, cache):
+    """One diagnosis for the condensed log, served from ``cache`` when the failure signature is known."""
+    blocks, stray, result = extract_failures_file(log_path)
+    key = run_key(blocks, stray, context=f'{LLM_MODEL}\n{make_prompt("")}')
+    entry = cache.get(key) if key else None
+    if entry:
+        llm = entry['diagnosis']
+        print(f"Diagnosis cache hit {key} ({(time.time() - entry['created_at']) / 3600:.1f} h old)")
+    elif os.getenv('OPENAI_API_KEY'):
+        # al LLM sólo le llegan las secciones de fallos condensadas; las reglas leen el log en streaming
+        llm = diagnose_with_llm(pack(blocks, stray, result))
+        if key and llm and not llm.startswith('[LLM call failed'):
+            cache.put(key, llm, model=LLM_MODEL)
+    else:
+        llm = None
+    cache.write_stats(key=key, hit=entry is not None)
+    return llm
+
+def diagnose_per_failure(report_path, cache):
+    """One diagnosis per failing test (ci/diagnose_async.py); None when neither LLM nor cache served any."""
+    ruleset = RuleSet(load_rules())
+    empty_case = {'nodeid': '', 'kind': '', 'text': ''}
+    results = diagnose_async.run(
+        report_path, LLM_MODEL, lambda text: simple_rules_based_summary(text, ruleset), cache,
+        context=f'{LLM_MODEL}\n{diagnose_async.case_prompt(empty_case)}', api_key=os.getenv('OPENAI_API_KEY'))
+    served = [r for r in results if r['status'] != 'rules']
+    print(f"Per-failure diagnosis: {len(served)}/{len(results)} cases from LLM or cache")
+    cache.write_stats(mode='per-failure', cases=len(results))
+    return diagnose_async.format_results(results) if served else None
+
 def junit_failures_errors(report_path: str) -> tuple[int,int,int]:
     if not os.path.exists(report_path):
         return (0, 0, -1)  # sin reporte
-    tree = ET.parse(report_path)
-    root = tree.getroot()
-    # maneja <testsuite> o <testsuites>
-    if root.tag == "testsuite":
-        tests = int(root.attrib.get("tests", "0"))
-        failures = int(root.attrib.get("failures", "0"))
-        errors = int(root.attrib.get("errors", "0"))
-        return (failures, errors, tests)
-    totals = [0,0,0]
-    for ts in root.iter("testsuite"):
-        totals[0] += int(ts.attrib.get("failures", "0"))
-        totals[1] += int(ts.attrib.get("errors", "0"))
-        totals[2] += int(ts.attrib.get("tests", "0"))
-    return tuple(totals)
+    # lectura en streaming: el report de una ejecución con shards puede pesar cientos de MB
+    totals = summarize(report_path, traceback_chars=0, max_failures=0)
+    return (totals['failures'], totals['errors'], totals['tests'])
 
 
 def main():
@@ -92,13 +111,20 @@ def main():
         print('No pytest_output.log found; nothing to diagnose.')
         return
 
-    log_text = log_path.read_text(encoding='utf-8', errors='ignore')
-    llm = diagnose_with_llm(log_text)
-    if llm is None or llm.startswith('[LLM call failed'):
-        rules = simple_rules_based_summary(log_text)
-        summary = f"LLM unavailable → Rules-based diagnosis:\n{rules}" if llm is None else f"{llm}\n\nRules-based addendum:\n{rules}"
+    cache = DiagnosisCache()
+    if LLM_ASYNC and os.path.exists('files/report.xml'):
+        llm = diagnose_per_failure('files/report.xml', cache)
+    else:
+        llm = diagnose_whole_log(log_path, cache)
+    # el log completo se lee en streaming, sin cargarlo en memoria; aciertos por regla para inspección
+    ruleset = RuleSet(load_rules())
+    matches = ruleset.scan_file(log_path)
+    with open(RULE_HITS_PATH, 'w') as f:
+        json.dump(matches, f, indent=2)
+    rules = ruleset.summary(matches)
+    if llm is None:
+        summary = f"LLM unavailable → Rules-based diagnosis:\n{rules}"
     else:
-        rules = simple_rules_based_summary(log_text)
         summary = f"{llm}\n\nRules-based addendum:\n{rules}"
 
     print('=== Failure Diagnosis ===')
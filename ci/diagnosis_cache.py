@@ -0,0 +1,138 @@
+# ci/diagnosis_cache.py
+"""Local cache of LLM diagnoses, keyed on a normalized failure signature.
+
+Each failure's traceback (``ci/log_condenser.py``) is normalized: test name,
+parametrize values, line numbers, memory addresses, timestamps, temporary
+paths and the durations pytest itself prints (``... in 1.23s`` result lines and
+``--durations`` rows) are stripped; numbers in assertion messages are kept. The signatures of all failures of a run, sorted,
+plus the model and the prompt template, are hashed into the cache key, so the
+same assertion failing on the next push is served from disk instead of
+calling the API again.
+
+Entries expire after ``DIAGNOSIS_CACHE_TTL_H`` hours and are evicted
+least-recently-used first beyond ``DIAGNOSIS_CACHE_MAX``. Hit/miss counters
+(this run and cumulative) are written to ``files/diagnosis_cache.json``.
+"""
+import hashlib
+import json
+import os
+import re
+import time
+from itertools import dropwhile
+from pathlib import Path
+
+from log_condenser import CAPTURED, PARAM_LINE
+
+CACHE_DIR = os.getenv('DIAGNOSIS_CACHE_DIR', '.cache/ai-ci/diagnosis')
+TTL_S = float(os.getenv('DIAGNOSIS_CACHE_TTL_H', '168')) * 3600
+MAX_ENTRIES = int(os.getenv('DIAGNOSIS_CACHE_MAX', '500'))
+STATS_PATH = 'files/diagnosis_cache.json'
+
+# orden importa: rutas temporales y timestamps antes que los números de línea
+NORMALIZE = [
+    (re.compile(r'(?:/private)?/(?:tmp|var/folders|var/tmp)/\S*|[A-Za-z]:\\[^\s]*\\Temp\\\S*'), '<tmp>'),
+    (re.compile(r'pytest-of-[^/\s]+/pytest-\d+/\S*'), '<tmp>'),
+    (re.compile(r'\btmp[a-z0-9_]{6,}\b'), '<tmp>'),
+    (re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?'), '<ts>'),
+    (re.compile(r'\b\d{2}:\d{2}:\d{2}(?:[.,]\d+)?\b'), '<time>'),
+    # sólo las duraciones que escribe pytest: "3 failed, 1 passed in 1.23s (0:00:01)" y filas de --durations
+    (re.compile(r'(?m)^(=*\s*\d+ (?:failed|passed|errors?|skipped|xfailed|xpassed|deselected|warnings?)\b.*? in )'
+                r'\d+(?:\.\d+)?s\b(?: \([^)]*\))?'), r'\1<dur>'),
+    (re.compile(r'(?m)^\d+(?:\.\d+)?s(?=\s+(?:setup|call|teardown)\s)'), '<dur>'),
+    (re.compile(r'0x[0-9a-fA-F]+'), '0x?'),
+    (re.compile(r'(\.py):\d+'), r'\1:N'),
+    (re.compile(r'\bline \d+'), 'line N'),
+]
+
+
+def normalize(text):
+    for pattern, repl in NORMALIZE:
+        text = pattern.sub(repl, text)
+    return text
+
+
+def traceback_signature(lines, name=''):
+    """sha1 of a normalized traceback given as lines (leading parametrize values dropped)."""
+    lines = dropwhile(lambda ln: not ln.strip() or PARAM_LINE.match(ln), lines)
+    body = '\n'.join(ln.rstrip() for ln in lines if ln.strip())
+    if name:
+        body = body.replace(name, '<test>')
+    return hashlib.sha1(normalize(body).encode()).hexdigest()
+
+
+def failure_signature(failure):
+    """Signature of one ``log_condenser.Failure`` (captured output excluded)."""
+    end = next((i for i, ln in enumerate(failure.lines) if CAPTURED.match(ln)), len(failure.lines))
+    return traceback_signature(failure.lines[:end], failure.name)
+
+
+def run_key(failures, stray=(), context=''):
+    """Cache key of a run: its distinct failure signatures (order-independent) plus ``context``.
+
+    None when the log has nothing to sign (no failure blocks, no ``E`` lines).
+    """
+    sigs = sorted({failure_signature(f) for f in failures})
+    if not sigs and not stray:
+        return None
+    h = hashlib.sha256(context.encode())
+    for sig in sigs:
+        h.update(sig.encode())
+    for line in sorted(set(stray)):
+        h.update(normalize(line).encode())
+    return h.hexdigest()[:32]
+
+
+class DiagnosisCache:
+    def __init__(self, cache_dir=CACHE_DIR, ttl_s=TTL_S, max_entries=MAX_ENTRIES):
+        self.dir = Path(cache_dir)
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.hits = self.misses = self.expired = 0
+
+    def get(self, key):
+        """Cached diagnosis entry for ``key`` or None (missing or older than the TTL)."""
+        path = self.dir / f'{key}.json'
+        try:
+            entry = json.loads(path.read_text())
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        if time.time() - entry.get('created_at', 0) > self.ttl_s:
+            path.unlink(missing_ok=True)
+            self.expired += 1
+            self.misses += 1
+            return None
+        os.utime(path)  # LRU
+        self.hits += 1
+        return entry
+
+    def put(self, key, diagnosis, **meta):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.dir / f'.{key}.{os.getpid()}.tmp'
+        tmp.write_text(json.dumps({'diagnosis': diagnosis, 'created_at': time.time(), **meta}))
+        os.replace(tmp, self.dir / f'{key}.json')
+        self.evict()
+
+    def evict(self):
+        entries = sorted(self.dir.glob('[0-9a-f]*.json'),  # stats.json no es una entrada
+                         key=lambda p: p.stat().st_mtime, reverse=True)
+        for path in entries[self.max_entries:]:
+            path.unlink(missing_ok=True)
+        return max(len(entries) - self.max_entries, 0)
+
+    def write_stats(self, path=STATS_PATH, **extra):
+        """Write this run's counters and the cumulative ones (kept in the cache dir) to ``path``."""
+        totals_path = self.dir / 'stats.json'
+        try:
+            totals = json.loads(totals_path.read_text())
+        except (OSError, ValueError):
+            totals = {'hits': 0, 'misses': 0, 'expired': 0}
+        for k in totals:
+            totals[k] += getattr(self, k)
+        if self.hits or self.misses:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            totals_path.write_text(json.dumps(totals))
+        stats = {'hits': self.hits, 'misses': self.misses, 'expired': self.expired, 'total': totals, **extra}
+        with open(path, 'w') as f:
+            json.dump(stats, f, indent=2)
+        return stats
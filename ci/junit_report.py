@@ -0,0 +1,131 @@
+# ci/junit_report.py
+"""Streaming reader for the JUnit reports pytest writes (``files/report.xml``).
+
+``iterparse`` walks the file once and every ``<testcase>`` is removed from its
+parent as soon as it has been read. Memory stays constant however many cases a
+sharded run merged into the report. Each case becomes a dict::
+
+    {'nodeid', 'file', 'classname', 'name', 'time',
+     'outcome': 'passed' | 'failure' | 'error' | 'skipped',
+     'message', 'traceback', 'skip_type'}
+
+where ``traceback`` is the failure/error text cut to ``JUNIT_TRACEBACK_CHARS``
+(head and tail kept). Shared by the diagnosis step, the timing history and the
+test result cache. The history store (ml/history_store.py) does not parse the
+report: ``write_cases`` hands it the outcomes as JSON Lines in ``CASES_PATH``.
+"""
+import json
+import os
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+TRACEBACK_CHARS = int(os.getenv('JUNIT_TRACEBACK_CHARS', '4000'))
+OUTCOME_TAGS = ('failure', 'error', 'skipped')
+# outcomes of the last run for ml/history_store.py
+CASES_PATH = os.getenv('TEST_CASES_PATH', 'files/test_cases.jsonl')
+
+
+def classname_to_file(classname, root='.'):
+    """``tests.test_payment`` / ``tests.test_payment.TestX`` -> ``tests/test_payment.py``."""
+    parts = classname.split('.')
+    for end in range(len(parts), 0, -1):
+        candidate = '/'.join(parts[:end]) + '.py'
+        if (Path(root) / candidate).exists():
+            return candidate
+    return '/'.join(parts) + '.py'
+
+
+def truncate(text, limit=TRACEBACK_CHARS):
+    """Head and tail of ``text`` (the tail, with the ``E`` lines and the exception, gets 3/4).
+
+    ``limit=None`` keeps everything, ``0`` drops the text.
+    """
+    if limit is None or len(text) <= limit:
+        return text
+    if limit == 0:
+        return ''
+    head = limit // 4
+    return f'{text[:head]}\n... ({len(text) - limit} chars omitted) ...\n{text[-(limit - head):]}'
+
+
+def case_record(case, file_cache, traceback_chars=TRACEBACK_CHARS):
+    classname = case.get('classname', '')
+    test_file = case.get('file')
+    if not test_file:
+        if classname not in file_cache:
+            file_cache[classname] = classname_to_file(classname)
+        test_file = file_cache[classname]
+    name = case.get('name', '')
+    problem = next((c for c in case if c.tag in OUTCOME_TAGS), None)
+    return {
+        'nodeid': f'{test_file}::{name}',
+        'file': test_file,
+        'classname': classname,
+        'name': name,
+        'time': float(case.get('time', '0') or 0),
+        'outcome': problem.tag if problem is not None else 'passed',
+        'message': problem.get('message', '') if problem is not None else '',
+        'traceback': truncate(problem.text or '', traceback_chars) if problem is not None else '',
+        'skip_type': problem.get('type', '') if problem is not None and problem.tag == 'skipped' else '',
+    }
+
+
+def iter_report(report_path, traceback_chars=TRACEBACK_CHARS):
+    """Yield ``('suite', attrib)`` when a ``<testsuite>`` opens and ``('case', record)`` per test case."""
+    stack, file_cache = [], {}
+    for event, elem in ET.iterparse(report_path, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            if elem.tag == 'testsuite':
+                yield 'suite', dict(elem.attrib)
+            continue
+        stack.pop()
+        if elem.tag == 'testcase':
+            yield 'case', case_record(elem, file_cache, traceback_chars)
+            elem.clear()
+            if stack:
+                stack[-1].remove(elem)  # el padre no acumula testcases ya leídos
+        elif elem.tag in ('system-out', 'system-err', 'properties') and stack and stack[-1].tag == 'testsuite':
+            # salida del suite completo: también puede ser enorme
+            elem.clear()
+
+
+def iter_cases(report_path, traceback_chars=TRACEBACK_CHARS):
+    for kind, item in iter_report(report_path, traceback_chars):
+        if kind == 'case':
+            yield item
+
+
+def write_cases(report_path, cases_path=CASES_PATH):
+    """One ``{file, nodeid, outcome, time}`` line per case of ``report_path`` (empty when there is none)."""
+    Path(cases_path).parent.mkdir(parents=True, exist_ok=True)
+    tmp = f'{cases_path}.{os.getpid()}.tmp'
+    n = 0
+    with open(tmp, 'w') as f:
+        if os.path.exists(report_path):
+            for case in iter_cases(report_path, traceback_chars=0):
+                f.write(json.dumps({k: case[k] for k in ('file', 'nodeid', 'outcome', 'time')}) + '\n')
+                n += 1
+    os.replace(tmp, cases_path)
+    return n
+
+
+def summarize(report_path, traceback_chars=TRACEBACK_CHARS, max_failures=None):
+    """Totals and failed cases of a report in one pass.
+
+    ``tests/failures/errors/skipped`` come from the ``<testsuite>`` attributes like
+    pytest reports them (``cases`` counts the ``<testcase>`` elements actually
+    read); ``failed`` holds the failure/error records, at most ``max_failures``.
+    """
+    totals = {'tests': 0, 'failures': 0, 'errors': 0, 'skipped': 0, 'time': 0.0, 'cases': 0}
+    failed = []
+    for kind, item in iter_report(report_path, traceback_chars):
+        if kind == 'suite':
+            for key in ('tests', 'failures', 'errors', 'skipped'):
+                totals[key] += int(item.get(key, '0') or 0)
+            totals['time'] += float(item.get('time', '0') or 0)
+        else:
+            totals['cases'] += 1
+            if item['outcome'] in ('failure', 'error') and (max_failures is None or len(failed) < max_failures):
+                failed.append(item)
+    return {**totals, 'failed': failed}
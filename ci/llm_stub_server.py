@@ -0,0 +1,111 @@
+# ci/llm_stub_server.py
+"""Local OpenAI-compatible stub for testing LLM diagnosis offline.
+
+Serves ``POST /v1/chat/completions`` (and ``GET /v1/models``) with a canned
+answer built from the first ``E `` line of the prompt. Latency and failures are
+configurable so timeouts, retries and the global deadline can be exercised:
+
+    STUB_LATENCY_MS=800 STUB_FAIL_RATE=0.2 python ci/llm_stub_server.py &
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=stub LLM_ASYNC=1 python ci/diagnose_failure_llm.py
+
+- ``STUB_PORT`` (default ``8089``; ``0`` picks a free port, printed at startup)
+- ``STUB_LATENCY_MS`` / ``STUB_JITTER_MS``: response delay, uniform in latency ± jitter
+- ``STUB_FAIL_RATE``: fraction of requests answered with HTTP 500
+- ``STUB_RATE_LIMIT_RATE``: fraction answered with HTTP 429
+- ``STUB_HANG_RATE``: fraction that never answer within ``STUB_HANG_S`` (default 300 s)
+- ``STUB_SEED``: make the random draws reproducible
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PORT = int(os.getenv('STUB_PORT', '8089'))
+LATENCY_MS = float(os.getenv('STUB_LATENCY_MS', '200'))
+JITTER_MS = float(os.getenv('STUB_JITTER_MS', '0'))
+FAIL_RATE = float(os.getenv('STUB_FAIL_RATE', '0'))
+RATE_LIMIT_RATE = float(os.getenv('STUB_RATE_LIMIT_RATE', '0'))
+HANG_RATE = float(os.getenv('STUB_HANG_RATE', '0'))
+HANG_S = float(os.getenv('STUB_HANG_S', '300'))
+
+_rng = random.Random(os.getenv('STUB_SEED'))
+_rng_lock = threading.Lock()
+E_LINE = re.compile(r'^E\s+(.+)$', re.MULTILINE)
+
+
+def draw():
+    with _rng_lock:
+        return _rng.random(), _rng.uniform(-JITTER_MS, JITTER_MS)
+
+
+def canned_answer(prompt):
+    m = E_LINE.search(prompt)
+    cause = m.group(1).strip() if m else 'no assertion found in the prompt'
+    return f"- Stub diagnosis: `{cause[:200]}`\n- Check the expected value against the implementation."
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, fmt, *args):
+        if os.getenv('STUB_VERBOSE') == '1':
+            super().log_message(fmt, *args)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            return self.send_json(200, {'object': 'list', 'data': [{'id': 'stub', 'object': 'model'}]})
+        self.send_json(404, {'error': {'message': f'no route {self.path}'}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            return self.send_json(404, {'error': {'message': f'no route {self.path}'}})
+        roll, jitter = draw()
+        # un único sorteo reparte los modos de fallo: [cuelgue | 429 | 500 | ok]
+        if roll < HANG_RATE:
+            time.sleep(HANG_S)
+        time.sleep(max(LATENCY_MS + jitter, 0) / 1000)
+        if HANG_RATE <= roll < HANG_RATE + RATE_LIMIT_RATE:
+            return self.send_json(429, {'error': {'message': 'stub rate limit', 'type': 'rate_limit_exceeded'}})
+        if HANG_RATE + RATE_LIMIT_RATE <= roll < HANG_RATE + RATE_LIMIT_RATE + FAIL_RATE:
+            return self.send_json(500, {'error': {'message': 'stub failure', 'type': 'server_error'}})
+        prompt = '\n'.join(str(m.get('content', '')) for m in body.get('messages', []))
+        answer = canned_answer(prompt)
+        self.send_json(200, {
+            'id': f'chatcmpl-stub-{time.time_ns()}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'stub'),
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': answer}}],
+            'usage': {'prompt_tokens': len(prompt) // 4, 'completion_tokens': len(answer) // 4,
+                      'total_tokens': (len(prompt) + len(answer)) // 4},
+        })
+
+
+def serve(port=PORT):
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    print(f"LLM stub on http://127.0.0.1:{server.server_port}/v1 (latency {LATENCY_MS:.0f}±{JITTER_MS:.0f} ms, "
+          f"fail {FAIL_RATE:.0%}, 429 {RATE_LIMIT_RATE:.0%}, hang {HANG_RATE:.0%})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    serve()
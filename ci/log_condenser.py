@@ -0,0 +1,187 @@
+# ci/log_condenser.py
+"""Condense a pytest log into the fragments worth sending to an LLM.
+
+The log is streamed once. Only the ``FAILURES``/``ERRORS`` sections are kept
+(one block per ``____ test name ____`` header), plus ``E `` lines found
+anywhere else and the final result line. Blocks whose traceback is identical
+once memory addresses and the test name are ignored are merged, keeping the
+count and the names of the tests that produced them.
+
+``condense()`` packs the unique failures into ``LLM_PROMPT_TOKENS`` (about four
+characters per token): first the compact form of every failure, most frequent
+first (header, ``E `` lines and the ``file:line: Error`` location), then the
+full tracebacks and finally the tail of their captured output, while the
+budget allows.
+"""
+import hashlib
+import os
+import re
+from itertools import dropwhile
+
+TOKEN_BUDGET = int(os.getenv('LLM_PROMPT_TOKENS', '2000'))
+CHARS_PER_TOKEN = 4
+MAX_BLOCK_LINES = 400  # un traceback gigante no se guarda entero
+MAX_LINE_CHARS = 300
+CAPTURED_TAIL = 20
+
+SECTION = re.compile(r'^={3,} (.+?) ={3,}\s*$')
+TEST_HEADER = re.compile(r'^_{3,} (.+?) _{3,}\s*$')
+LOCATION = re.compile(r'^\S+:\d+: \w+')
+RESULT_LINE = re.compile(r'^=*\s*\d+ (failed|passed|error|errors|skipped)\b.* in [\d.]+s')
+ADDRESS = re.compile(r'0x[0-9a-fA-F]+')
+PARAM_LINE = re.compile(r'^\w+ = ')
+CAPTURED = re.compile(r'^-{3,} Captured .+ -{3,}\s*$')
+
+
+class Failure:
+    def __init__(self, name):
+        self.name = name
+        self.names = [name]
+        self.count = 1
+        self.lines = []
+        self.truncated = 0
+
+    def add(self, line):
+        if len(self.lines) < MAX_BLOCK_LINES:
+            self.lines.append(line if len(line) <= MAX_LINE_CHARS else line[:MAX_LINE_CHARS] + '…')
+        else:
+            self.truncated += 1
+
+    @property
+    def error_lines(self):
+        return [ln for ln in self.lines if ln.startswith('E ')]
+
+    @property
+    def location(self):
+        return next((ln for ln in reversed(self.lines) if LOCATION.match(ln)), '')
+
+    def signature(self):
+        """Traceback identity: the block without the test name, parametrize values or memory addresses."""
+        # pytest lista primero los argumentos de los tests parametrizados (``i = 3``)
+        lines = dropwhile(lambda ln: not ln.strip() or PARAM_LINE.match(ln), self.lines)
+        body = '\n'.join(lines).replace(self.name, '<test>')
+        return hashlib.sha1(ADDRESS.sub('0x?', body).encode()).hexdigest()
+
+    def header(self):
+        more = f" (x{self.count}, also {', '.join(self.names[1:4])}{'…' if self.count > 4 else ''})" if self.count > 1 else ''
+        return f'__ {self.name} __{more}'
+
+    def compact(self):
+        return '\n'.join([self.header()] + self.error_lines + ([self.location] if self.location else []))
+
+    def traceback(self):
+        end = next((i for i, ln in enumerate(self.lines) if CAPTURED.match(ln)), len(self.lines))
+        return '\n'.join([self.header()] + [ln for ln in self.lines[:end] if ln.strip()])
+
+    def full(self):
+        """Traceback plus the last ``CAPTURED_TAIL`` lines of captured output/logs."""
+        start = next((i for i, ln in enumerate(self.lines) if CAPTURED.match(ln)), None)
+        if start is None:
+            return self.traceback()
+        captured = [ln for ln in self.lines[start:] if ln.strip()]
+        skipped = len(captured) - CAPTURED_TAIL + self.truncated
+        return '\n'.join([self.traceback()] + ([f'... ({skipped} lines)'] if skipped > 0 else [])
+                         + captured[-CAPTURED_TAIL:])
+
+
+def extract_failures(lines):
+    """(unique failures in order of first appearance, stray ``E `` lines, result line) from log lines."""
+    unique, stray, result = {}, Failure('E lines outside FAILURES/ERRORS'), ''
+    section, current = None, None
+
+    def close():
+        if current is None:
+            return
+        key = current.signature()
+        if key in unique:
+            unique[key].count += 1
+            unique[key].names.append(current.name)
+        else:
+            unique[key] = current
+
+    for raw in lines:
+        # comprobaciones baratas por prefijo antes de cualquier regex: casi todas las líneas son ruido
+        first = raw[:1]
+        if first == '=':
+            m = SECTION.match(raw)
+            if m:
+                close()
+                current = None
+                section = m.group(1) if m.group(1) in ('FAILURES', 'ERRORS') else None
+                if RESULT_LINE.match(raw):
+                    result = raw.strip('=\n ')
+                continue
+        line = raw.rstrip('\n')
+        if section:
+            m = TEST_HEADER.match(line) if first == '_' else None
+            if m:
+                close()
+                current = Failure(m.group(1))
+            elif current is not None:
+                current.add(line)
+        elif first == 'E' and line.startswith('E '):
+            stray.add(line)
+        elif first.isdigit() and RESULT_LINE.match(line):
+            result = line.strip()
+    close()
+    failures = list(unique.values())
+    return failures, stray.lines, result
+
+
+def extract_failures_file(path):
+    with open(path, encoding='utf-8', errors='ignore') as f:
+        return extract_failures(f)
+
+
+def pack(failures, stray, result, budget=TOKEN_BUDGET):
+    """Fit the fragments into ``budget`` tokens, most frequent failures first; output keeps log order.
+
+    Every part counts with its blank-line separator, including the result line and the note on
+    omitted failures, so the text never exceeds ``budget * CHARS_PER_TOKEN`` characters.
+    """
+    limit = budget * CHARS_PER_TOKEN
+    result = result if len(result) + 2 <= limit else ''
+    used = len(result) + 2 if result else 0
+    # sitio para la nota de omitidos, con el número más largo posible
+    note = len(f'... {len(failures)} more distinct failures omitted') + 2
+    note = note if failures and used + note <= limit else 0
+    used += note
+    chosen = {}
+    by_weight = sorted(range(len(failures)), key=lambda i: -failures[i].count)
+    for level in ('compact', 'traceback', 'full'):
+        for i in by_weight:
+            text = getattr(failures[i], level)()
+            extra = len(text) - len(chosen[i]) if i in chosen else len(text) + 2
+            if used + extra <= limit:
+                chosen[i] = text
+                used += extra
+    omitted = len(failures) - len(chosen)
+    if not omitted:
+        used -= note
+    parts = [chosen[i] for i in sorted(chosen)]
+    if stray:
+        header = '__ E lines outside FAILURES/ERRORS __'
+        lines = []
+        used += len(header) + 2
+        for ln in dict.fromkeys(stray):  # E lines repetidas: una vez
+            if used + len(ln) + 1 > limit:
+                break
+            lines.append(ln)
+            used += len(ln) + 1
+        if lines:
+            parts.append('\n'.join([header] + lines))
+    if omitted and note:
+        parts.append(f'... {omitted} more distinct failures omitted')
+    if result:
+        parts.append(result)
+    return '\n\n'.join(parts)
+
+
+def condense(path, budget=TOKEN_BUDGET):
+    failures, stray, result = extract_failures_file(path)
+    return pack(failures, stray, result, budget)
+
+
+if __name__ == '__main__':
+    import sys
+    print(condense(sys.argv[1] if len(sys.argv) > 1 else 'files/pytest_output.log'))
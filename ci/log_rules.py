@@ -0,0 +1,161 @@
+# ci/log_rules.py
+"""Data-driven triage rules for pytest logs, matched in one streaming pass.
+
+Rules come from ``ci/diagnosis_rules.json`` plus any files listed in
+``DIAGNOSIS_RULES`` (comma-separated; a rule with an existing ``id`` replaces
+it, ``"enabled": false`` drops it). A rule has either ``any`` or ``all``
+patterns, never both: an ``any`` rule fires when a line matches one of them,
+an ``all`` rule when every pattern matched somewhere in the log. Patterns are
+case-insensitive regular expressions applied line by line (``^``/``$`` are
+the line's start and end).
+
+The log is read once, in blocks of whole lines, and never held in memory.
+All rules are compiled into one ``RuleSet``: plain-text patterns are searched
+with ``bytes.find`` over the lowercased block (C speed, no per-line Python
+work), the remaining ones with a single compiled alternation. Patterns with
+backreferences, named groups or inline global flags (``(?m)``) are searched
+on their own: inside the shared alternation their group numbers would point
+at another pattern's groups, and a global flag is only valid at the start.
+Line numbers are only computed for the lines that matched.
+"""
+import json
+import os
+import re
+from pathlib import Path
+
+DEFAULT_RULES = Path(__file__).resolve().parent / 'diagnosis_rules.json'
+EXTRA_RULES = [p.strip() for p in os.getenv('DIAGNOSIS_RULES', '').split(',') if p.strip()]
+MAX_FIRST_LINES = 3
+BLOCK_SIZE = 8 * 2**20
+REGEX_CHARS = set('.^$*+?{}[]\\|()')
+# \1…, (?P=name), (?P<name>…), (?(1)…): sólo tienen sentido en su propio patrón
+# (?i), (?m)…: flags globales, sólo válidos al principio de la expresión completa
+STANDALONE = re.compile(r'\\[1-9]|\(\?P[=<]|\(\?<[A-Za-z_]|\(\?\(|\(\?[aiLmsux]+\)')
+FLAGS = re.IGNORECASE | re.MULTILINE
+
+
+def check_rule(rule, source='rules'):
+    """Raise ``ValueError`` for a rule without patterns or with both ``any`` and ``all``."""
+    if not rule.get('any') and not rule.get('all'):
+        raise ValueError(f"{source}: rule {rule.get('id')!r} needs 'any' or 'all' patterns")
+    if rule.get('any') and rule.get('all'):
+        raise ValueError(f"{source}: rule {rule.get('id')!r} has both 'any' and 'all'; split it in two rules")
+
+
+def load_rules(paths=None):
+    """Rule dicts in file order; later files override earlier ones by ``id``."""
+    rules = {}
+    for path in [DEFAULT_RULES] + list(EXTRA_RULES if paths is None else paths):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        for rule in data.get('rules', []) if isinstance(data, dict) else data:
+            rules.pop(rule['id'], None)
+            if not rule.get('enabled', True):
+                continue
+            check_rule(rule, path)
+            rules[rule['id']] = rule
+    return list(rules.values())
+
+
+def compile_pattern(pattern):
+    try:
+        return re.compile(pattern.encode(), FLAGS)
+    except re.error as e:
+        raise ValueError(f'invalid rule pattern {pattern!r}: {e}') from None
+
+
+class RuleSet:
+    def __init__(self, rules):
+        for rule in rules:
+            check_rule(rule)
+        self.rules = rules
+        self.patterns = list(dict.fromkeys(p for r in rules for p in r.get('any', []) + r.get('all', [])))
+        index = {p: i for i, p in enumerate(self.patterns)}
+        # texto plano → bytes.find sobre el bloque en minúsculas; el resto → una sola regex
+        self.literals = [(i, p.encode().lower()) for i, p in enumerate(self.patterns) if not REGEX_CHARS & set(p)]
+        self.regexes = [(i, compile_pattern(p).search) for i, p in enumerate(self.patterns) if REGEX_CHARS & set(p)]
+        shared = [self.patterns[i] for i, _ in self.regexes if not STANDALONE.search(self.patterns[i])]
+        # la alternación (si hay) y cada patrón con grupos o flags por separado: sólo localizan líneas candidatas
+        self.locators = [re.compile(b'|'.join(b'(?:%s)' % p.encode() for p in shared), FLAGS).search] if shared else []
+        self.locators += [search for i, search in self.regexes if STANDALONE.search(self.patterns[i])]
+        self.users = [[] for _ in self.patterns]  # patrón → reglas que lo usan
+        for r_i, rule in enumerate(rules):
+            for p in set(rule.get('any', []) + rule.get('all', [])):
+                self.users[index[p]].append(r_i)
+        self.required = [{index[p] for p in rule.get('all', [])} for rule in rules]
+
+    def _block_hits(self, block):
+        """{offset of line start: {pattern index}} for the lines of ``block`` that match."""
+        hits = {}
+        low = block.lower()
+        for i, needle in self.literals:
+            pos = low.find(needle)
+            while pos >= 0:
+                start = low.rfind(b'\n', 0, pos) + 1
+                hits.setdefault(start, set()).add(i)
+                end = low.find(b'\n', pos)
+                pos = low.find(needle, end + 1) if end >= 0 else -1
+        for locate in self.locators:
+            m = locate(block)
+            while m:
+                start = block.rfind(b'\n', 0, m.start()) + 1
+                end = block.find(b'\n', m.start())
+                end = len(block) if end < 0 else end
+                line = block[start:end]
+                # cada patrón se confirma sobre la línea localizada
+                found = {i for i, search in self.regexes if search(line)}
+                if found:
+                    hits.setdefault(start, set()).update(found)
+                m = locate(block, end + 1)
+        return hits
+
+    def scan(self, f):
+        """{rule id: {'hits': matching lines, 'first_lines': [line numbers]}} for the rules that fired.
+
+        ``f`` is a binary file object.
+        """
+        hits = [0] * len(self.rules)
+        first = [[] for _ in self.rules]
+        seen = set()
+        lineno, rest = 1, b''
+        while True:
+            data = f.read(BLOCK_SIZE)
+            if data:
+                block = rest + data
+                cut = block.rfind(b'\n') + 1
+                if not cut:  # línea más larga que el bloque: seguir leyendo
+                    rest = block
+                    continue
+                block, rest = block[:cut], block[cut:]
+            else:
+                block, rest = rest, b''
+                if not block:
+                    break
+            prev = 0
+            for start, found in sorted(self._block_hits(block).items()):
+                lineno += block.count(b'\n', prev, start)
+                prev = start
+                seen.update(found)
+                for r_i in {r_i for i in found for r_i in self.users[i]}:
+                    hits[r_i] += 1
+                    if len(first[r_i]) < MAX_FIRST_LINES:
+                        first[r_i].append(lineno)
+            lineno += block.count(b'\n', prev)
+        result = {}
+        for r_i, rule in enumerate(self.rules):
+            if (self.required[r_i] <= seen) if self.required[r_i] else hits[r_i]:
+                result[rule['id']] = {'hits': hits[r_i], 'first_lines': first[r_i]}
+        return result
+
+    def scan_file(self, path):
+        with open(path, 'rb') as f:
+            return self.scan(f)
+
+    def summary(self, matches):
+        lines = []
+        for rule in self.rules:
+            m = matches.get(rule['id'])
+            if m:
+                where = f" (líneas {', '.join(map(str, m['first_lines']))}; {m['hits']} coincidencias)" if m['first_lines'] else ''
+                lines.append(f"- {rule['hint']}{where}")
+        return '\n'.join(lines) if lines else '- No se detectaron patrones comunes; revisa el log y el diff del commit.'
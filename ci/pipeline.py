@@ -0,0 +1,234 @@
+# ci/pipeline.py
+"""Whole CI flow in one process: train → changed files → predict → tests → diagnosis.
+
+    python -m ci.pipeline            # from the repo root; --force re-runs every stage,
+                                     # --no-cache skips the test result cache
+
+Each step is the ``main()`` of its script, called as a function. The changed
+files and the selection decision are handed to the next stage in memory, and
+every stage still writes the same artifacts under ``files/``. A stage is
+skipped when the fingerprint of its inputs matches the last run and its
+outputs are still the ones that run wrote. The fingerprint covers the input
+files (size + mtime, never read), the upstream result, the environment knobs
+the stage reads and the stage's own code. Fingerprints live in
+``PIPELINE_STATE`` (default ``.cache/ai-ci/pipeline/state.json``). Skipped
+stages import nothing, so a no-op run never loads scikit-learn, pandas or
+pytest.
+
+- train: ``ml/*.py``, ``app/`` file list, ``HISTORY_DB`` / ``SYNTH_SHARDS_DIR``
+- changed files: always runs (``git rev-parse`` plus the diff cache)
+- predict: changed files, model + mapping, history store, ``app/`` + ``tests/``;
+  the exact test durations only under ``TIME_BUDGET_S`` (they change which
+  tests fit). A reused decision gets its expected catch rate and predicted
+  runtime recomputed from the current ``files/test_timings.json``, which the
+  tests stage rewrites on every run
+- tests: selected tests, ``app/``, ``tests/``, ``ci/`` plugins, requirements;
+  only reused when that run passed (like ``ci/result_cache.py``)
+- diagnosis: only when tests failed; report, log, rules and LLM settings
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+# sólo el orquestador ve ml/ y ci/ a la vez; los scripts se pasan datos (files/, la decisión)
+sys.path.insert(0, str(ROOT / 'ml'))
+sys.path.insert(0, str(ROOT / 'ci'))
+
+STATE_PATH = os.getenv('PIPELINE_STATE', '.cache/ai-ci/pipeline/state.json')
+MODEL_PATH = os.getenv('MODEL_PATH', 'files/model_rf.pkl')
+
+TRAIN_ENV = ('HISTORY_DB', 'SYNTH_SHARDS_DIR', 'SYNTH_ROWS', 'APP_DIR', 'DIR_FEATURES', 'MODEL_CANDIDATE',
+             'INCREMENTAL', 'INCREMENT_TREES', 'MAX_TREES', 'TRAIN_CACHE', 'MODEL_PATH')
+PREDICT_ENV = ('PROB_THRESHOLD', 'TOP_K', 'MIN_TESTS', 'TIME_BUDGET_S', 'FLAT_MODEL', 'MODEL_PATH',
+               'BATCH_INPUT', 'BATCH_OUTPUT', 'IMPORT_ROOTS', 'TIMINGS_PATH')
+TESTS_ENV = ('BREAK_PAYMENT', 'TEST_CACHE_ENV', 'NODE_SELECTION', 'PARALLEL_SHARDS', 'FAIL_FAST', 'RISK_ORDER',
+             'STREAM_OUTPUT', 'RECORD_COVERAGE_MAP', 'TEST_CACHE', 'PYTEST_ADDOPTS', 'PYTHONPATH')
+DIAGNOSE_ENV = ('OPENAI_MODEL', 'OPENAI_BASE_URL', 'LLM_ASYNC', 'LLM_PROMPT_TOKENS', 'LLM_MAX_CASES', 'DIAGNOSIS_RULES')
+
+
+def stamp(*paths):
+    """[(path, size, mtime_ns)] of the given files, and of the ``*.py`` files under the given directories."""
+    out = []
+    for path in map(Path, paths):
+        files = sorted(path.rglob('*.py')) if path.is_dir() else [path]
+        for f in files:
+            try:
+                st = f.stat()
+            except OSError:
+                out.append([f.as_posix(), None, None])  # ausente también es un estado
+                continue
+            out.append([f.as_posix(), st.st_size, st.st_mtime_ns])
+    return out
+
+
+def env_values(names):
+    return {name: os.environ.get(name) for name in names}
+
+
+def fingerprint(inputs):
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+
+def load_state(path=STATE_PATH):
+    try:
+        return json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state, path=STATE_PATH):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f'.{os.getpid()}.tmp')
+    tmp.write_text(json.dumps(state, indent=2))
+    os.replace(tmp, path)
+
+
+def budget_durations(timings_path, budget_s):
+    """Test durations the time-budget knapsack picks from; None when no budget is set."""
+    if not budget_s:
+        return None
+    try:
+        tests = json.loads(Path(timings_path).read_text()).get('tests', {})
+    except (OSError, ValueError):
+        return {}
+    return {t: rec['duration_s'] for t, rec in sorted(tests.items())}
+
+
+class Pipeline:
+    def __init__(self, state, force=False):
+        self.state = state
+        self.force = force
+        self.timings = []
+
+    def stage(self, name, inputs, outputs, fn, reusable=lambda result: True, refresh=None):
+        """Result of ``fn()``, or of the last run when ``inputs`` and ``outputs`` are unchanged.
+
+        ``refresh(result)`` updates a reused result (and may rewrite the outputs).
+        """
+        t0 = time.perf_counter()
+        key = fingerprint(inputs)
+        prev = self.state.get(name)
+        if (not self.force and prev and prev['key'] == key and prev['outputs'] == stamp(*outputs)
+                and reusable(prev['result'])):
+            print(f"[pipeline] {name}: inputs unchanged → skipped")
+            result = prev['result']
+            if refresh is not None:
+                result = refresh(result)
+                self.state[name] = {'key': key, 'outputs': stamp(*outputs), 'result': result}
+            self.timings.append((name, 'skipped', time.perf_counter() - t0))
+            return result
+        print(f"[pipeline] {name}: running")
+        result = fn()
+        self.state[name] = {'key': key, 'outputs': stamp(*outputs), 'result': result}
+        self.timings.append((name, 'ran', time.perf_counter() - t0))
+        return result
+
+
+def train():
+    import train_test_selector
+    train_test_selector.main(model_path=MODEL_PATH)
+
+
+def collect_changed():
+    import collect_changed_files
+    return collect_changed_files.main()
+
+
+def predict(changed):
+    import predict_tests
+    return predict_tests.main(changed=changed)
+
+
+def refresh_decision(decision):
+    import predict_tests
+    return predict_tests.refresh_stats(decision)
+
+
+def run_tests(decision, no_cache=False):
+    import run_selected_tests
+    return run_selected_tests.main(data=decision, no_cache=no_cache)
+
+
+def diagnose():
+    import diagnose_failure_llm
+    diagnose_failure_llm.main()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    force = '--force' in argv or os.getenv('PIPELINE_FORCE') == '1'
+    no_cache = '--no-cache' in argv
+    os.makedirs('files', exist_ok=True)
+    t0 = time.perf_counter()
+    pipe = Pipeline(load_state(), force=force)
+    returncode = 1
+    try:
+        from flat_forest import flat_path_for
+
+        model_outputs = [MODEL_PATH, flat_path_for(MODEL_PATH), 'files/test_index.json', 'files/train_state.json']
+        pipe.stage('train', {
+            'code': stamp(ROOT / 'ml'),
+            'app': stamp(os.getenv('APP_DIR', 'app')),
+            'data': stamp(*[p for p in (os.getenv('HISTORY_DB'), 'files/promoted_model.json') if p]) + (
+                stamp(*sorted(Path(os.environ['SYNTH_SHARDS_DIR']).glob('shard_*.*')))
+                if os.getenv('SYNTH_SHARDS_DIR') else []),
+            'env': env_values(TRAIN_ENV),
+        }, model_outputs, train)
+
+        # barato (rev-parse + caché de diffs por SHA): siempre se ejecuta
+        t1 = time.perf_counter()
+        changed = collect_changed()
+        pipe.timings.append(('changed', 'ran', time.perf_counter() - t1))
+
+        decision = pipe.stage('predict', {
+            'changed': changed['files'],
+            'model': stamp(*model_outputs),
+            'durations': budget_durations(os.getenv('TIMINGS_PATH', 'files/test_timings.json'),
+                                          os.getenv('TIME_BUDGET_S')),
+            'history': stamp(os.getenv('HISTORY_DB', 'files/history.sqlite')),
+            'sources': stamp('app', 'tests'),
+            'code': stamp(ROOT / 'ml'),
+            'env': env_values(PREDICT_ENV),
+        }, ['files/selected_tests.json'], lambda: predict(changed['files']), refresh=refresh_decision)
+        if decision is None:  # modo batch: la decisión de este commit sigue en disco
+            decision = json.load(open('files/selected_tests.json'))
+
+        # sólo lo que decide qué se ejecuta y en qué orden: las duraciones estimadas cambian en cada run
+        returncode = pipe.stage('tests', {
+            'selected': decision.get('selected_tests', []),
+            'class_probs': decision.get('class_probs', []),
+            'node_history': decision.get('node_history', {}),
+            'hunks': changed.get('hunks', {}),
+            'sources': stamp('app', 'tests', ROOT / 'ci', 'conftest.py', 'requirements.txt'),
+            'python': sys.version,
+            'no_cache': no_cache,
+            'env': env_values(TESTS_ENV + tuple(v.strip() for v in os.getenv('TEST_CACHE_ENV', '').split(',')
+                                                if v.strip())),
+        }, ['files/report.xml', 'files/pytest_output.log'], lambda: run_tests(decision, no_cache),
+            reusable=lambda code: code == 0)
+
+        if returncode == 0:
+            print("[pipeline] diagnose: tests passed → skipped")
+        else:
+            pipe.stage('diagnose', {
+                'report': stamp('files/report.xml', 'files/pytest_output.log', 'files/selected_tests.json'),
+                'rules': stamp(ROOT / 'ci' / 'diagnosis_rules.json',
+                               *[p for p in os.getenv('DIAGNOSIS_RULES', '').split(',') if p.strip()]),
+                'code': stamp(ROOT / 'ci'),
+                'llm': bool(os.getenv('OPENAI_API_KEY')),
+                'env': env_values(DIAGNOSE_ENV),
+            }, ['files/diagnosis.txt'], diagnose)
+    finally:
+        save_state(pipe.state)
+        ran = ', '.join(f'{name} {how} {seconds:.2f}s' for name, how, seconds in pipe.timings)
+        print(f"[pipeline] {ran} — total {time.perf_counter() - t0:.2f}s")
+    return returncode
+
+
+if __name__ == '__main__':
+    sys.exit(main())
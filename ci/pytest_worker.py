@@ -0,0 +1,320 @@
+# ci/pytest_worker.py
+"""Warm pytest worker: pre-imports pytest, app/ and test dependencies; forks a clean child per run.
+
+The server imports pytest (with its default plugins), every module under
+``WORKER_PRELOAD`` and whatever the files under ``WORKER_PRELOAD_TESTS``
+import, once. The test modules and conftest.py files themselves are not
+preloaded: pytest rewrites their asserts when it imports them, and would reuse
+a plain copy found in ``sys.modules``. Each request (one JSON line over a Unix
+socket) is served by a forked child that inherits those imports, applies the
+client's cwd/env, redirects stdout/stderr to the given files and calls
+``pytest.main(args)``. Before forking, preloaded modules whose source mtime
+changed are dropped and imported again, and test files whose mtime changed
+are re-scanned for new imports, so children never see stale code. Preloaded
+objects sit in the permanent gc generation; it is emptied and collected
+before a reload so replaced modules do not leak.
+
+    python ci/pytest_worker.py &     # then ci/run_selected_tests.py uses it automatically
+"""
+import ast
+import gc
+import importlib
+import json
+import os
+import select
+import signal
+import socketserver
+import sys
+import time
+from pathlib import Path
+
+WORKER_SOCKET = os.getenv('PYTEST_WORKER_SOCKET', 'files/pytest_worker.sock')
+WORKER_PRELOAD = tuple(p.strip() for p in os.getenv('WORKER_PRELOAD', 'app').split(',') if p.strip())
+WORKER_PRELOAD_TESTS = tuple(p.strip() for p in os.getenv('WORKER_PRELOAD_TESTS', 'tests').split(',') if p.strip())
+# salida de cada run: directorio del worker (0700), nunca rutas elegidas por el cliente
+WORKER_OUTPUT_DIR = os.getenv('PYTEST_WORKER_DIR', 'files/pytest_worker')
+# variables del cliente que pasan al hijo; el resto viene del entorno del worker (``X_*`` = prefijo)
+WORKER_ENV_KEYS = tuple(k.strip() for k in os.getenv(
+    'WORKER_ENV_KEYS', 'PYTHONPATH,PYTHONHASHSEED,TZ,LANG,LC_*,CI,GITHUB_*,COVERAGE_*').split(',') if k.strip())
+# -p sólo para los plugins del repo (o para desactivar alguno con no:NAME)
+WORKER_PLUGINS = ('risk_order', 'coverage_map')
+
+
+def absolute_imports(path):
+    """Top-level-absolute module names imported anywhere in ``path`` (``from a.b import c`` → ``a.b``)."""
+    try:
+        tree = ast.parse(Path(path).read_bytes())
+    except (OSError, SyntaxError, ValueError):
+        return []
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and not node.level and node.module:
+            names.append(node.module)
+    return names
+
+
+class Preloaded:
+    """Modules imported in the server, with the mtime of their source at import time."""
+
+    def __init__(self, packages=WORKER_PRELOAD, test_dirs=WORKER_PRELOAD_TESTS, root='.'):
+        self.packages = packages
+        self.test_dirs = test_dirs
+        self.root = Path(root).resolve()
+        self.mtimes = {}
+        self.test_mtimes = {}
+        self.test_deps = set()
+
+    def module_names(self):
+        for package in self.packages:
+            for path in sorted((self.root / package).rglob('*.py')):
+                parts = list(path.relative_to(self.root).with_suffix('').parts)
+                if parts[-1] == '__init__':
+                    parts.pop()
+                yield '.'.join(parts)
+
+    def load(self):
+        for name in self.module_names():
+            try:
+                module = importlib.import_module(name)
+            except Exception as e:  # a broken module must not take the worker down
+                print(f"Preload of {name} failed: {type(e).__name__}: {e}")
+                continue
+            if getattr(module, '__file__', None):
+                self.mtimes[name] = os.stat(module.__file__).st_mtime_ns
+
+    def test_files(self):
+        for test_dir in self.test_dirs:
+            yield from sorted((self.root / test_dir).rglob('*.py'))
+
+    def load_test_deps(self):
+        """Import what new or modified test files import; returns the modules imported now."""
+        files = list(self.test_files())
+        # módulos locales de los tests (helpers, conftest): los importa pytest, con sus asserts reescritos
+        local = set(self.test_dirs) | {p.stem for p in files} | {p.parent.name for p in files}
+        managed = tuple(p.replace('/', '.') for p in self.packages)
+        loaded = []
+        for path in files:
+            mtime = os.stat(path).st_mtime_ns
+            if self.test_mtimes.get(path) == mtime:
+                continue
+            self.test_mtimes[path] = mtime
+            for name in absolute_imports(path):
+                top = name.split('.')[0]
+                if top in local or top in managed or name in sys.modules:
+                    continue
+                try:
+                    importlib.import_module(name)
+                except Exception:  # optional or test-local dependency: pytest reports it if it matters
+                    continue
+                self.test_deps.add(name)
+                loaded.append(name)
+        return loaded
+
+    def stale(self):
+        changed = []
+        for name, mtime in self.mtimes.items():
+            module = sys.modules.get(name)
+            try:
+                current = os.stat(module.__file__).st_mtime_ns if module else None
+            except OSError:
+                current = None
+            if current != mtime:
+                changed.append(name)
+        known = set(self.mtimes)
+        return changed + [n for n in self.module_names() if n not in known]
+
+    def refresh(self):
+        """Re-import everything under the preloaded packages if any source changed; returns the changes."""
+        changed = self.stale()
+        if changed:
+            # los módulos sustituidos deben poder liberarse: fuera de la generación permanente
+            gc.unfreeze()
+            prefixes = tuple(p.replace('/', '.') for p in self.packages)
+            for name in [n for n in sys.modules if n in prefixes or n.startswith(tuple(p + '.' for p in prefixes))]:
+                del sys.modules[name]
+            importlib.invalidate_caches()
+            gc.collect()
+            self.mtimes.clear()
+            self.load()
+        if self.load_test_deps() or changed:
+            gc.freeze()  # lo recién importado también a la generación permanente
+        return changed
+
+
+def allowed_env(key):
+    return any(key.startswith(k[:-1]) if k.endswith('*') else key == k for k in WORKER_ENV_KEYS)
+
+
+def check_args(args):
+    """Raise ``ValueError`` unless ``args`` is a list of strings loading only the repo's plugins."""
+    if not isinstance(args, list) or not all(isinstance(a, str) for a in args):
+        raise ValueError('args must be a list of strings')
+    for i, arg in enumerate(args):
+        if arg == '-p':
+            plugin = args[i + 1] if i + 1 < len(args) else ''
+        elif arg.startswith('-p'):
+            plugin = arg[2:]
+        else:
+            continue
+        if plugin not in WORKER_PLUGINS and not plugin.startswith('no:'):
+            raise ValueError(f'plugin {plugin!r} not allowed in the worker')
+
+
+def run_child(req, outputs):
+    """In the forked child: isolate, redirect output, run pytest and exit without returning."""
+    code = 3
+    try:
+        env = req.get('env', {})
+        for key in [k for k in os.environ if allowed_env(k) and k not in env]:
+            del os.environ[key]
+        os.environ.update({k: str(v) for k, v in env.items() if allowed_env(k)})
+        for fd, path in zip((1, 2), outputs):
+            out = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            os.dup2(out, fd)
+            os.close(out)
+        import pytest
+        code = int(pytest.main(req.get('args', [])))
+    except BaseException as e:
+        print(f"pytest worker child failed: {type(e).__name__}: {e}", file=sys.stderr)
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def wait_child(pid, timeout):
+    """Wait up to ``timeout`` seconds (None: forever) for child ``pid`` to exit; False if it is still running."""
+    if timeout is None:
+        return True  # the caller's waitpid blocks
+    if hasattr(os, 'pidfd_open'):
+        fd = os.pidfd_open(pid)
+        try:
+            return bool(select.select([fd], [], [], timeout)[0])
+        finally:
+            os.close(fd)
+    deadline = time.monotonic() + timeout
+    while not os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT):
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                resp = self.server.dispatch(json.loads(line))
+            except Exception as e:
+                resp = {'error': f'{type(e).__name__}: {e}'}
+            self.wfile.write(json.dumps(resp).encode() + b'\n')
+            self.wfile.flush()
+
+
+class WorkerServer(socketserver.UnixStreamServer):
+    # one run at a time: forking from a single-threaded server keeps children clean
+    def __init__(self, socket_path, preloaded, output_dir=WORKER_OUTPUT_DIR):
+        # sólo el dueño puede conectarse: umask durante el bind y chmod explícito después
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, Handler)
+        finally:
+            os.umask(old_umask)
+        os.chmod(socket_path, 0o600)
+        self.preloaded = preloaded
+        self.root = os.getcwd()
+        self.output_dir = os.path.abspath(output_dir)
+        os.makedirs(self.output_dir, mode=0o700, exist_ok=True)
+        os.chmod(self.output_dir, 0o700)
+        self.runs = 0
+
+    def dispatch(self, req):
+        op = req.get('op', 'run')
+        if op == 'ping':
+            return {'ok': True, 'pid': os.getpid()}
+        if op != 'run':
+            return {'error': f'unknown op {op!r}'}
+        if os.path.realpath(req.get('cwd', self.root)) != os.path.realpath(self.root):
+            return {'error': f'cwd must be the worker root {self.root}'}
+        check_args(req.get('args', []))
+        timeout = req.get('timeout')
+        t0 = time.perf_counter()
+        reloaded = self.preloaded.refresh()
+        self.runs += 1
+        outputs = [os.path.join(self.output_dir, f'run_{self.runs}.{name}') for name in ('out', 'err')]
+        pid = os.fork()
+        if pid == 0:
+            self.socket.close()
+            run_child(req, outputs)
+        timed_out = not wait_child(pid, timeout)
+        if timed_out:
+            os.kill(pid, signal.SIGKILL)  # hijo colgado: no bloquear el worker (ni el CI)
+        _, status = os.waitpid(pid, 0)
+        return {
+            'returncode': os.waitstatus_to_exitcode(status),
+            'timed_out': timed_out,
+            'stdout': outputs[0],
+            'stderr': outputs[1],
+            'reloaded': reloaded,
+            'elapsed_s': time.perf_counter() - t0,
+        }
+
+
+def query_worker(request, socket_path=WORKER_SOCKET, timeout=None):
+    # None ⇒ no worker running / unreachable; caller runs pytest in a subprocess
+    import socket
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(socket_path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            sock.sendall(json.dumps(request).encode() + b'\n')
+            line = sock.makefile('rb').readline()
+        resp = json.loads(line)
+    except (OSError, ValueError):
+        return None
+    return None if 'error' in resp else resp
+
+
+def serve(socket_path=WORKER_SOCKET):
+    if os.path.exists(socket_path):
+        if query_worker({'op': 'ping'}, socket_path=socket_path, timeout=0.5):
+            print(f"pytest worker already running on {socket_path}")
+            return 1
+        os.unlink(socket_path)  # stale socket from a previous run
+
+    t0 = time.perf_counter()
+    sys.path.insert(0, os.getcwd())  # app/ importable as in `PYTHONPATH=. pytest`
+    import pytest
+    from _pytest.config import default_plugins
+    for name in default_plugins:
+        importlib.import_module(f'_pytest.{name}')
+    preloaded = Preloaded()
+    preloaded.load()
+    preloaded.load_test_deps()
+    # preloaded objects go to the permanent generation: the children's gc passes skip them
+    gc.freeze()
+    print(f"Preloaded pytest, {len(preloaded.mtimes)} modules and {len(preloaded.test_deps)} test dependencies "
+          f"in {time.perf_counter() - t0:.2f}s")
+
+    server = WorkerServer(socket_path, preloaded)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"Serving pytest runs on {socket_path} (pid {os.getpid()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(serve())
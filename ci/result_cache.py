@@ -0,0 +1,185 @@
+# ci/result_cache.py
+"""Content-addressed cache of passing test results.
+
+Each selected item (test file or node ID) is keyed on the content of the test
+file and everything it transitively imports under app/ and tests/ (from the
+import-graph index ml/predict_tests.py refreshes in ``files/import_graph.json``;
+items whose sources no longer match the index are simply run), the Python
+version, the installed versions of requirements.txt and a whitelist of
+environment variables. Items
+whose key already passed are not re-run; they appear in ``files/report.xml``
+as skipped (``type="ai-ci-cache"``). Entries are evicted least-recently-used
+first beyond ``TEST_CACHE_MAX`` entries or ``TEST_CACHE_MAX_MB``.
+"""
+import hashlib
+import json
+import os
+import re
+import sys
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+from junit_report import iter_cases
+
+# refreshed by ml/predict_tests.py before the tests run
+INDEX_PATH = os.getenv('IMPORT_GRAPH_PATH', 'files/import_graph.json')
+CACHE_DIR = os.getenv('TEST_CACHE_DIR', '.cache/ai-ci/results')
+MAX_ENTRIES = int(os.getenv('TEST_CACHE_MAX', '5000'))
+MAX_MB = float(os.getenv('TEST_CACHE_MAX_MB', '50'))
+ENV_WHITELIST = tuple(v.strip() for v in os.getenv('TEST_CACHE_ENV', 'BREAK_PAYMENT').split(',') if v.strip())
+SKIP_TYPE = 'ai-ci-cache'
+
+
+def environment_fingerprint(requirements='requirements.txt'):
+    from importlib import metadata
+
+    h = hashlib.sha256(sys.version.encode())
+    if os.path.exists(requirements):
+        data = Path(requirements).read_text()
+        h.update(data.encode())
+        for line in data.splitlines():
+            name = re.split(r'[<>=!~;\[\s]', line.strip(), maxsplit=1)[0]
+            if name and not name.startswith('#'):
+                try:
+                    version = metadata.version(name)
+                except metadata.PackageNotFoundError:
+                    version = 'missing'
+                h.update(f'{name}=={version}\n'.encode())
+    for name in ENV_WHITELIST:
+        h.update(f'{name}={os.environ.get(name)!r}\n'.encode())
+    return h.hexdigest()
+
+
+def load_index(index_path=INDEX_PATH):
+    try:
+        with open(index_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'files': {}, 'impact': {}}
+
+
+def index_is_current(test_file, sources, files, _seen):
+    """True when ``sources`` still hold the content the index recorded and no conftest.py was added."""
+    for src in sources:
+        if src not in _seen:
+            rec = files.get(src)
+            try:
+                st = os.stat(src)
+            except OSError:
+                _seen[src] = False
+                continue
+            # mismo criterio que ml/import_graph.py: stat primero, hash sólo si el fichero se tocó
+            _seen[src] = bool(rec) and ((rec['size'], rec['mtime_ns']) == (st.st_size, st.st_mtime_ns)
+                                        or hashlib.sha1(Path(src).read_bytes()).hexdigest() == rec['sha1'])
+        if not _seen[src]:
+            return False
+    # el conftest.py de la raíz queda fuera del índice (IMPORT_ROOTS son subdirectorios)
+    conftests = (parent / 'conftest.py' for parent in list(Path(test_file).parents)[:-1])
+    return all(c.as_posix() in files for c in conftests if c.exists())
+
+
+def item_keys(items, index=None):
+    """{item: key} for every item whose test file is in a current import graph (others are not cacheable)."""
+    index = index or load_index()
+    deps = {}
+    for src, tests in index['impact'].items():
+        for test in tests:
+            deps.setdefault(test, []).append(src)
+    env = environment_fingerprint()
+    keys, seen = {}, {}
+    for item in items:
+        test_file = item.split('::', 1)[0]
+        sources = deps.get(test_file)
+        if not sources or not index_is_current(test_file, sources, index['files'], seen):
+            continue
+        h = hashlib.sha256(f'{env}\n{item}\n'.encode())
+        for src in sorted(sources):
+            h.update(f"{src}:{index['files'][src]['sha1']}\n".encode())
+        keys[item] = h.hexdigest()[:32]
+    return keys
+
+
+def lookup(keys, cache_dir=CACHE_DIR):
+    """{item: cached entry} for items whose key previously passed."""
+    hits = {}
+    for item, key in keys.items():
+        path = Path(cache_dir) / f'{key}.json'
+        if path.exists():
+            hits[item] = json.loads(path.read_text())
+            os.utime(path)  # mark as recently used
+    return hits
+
+
+def case_path(case):
+    """``['TestA', 'test_x[1]']`` for a case of ``tests/x.py`` whose classname is ``tests.x.TestA``."""
+    module = case['file'][:-len('.py')].replace('/', '.')
+    classname = case['classname']
+    classes = classname[len(module) + 1:].split('.') if classname.startswith(module + '.') else []
+    return classes + [case['name']]
+
+
+def _matches(item, case):
+    # item: fichero, clase o nodo (``file::TestA::test_x``); clases y función deben coincidir
+    file_part, _, rest = item.partition('::')
+    if file_part != case['file']:
+        return False
+    if not rest:
+        return True
+    want, have = rest.split('::'), case_path(case)
+    if len(want) > len(have) or want[:-1] != have[:len(want) - 1]:
+        return False
+    last, got = want[-1], have[len(want) - 1]
+    return got == last or ('[' not in last and got.startswith(last + '['))
+
+
+def store(keys, report_path, cache_dir=CACHE_DIR):
+    """Record the items of ``keys`` whose test cases all passed in ``report_path``."""
+    if not keys or not os.path.exists(report_path):
+        return 0
+    files = {item.split('::', 1)[0] for item in keys}
+    cases = [c for c in iter_cases(report_path, traceback_chars=0) if c['file'] in files]
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    stored = 0
+    for item, key in keys.items():
+        own = [c for c in cases if _matches(item, c)]
+        if not own or any(c['outcome'] != 'passed' for c in own):
+            continue
+        entry = {
+            'item': item,
+            'cases': [{'classname': c['classname'], 'name': c['name'], 'time': c['time']} for c in own],
+        }
+        tmp = Path(cache_dir) / f'.{key}.{os.getpid()}.tmp'
+        tmp.write_text(json.dumps(entry))
+        os.replace(tmp, Path(cache_dir) / f'{key}.json')
+        stored += 1
+    evict(cache_dir)
+    return stored
+
+
+def add_to_report(report_path, hits):
+    """Append the cached passes to the JUnit report as one skipped ``cached`` suite."""
+    if not hits:
+        return
+    root = ET.parse(report_path).getroot() if os.path.exists(report_path) else ET.Element('testsuites')
+    if root.tag != 'testsuites':
+        wrapper = ET.Element('testsuites')
+        wrapper.append(root)
+        root = wrapper
+    cases = [c for entry in hits.values() for c in entry['cases']]
+    suite = ET.SubElement(root, 'testsuite', name='cached', tests=str(len(cases)), failures='0',
+                          errors='0', skipped=str(len(cases)), time='0')
+    for c in cases:
+        case = ET.SubElement(suite, 'testcase', classname=c['classname'], name=c['name'], time='0')
+        ET.SubElement(case, 'skipped', type=SKIP_TYPE, message=f"cached pass (previously {c['time']}s)")
+    ET.ElementTree(root).write(report_path, encoding='utf-8', xml_declaration=True)
+
+
+def evict(cache_dir=CACHE_DIR, max_entries=MAX_ENTRIES, max_mb=MAX_MB):
+    entries = sorted(Path(cache_dir).glob('*.json'), key=lambda p: p.stat().st_mtime, reverse=True)
+    total, removed = 0, 0
+    for i, path in enumerate(entries):
+        total += path.stat().st_size
+        if i >= max_entries or total > max_mb * 2**20:
+            path.unlink(missing_ok=True)
+            removed += 1
+    return removed
@@ -1,14 +1,285 @@
 # ci/run_selected_tests.py
-import json, os, subprocess, sys
+import heapq, json, os, shutil, subprocess, sys, tempfile, threading, time
+import xml.etree.ElementTree as ET
+from collections import deque
+from pathlib import Path
 
-def main():
+from junit_report import write_cases
+from timing_history import load_timings, update_timings
+import coverage_map
+import result_cache
+from pytest_worker import query_worker
+
+CI_DIR = os.path.dirname(os.path.abspath(__file__))
+SHARD_DIR = 'files/shards'
+LOG_PATH = 'files/pytest_output.log'
+RISK_ORDER_PATH = 'files/risk_order.json'
+# una línea por ejecución: tiempo hasta el primer fallo, para comparar órdenes entre runs
+METRICS_PATH = os.getenv('TEST_METRICS_PATH', 'files/test_metrics.jsonl')
+DEFAULT_TEST_DURATION_S = 1.0
+# STREAM_OUTPUT=1: líneas que se conservan en memoria (cola del log) para el diagnóstico
+TAIL_LINES = int(os.getenv('STREAM_TAIL_LINES', '200'))
+# plazo de un run en el worker caliente: un hijo colgado no bloquea el CI
+WORKER_TIMEOUT_S = float(os.getenv('PYTEST_WORKER_TIMEOUT', '1800'))
+
+_console_lock = threading.Lock()
+
+def node_selection(tests):
+    # NODE_SELECTION=1: reduce los ficheros seleccionados a los nodos que ejecutan líneas cambiadas
+    if os.getenv('NODE_SELECTION') != '1' or not os.path.exists('files/changed_files.json'):
+        return tests
+    cov_map = coverage_map.load_map()
+    diff = json.load(open('files/changed_files.json'))
+    if isinstance(diff, list):
+        diff = {}  # formato antiguo: sólo nombres, sin rangos de líneas
+    hunks, base = diff.get('hunks', {}), diff.get('base')
+    if not cov_map or not hunks or not base:
+        print("Node selection unavailable (no coverage map or diff hunks); running whole files.")
+        return tests
+    nodes = coverage_map.select_nodes(tests, hunks, cov_map, coverage_map.base_blobs(base, list(hunks)))
+    if nodes is None:
+        print("Coverage map does not cover the changed lines; running whole files.")
+        return tests
+    print(f"Node selection: {len(nodes)} test nodes from {len(tests)} files.")
+    return nodes
+
+def test_durations(tests):
+    """Historical seconds per selected item; nodes share their file's time, unseen files take the median."""
+    history = {t: rec['duration_s'] for t, rec in load_timings().get('tests', {}).items()}
+    fallback = sorted(history.values())[len(history) // 2] if history else DEFAULT_TEST_DURATION_S
+    per_file = {}
+    for t in tests:
+        per_file.setdefault(t.split('::', 1)[0], []).append(t)
+    return {t: history.get(f, fallback) / len(items) for f, items in per_file.items() for t in items}
+
+def plan_shards(tests, n_shards):
+    # LPT: el test más largo primero, siempre al shard con menos carga
+    durations = test_durations(tests)
+    shards = [(0.0, i, []) for i in range(n_shards)]
+    for t in sorted(tests, key=lambda t: durations[t], reverse=True):
+        load, i, items = heapq.heappop(shards)
+        items.append(t)
+        heapq.heappush(shards, (load + durations[t], i, items))
+    return [(load, items) for load, _, items in sorted(shards, key=lambda s: s[1]) if items]
+
+def shard_count(n_tests):
+    requested = os.getenv('PARALLEL_SHARDS', '1')
+    if requested == 'auto':
+        n = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    else:
+        n = int(requested)
+    return max(1, min(n, n_tests))
+
+def merge_junit(reports, output):
+    # un <testsuites> con el <testsuite> de cada shard: diagnose_failure_llm.py ya suma ambos formatos
+    merged = ET.Element('testsuites')
+    for path in reports:
+        if not os.path.exists(path):
+            continue
+        root = ET.parse(path).getroot()
+        merged.extend([root] if root.tag == 'testsuite' else list(root.iter('testsuite')))
+    ET.ElementTree(merged).write(output, encoding='utf-8', xml_declaration=True)
+
+def write_risk_order(tests, class_probs, node_history, path=RISK_ORDER_PATH):
+    """Per-file predicted failure probability + per-node historical failure rate for ci/risk_order.py.
+
+    ``node_history`` is ``{node: [runs, failures]}`` from the history store, as ml/predict_tests.py
+    puts it in the selection decision.
+    """
+    from risk_order import failure_rate
+    files = {t.split('::', 1)[0] for t in tests}
+    nodes = {n: failure_rate(runs, fails) for n, (runs, fails) in node_history.items()
+             if n.split('::', 1)[0] in files}
+    with open(path, 'w') as f:
+        json.dump({'files': {c['label']: c['prob'] for c in class_probs}, 'nodes': nodes}, f, indent=2)
+    return path
+
+def record_metrics(metric_paths, tests, returncode, wall_s, risk_ordered, path=METRICS_PATH):
+    # varios shards: el primer fallo global es el mínimo de los tiempos por shard
+    runs = []
+    for p in metric_paths:
+        if os.path.exists(p):
+            with open(p) as f:
+                runs.append(json.load(f))
+            os.remove(p)
+    failed = [r for r in runs if r.get('ttff_s') is not None]
+    first = min(failed, key=lambda r: r['ttff_s']) if failed else {}
+    record = {
+        'timestamp': time.time(),
+        'sha': os.getenv('GITHUB_SHA', ''),
+        'risk_ordered': risk_ordered,
+        'fail_fast': os.getenv('FAIL_FAST') == '1',
+        'shards': len(metric_paths),
+        'items_selected': len(tests),
+        'tests_started': sum(r.get('tests_started', 0) for r in runs),
+        'ttff_s': first.get('ttff_s'),
+        'first_failure': first.get('first_failure'),
+        'first_failure_position': first.get('first_failure_position'),
+        'wall_s': wall_s,
+        'returncode': returncode,
+    }
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+    return record
+
+def run_in_worker(args, env):
+    """Run pytest in the warm worker (ci/pytest_worker.py) → CompletedProcess, or None if none is running."""
+    if os.getenv('PYTEST_WORKER', '1') == '0':
+        return None
+    # el worker mata el run al agotar el plazo; el socket espera un poco más por si el worker no responde
+    resp = query_worker({'op': 'run', 'args': args[1:], 'cwd': os.getcwd(), 'env': env, 'timeout': WORKER_TIMEOUT_S},
+                        timeout=WORKER_TIMEOUT_S + 30)
+    if resp is None:
+        return None
+    if resp.get('reloaded'):
+        print(f"pytest worker reloaded: {', '.join(resp['reloaded'])}")
+    out, err = (Path(resp[name]).read_text(errors='replace') for name in ('stdout', 'stderr'))
+    for name in ('stdout', 'stderr'):
+        Path(resp[name]).unlink(missing_ok=True)
+    if resp.get('timed_out'):
+        err += f"\npytest worker: run killed after {WORKER_TIMEOUT_S:.0f}s\n"
+    return subprocess.CompletedProcess(args, resp['returncode'], out, err)
+
+def tee(pipe, sinks, tail, console=None, prefix=''):
+    """Copy ``pipe`` line by line to ``sinks`` (and live to ``console``); only ``tail`` stays in memory."""
+    for line in pipe:
+        for sink in sinks:
+            sink.write(line)
+        if console is not None:
+            with _console_lock:
+                console.write(prefix + line)
+                console.flush()
+        tail.append(line)
+    pipe.close()
+
+def start_streaming(args, env, out_sink, err_sink, prefix=''):
+    """Popen whose stdout/stderr are teed by background threads → (proc, threads, (out tail, err tail))."""
+    # sin esto pytest bufferiza su stdout al escribir a un pipe y no habría salida en vivo
+    proc = subprocess.Popen(args, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            env={**env, 'PYTHONUNBUFFERED': '1'}, bufsize=1)
+    tails = (deque(maxlen=TAIL_LINES), deque(maxlen=TAIL_LINES))
+    threads = [
+        threading.Thread(target=tee, args=(proc.stdout, [out_sink], tails[0], sys.stdout, prefix), daemon=True),
+        threading.Thread(target=tee, args=(proc.stderr, [err_sink], tails[1], sys.stderr, prefix), daemon=True),
+    ]
+    for t in threads:
+        t.start()
+    return proc, threads, tails
+
+def run_streaming(args, env, log_path=LOG_PATH):
+    """Single pytest, output written to console and log as produced → (returncode, tails)."""
+    with open(log_path, 'w') as log, tempfile.TemporaryFile('w+') as err_spool:
+        proc, threads, tails = start_streaming(args, env, log, err_spool)
+        for t in threads:
+            t.join()
+        proc.wait()
+        # misma estructura que el modo clásico: stdout, separador, stderr
+        log.write('\n--- STDERR ---\n')
+        err_spool.seek(0)
+        shutil.copyfileobj(err_spool, log)
+    return proc.returncode, tails
+
+def copy_sections(spools, dest, header):
+    for i, (spool, status) in enumerate(spools):
+        dest.write(header(i, status))
+        spool.seek(0)
+        shutil.copyfileobj(spool, dest)
+        dest.write('\n')
+
+def run_shards(shards, base_args, env, fail_fast, stream=False, log_path=LOG_PATH):
+    """Run one pytest per shard concurrently; writes the merged log and report → returncode."""
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    procs = []
+    for i, (load, items) in enumerate(shards):
+        report = f'{SHARD_DIR}/report_{i}.xml'
+        if os.path.exists(report):
+            os.remove(report)
+        out, err = tempfile.TemporaryFile('w+'), tempfile.TemporaryFile('w+')
+        args = ['pytest'] + items + base_args + ['--junitxml', report,
+                                                 '--risk-metrics', f'{SHARD_DIR}/metrics_{i}.json']
+        print(f'Shard {i + 1}/{len(shards)} (~{load:.1f}s):', ' '.join(args), flush=True)
+        if stream:
+            proc, threads, _ = start_streaming(args, env, out, err, prefix=f'[shard {i + 1}] ')
+        else:
+            proc, threads = subprocess.Popen(args, text=True, stdout=out, stderr=err, env=env), []
+        procs.append((proc, threads, out, err, report))
+
+    cancelled = set()
+    while any(p.poll() is None for p, *_ in procs):
+        if fail_fast and any(p.poll() not in (None, 0, 5) for p, *_ in procs):
+            for i, (p, *_) in enumerate(procs):
+                if p.poll() is None:
+                    p.terminate()
+                    cancelled.add(i)
+            for p, *_ in procs:
+                p.wait()
+            break
+        time.sleep(0.02)
+    for _, threads, *_ in procs:
+        for t in threads:
+            t.join()
+
+    n = len(procs)
+    status = ['cancelled (FAIL_FAST)' if i in cancelled else f'exit {p.returncode}' for i, (p, *_) in enumerate(procs)]
+    outs = [(out, status[i]) for i, (_, _, out, _, _) in enumerate(procs)]
+    errs = [(err, status[i]) for i, (_, _, _, err, _) in enumerate(procs)]
+    # el log se compone por trozos desde los ficheros temporales, sin cargarlo entero en memoria
+    with open(log_path, 'w') as log:
+        copy_sections(outs, log, lambda i, st: f'=== shard {i + 1}/{n}: {st} ===\n')
+        log.write('\n--- STDERR ---\n')
+        copy_sections(errs, log, lambda i, st: f'=== shard {i + 1}/{n} ===\n')
+    if not stream:
+        copy_sections(outs, sys.stdout, lambda i, st: f'=== shard {i + 1}/{n}: {st} ===\n')
+        copy_sections(errs, sys.stderr, lambda i, st: f'=== shard {i + 1}/{n} ===\n')
+    for _, _, out, err, _ in procs:
+        out.close()
+        err.close()
+
+    codes = [p.returncode for i, (p, *_) in enumerate(procs) if i not in cancelled]
+    merge_junit([r for i, (*_, r) in enumerate(procs) if i not in cancelled], 'files/report.xml')
+
+    # 5 = "no tests collected" en un shard no es un fallo si otro shard ejecutó tests
+    failed = [c for c in codes if c not in (0, 5)]
+    return failed[0] if failed else (0 if 0 in codes else 5)
+
+def main(data=None, no_cache=False):
+    # data: decisión de selección ya en memoria (ci/pipeline.py); si no, files/selected_tests.json
+    # no_cache: --no-cache en la línea de comandos (o del pipeline); nunca se lee sys.argv aquí
     env = os.environ.copy()
     env['PYTHONPATH'] = env.get('PYTHONPATH', os.getcwd())
+    # plugins de pytest del directorio ci/ (risk_order, coverage_map)
+    env['PYTHONPATH'] = os.pathsep.join([env['PYTHONPATH'], CI_DIR])
 
-    tests = []
-    if os.path.exists('files/selected_tests.json'):
-        data = json.load(open('files/selected_tests.json'))
-        tests = data.get('selected_tests', [])
+    record_map = os.getenv('RECORD_COVERAGE_MAP') == '1'
+    if data is None:
+        data = json.load(open('files/selected_tests.json')) if os.path.exists('files/selected_tests.json') else {}
+    if record_map:
+        # el mapa de cobertura por nodo se graba una vez con la suite completa
+        tests = ['tests/']
+    else:
+        tests = node_selection(data.get('selected_tests', []))
+
+    # Caché de resultados: tests cuyo código, imports, entorno y versiones no cambiaron desde un pase
+    use_cache = not record_map and not no_cache and os.getenv('TEST_CACHE', '1') != '0' and bool(tests)
+    keys, cached = {}, {}
+    if use_cache:
+        keys = result_cache.item_keys(tests)
+        cached = result_cache.lookup(keys)
+        if cached:
+            print(f"Test result cache: skipping {len(cached)} unchanged passing item(s): {', '.join(cached)}")
+        tests = [t for t in tests if t not in cached]
+
+    if not tests and cached:
+        msg = "All selected tests have cached passing results. Skipping pytest."
+        print(msg)
+        with open('files/report.xml', 'w') as f:
+            f.write('<testsuites></testsuites>')
+        result_cache.add_to_report('files/report.xml', cached)
+        write_cases('files/report.xml')
+        with open(LOG_PATH, 'w') as f:
+            f.write(msg + '\n' + ''.join(f'CACHED {t}\n' for t in cached))
+        return 0
 
     if not tests:
         msg = "No tests selected (no app/ changes). Skipping pytest."
@@ -16,25 +287,74 @@ def main():
         # Dejar un reporte mínimo opcional para herramientas que esperan XML
         with open('files/report.xml', 'w') as f:
             f.write('<testsuite name="skip" tests="0" failures="0" errors="0"></testsuite>')
+        write_cases('files/report.xml')
         with open('files/pytest_output.log', 'w') as f:
             f.write(msg + '\n')
-        sys.exit(0)
+        return 0
 
     fail_fast = os.getenv('FAIL_FAST') == '1'
-    args = ['pytest'] + tests + ['-q', '--junitxml', 'files/report.xml']
+    # RISK_ORDER=1: ficheros por probabilidad de fallo predicha y, dentro, nodos por tasa histórica de fallo
+    risk_ordered = os.getenv('RISK_ORDER') == '1' and not record_map
+    plugin_args = ['-p', 'risk_order']
+    if risk_ordered:
+        plugin_args += ['--risk-order', write_risk_order(tests, data.get('class_probs', []),
+                                                        data.get('node_history', {}))]
+    args = ['pytest'] + tests + ['-q', '--junitxml', 'files/report.xml'] + plugin_args
+    args += ['--risk-metrics', f'{SHARD_DIR}/metrics_0.json']
     if fail_fast: args.append('-x')
+    if record_map:
+        args += ['-p', 'coverage_map', '--coverage-map', coverage_map.COVERAGE_MAP_PATH]
+
+    # STREAM_OUTPUT=1: salida en vivo y memoria acotada (sólo la cola del log)
+    stream = os.getenv('STREAM_OUTPUT') == '1'
+    # PARALLEL_SHARDS=N|auto: shards equilibrados por duración histórica, en paralelo
+    n_shards = 1 if record_map else shard_count(len(tests))
+    shards = plan_shards(tests, n_shards) if n_shards > 1 else [(0.0, tests)]
+    metric_paths = [f'{SHARD_DIR}/metrics_{i}.json' for i in range(len(shards))]
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    t0 = time.perf_counter()
+    if n_shards > 1:
+        base_args = ['-q'] + (['-x'] if fail_fast else []) + plugin_args
+        returncode = run_shards(shards, base_args, env, fail_fast, stream)
+    elif stream:
+        print('Running:', ' '.join(args), flush=True)
+        returncode, (out_tail, _) = run_streaming(args, env)
+        summary = next((ln.strip() for ln in reversed(out_tail) if ln.strip()), '')
+        print(f'pytest exit {returncode}: {summary}')
+    else:
+        print('Running:', ' '.join(args))
+        # worker caliente si está levantado; si no, un pytest nuevo
+        proc = run_in_worker(args, env) or subprocess.run(args, text=True, capture_output=True, env=env)
+        print(proc.stdout)
+        print(proc.stderr, file=sys.stderr)
+
+        with open(LOG_PATH, 'w') as f:
+            f.write(proc.stdout)
+            f.write('\n--- STDERR ---\n')
+            f.write(proc.stderr)
+        returncode = proc.returncode
+
+    metrics = record_metrics(metric_paths, tests, returncode, time.perf_counter() - t0, risk_ordered)
+    if metrics['ttff_s'] is not None:
+        print(f"Time to first failure: {metrics['ttff_s']:.3f}s (test #{metrics['first_failure_position']}, "
+              f"{metrics['first_failure']}; risk-ordered={risk_ordered}) → {METRICS_PATH}")
 
-    print('Running:', ' '.join(args))
-    proc = subprocess.run(args, text=True, capture_output=True, env=env)
-    print(proc.stdout)
-    print(proc.stderr, file=sys.stderr)
+    if use_cache:
+        stored = result_cache.store({t: k for t, k in keys.items() if t in tests}, 'files/report.xml')
+        result_cache.add_to_report('files/report.xml', cached)
+        print(f"Test result cache: {stored} passing item(s) stored, {len(cached)} reported as cached.")
+    # resultados de esta ejecución para ml/history_store.py
+    write_cases('files/report.xml')
 
-    with open('files/pytest_output.log', 'w') as f:
-        f.write(proc.stdout)
-        f.write('\n--- STDERR ---\n')
-        f.write(proc.stderr)
+    # Historial de duraciones por fichero de test (para selección con presupuesto de tiempo).
+    # Sólo ejecuciones completas: FAIL_FAST corta en el primer fallo (y termina shards), el mapa de
+    # cobertura traza cada línea, y los nodos sueltos de NODE_SELECTION no son el fichero entero.
+    if record_map or (fail_fast and returncode != 0) or returncode not in (0, 1, 5):
+        print(f"Partial or instrumented run (exit {returncode}) → test timings not updated.")
+    else:
+        update_timings('files/report.xml', items=tests)
 
-    sys.exit(proc.returncode)
+    return returncode
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main(no_cache='--no-cache' in sys.argv[1:]))
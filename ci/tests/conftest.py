@@ -0,0 +1,6 @@
+# ci/tests/conftest.py
+# Tests of the CI scripts (not the demo app suite in tests/): ci/ modules import each other by bare name
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,107 @@
+import json
+import subprocess
+
+import pytest
+
+import collect_changed_files
+from collect_changed_files import cached_diff, get_changed_range, parse_diff
+
+DIFF = """\
+:100644 100644 1111111 2222222 M\tapp/queries.sql
+:100644 100644 3333333 4444444 M\tapp/payment.py
+diff --git a/app/queries.sql b/app/queries.sql
+index 1111111..2222222 100644
+--- a/app/queries.sql
++++ b/app/queries.sql
+@@ -3,2 +2,0 @@ SELECT 1;
+--- old comment
+---- a/app/payment.py
+@@ -10 +8 @@ SELECT 2;
+-SELECT 3;
++++ b/not/a/header
++SELECT 4;
+diff --git a/app/payment.py b/app/payment.py
+index 3333333..4444444 100644
+--- a/app/payment.py
++++ b/app/payment.py
+@@ -7,0 +8 @@ def pay():
++    return 1
+"""
+
+
+def test_removed_lines_that_look_like_headers_keep_the_current_file():
+    changed, hunks = parse_diff(DIFF)
+    assert changed == ['app/queries.sql', 'app/payment.py']
+    assert hunks == {'app/queries.sql': [[3, 4], [10, 10]], 'app/payment.py': [[7, 8]]}
+
+
+def make_git(path):
+    def git(*args):
+        return subprocess.run(['git', '-C', str(path), *args], check=True, text=True,
+                              stdout=subprocess.PIPE).stdout.strip()
+
+    git('init', '-q')
+    git('config', 'user.email', 'ci@example.com')
+    git('config', 'user.name', 'ci')
+    return git
+
+
+def commit(git, path, name, text):
+    (path / name).parent.mkdir(parents=True, exist_ok=True)
+    (path / name).write_text(text)
+    git('add', '.')
+    git('commit', '-q', '-m', name)
+    return git('rev-parse', 'HEAD')
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    root = tmp_path / 'repo'
+    root.mkdir()
+    monkeypatch.chdir(root)
+    monkeypatch.setattr(collect_changed_files, 'CACHE_DIR', str(tmp_path / 'cache'))
+    for name in ('GITHUB_EVENT_NAME', 'GITHUB_EVENT_PATH', 'GITHUB_EVENT_BEFORE', 'BEFORE_SHA', 'GITHUB_BASE_REF'):
+        monkeypatch.delenv(name, raising=False)
+    return root, make_git(root)
+
+
+def test_empty_pr_diff_falls_back_to_the_last_commit(repo, tmp_path, monkeypatch):
+    root, git = repo
+    commit(git, root, 'app/a.py', 'A = 1\n')
+    head = commit(git, root, 'app/b.py', 'B = 1\n')
+    event = tmp_path / 'event.json'
+    event.write_text(json.dumps({'pull_request': {'base': {'sha': head}}}))
+    monkeypatch.setenv('GITHUB_EVENT_NAME', 'pull_request')
+    monkeypatch.setenv('GITHUB_EVENT_PATH', str(event))
+    monkeypatch.setenv('GITHUB_SHA', head)
+
+    changed, _, base, _ = get_changed_range()
+    assert changed == ['app/b.py']
+    assert base == git('rev-parse', 'HEAD~1')
+
+
+def test_memo_cache_keeps_three_dot_and_two_dot_apart(repo):
+    root, git = repo
+    commit(git, root, 'app/a.py', 'A = 1\n')
+    git('checkout', '-q', '-b', 'feature')
+    feature = commit(git, root, 'app/feature.py', 'F = 1\n')
+    git('checkout', '-q', '-')
+    main = commit(git, root, 'app/main.py', 'M = 1\n')
+
+    assert cached_diff(main, feature, True)[0] == ['app/feature.py']
+    assert cached_diff(main, feature, False)[0] == ['app/feature.py', 'app/main.py']
+    assert cached_diff(main, feature, True)[0] == ['app/feature.py']  # served from the cache
+
+
+def test_real_git_diff_of_sql_comments(tmp_path):
+    git = make_git(tmp_path)
+    (tmp_path / 'a.sql').write_text('SELECT 1;\n-- a/b.sql\n-- keep\nSELECT 2;\n')
+    (tmp_path / 'b.sql').write_text('SELECT 1;\n')
+    git('add', '.')
+    git('commit', '-q', '-m', 'base')
+    (tmp_path / 'a.sql').write_text('SELECT 1;\n-- keep\nSELECT 3;\n')
+    (tmp_path / 'b.sql').write_text('SELECT 1;\nSELECT 2;\n')
+
+    changed, hunks = parse_diff(git('diff', '--raw', '-p', '-U0', '--no-color', '--no-renames'))
+    assert changed == ['a.sql', 'b.sql']
+    assert hunks == {'a.sql': [[2, 2], [4, 4]], 'b.sql': [[1, 2]]}
@@ -0,0 +1,81 @@
+import asyncio
+import os
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('openai')
+
+from diagnose_async import diagnose_cases
+
+STUB = Path(__file__).resolve().parent.parent / 'llm_stub_server.py'
+CASE = {'nodeid': 'tests/test_payment.py::test_discount', 'name': 'test_discount', 'kind': 'failure',
+        'message': 'assert 90 == 81', 'text': 'def test_discount():\n>       assert 90 == 81\nE       assert 90 == 81\n'}
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """Start the stub on a free port with the given STUB_* settings; points the SDK at it."""
+    procs = []
+
+    def start(**settings):
+        env = {**os.environ, 'STUB_PORT': '0', 'STUB_LATENCY_MS': '0', 'STUB_HANG_S': '30',
+               **{f'STUB_{k.upper()}': str(v) for k, v in settings.items()}}
+        proc = subprocess.Popen([sys.executable, '-u', str(STUB)], env=env, stdout=subprocess.PIPE, text=True)
+        procs.append(proc)
+        url = re.search(r'(http://\S+/v1)', proc.stdout.readline()).group(1)
+        monkeypatch.setenv('OPENAI_BASE_URL', url)
+        return url
+
+    yield start
+    for proc in procs:
+        proc.kill()
+        proc.wait()
+
+
+def diagnose(**kwargs):
+    settings = {'api_key': 'stub', 'concurrency': 1, 'deadline': 20, 'timeout': 5, 'retries': 2, 'backoff': 0.01,
+                **kwargs}
+    t0 = time.perf_counter()
+    [result] = asyncio.run(diagnose_cases([CASE], 'stub', lambda text: 'rules: ' + text.splitlines()[-1],
+                                          **settings))
+    return result, time.perf_counter() - t0
+
+
+def test_answer_comes_from_the_stub(stub):
+    stub()
+    result, _ = diagnose()
+    assert result['status'] == 'llm' and result['attempts'] == 1
+    assert 'assert 90 == 81' in result['diagnosis']
+
+
+def test_hung_attempts_are_cut_at_the_timeout_then_fall_back(stub):
+    stub(hang_rate=1)
+    result, elapsed = diagnose(timeout=0.3, retries=1)
+    assert result['status'] == 'rules' and 'Timeout' in result['reason']
+    assert result['diagnosis'] == 'rules: E       assert 90 == 81'
+    assert elapsed < 5  # two attempts of 0.3 s, not the stub's 30 s hang
+
+
+def test_429_and_5xx_are_retried_with_backoff(stub):
+    # seed 37: first request 429, second 500, third answered
+    stub(rate_limit_rate=0.3, fail_rate=0.3, seed=37)
+    result, _ = diagnose(backoff=0.2)
+    assert result['status'] == 'llm' and result['attempts'] == 3
+    assert result['seconds'] >= 0.2 * 0.5 + 0.4 * 0.5  # jittered 0.2 s, then 0.4 s
+
+    stub(rate_limit_rate=1)
+    result, _ = diagnose(retries=1)
+    assert result['status'] == 'rules' and 'RateLimitError' in result['reason']
+
+
+def test_unfinished_requests_fall_back_at_the_deadline(stub):
+    stub(latency_ms=10000)
+    result, elapsed = diagnose(deadline=1.5, timeout=30)
+    assert result == {'nodeid': CASE['nodeid'], 'key': result['key'], 'status': 'rules', 'reason': 'deadline',
+                      'diagnosis': 'rules: E       assert 90 == 81'}
+    assert elapsed < 5
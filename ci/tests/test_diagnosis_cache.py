@@ -0,0 +1,32 @@
+from diagnosis_cache import normalize, traceback_signature
+
+
+def traceback(value, tmp='/tmp/pytest-of-ci/pytest-7/test_x0', line=42, addr='0x7f3a2c'):
+    return [
+        'i = 3',
+        '',
+        '    def test_wait():',
+        f'        out = run("{tmp}/data.bin", handle={addr})',
+        f'>       assert {value} s == 3 s',
+        f'E       assert {value} s == 3 s',
+        f'tests/test_wait.py:{line}: AssertionError',
+    ]
+
+
+def test_signature_ignores_paths_line_numbers_and_addresses():
+    a = traceback_signature(traceback(5), 'test_wait[3]')
+    b = traceback_signature(traceback(5, tmp='/tmp/pytest-of-ci/pytest-9/test_x1', line=57, addr='0x55aa'),
+                            'test_wait[4]')
+    assert a == b
+
+
+def test_numbers_in_assertion_messages_are_kept():
+    assert traceback_signature(traceback(5)) != traceback_signature(traceback(7))
+    assert normalize('E   AssertionError: took 250 ms, limit 100 ms') == 'E   AssertionError: took 250 ms, limit 100 ms'
+
+
+def test_pytest_durations_are_normalized():
+    assert normalize('==== 2 failed, 5 passed in 1.23s (0:00:01) ====') == '==== 2 failed, 5 passed in <dur> ===='
+    assert normalize('1 failed in 12.50s') == '1 failed in <dur>'
+    assert normalize('0.51s call     tests/test_wait.py::test_wait') == '<dur> call     tests/test_wait.py::test_wait'
+    assert normalize('E   TimeoutError: no reply in 2.00s') == 'E   TimeoutError: no reply in 2.00s'
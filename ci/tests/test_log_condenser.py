@@ -0,0 +1,43 @@
+import random
+
+from log_condenser import CHARS_PER_TOKEN, extract_failures, pack
+
+
+def fake_log(n_failures, seed=0):
+    rng = random.Random(seed)
+    lines = ['============================= test session starts ==============================\n',
+             'collected 50 items\n', '\n',
+             '=================================== FAILURES ===================================\n']
+    for i in range(n_failures):
+        kind = rng.randrange(max(1, n_failures // 2))  # algunos tracebacks se repiten
+        lines.append(f'_____________________________ test_case_{i} _____________________________\n')
+        lines += [f'    def test_case_{i}():\n'] + [f'        step_{kind}_{j}()\n' for j in range(rng.randint(1, 30))]
+        lines.append(f'E       AssertionError: kind {kind} ' + 'x' * rng.randint(0, 200) + '\n')
+        lines.append(f'tests/test_mod.py:{10 + kind}: AssertionError\n')
+        lines.append('----------------------------- Captured stdout call -----------------------------\n')
+        lines += [f'log {kind} line {j}\n' for j in range(rng.randint(0, 60))]
+    lines.append('=========================== short test summary info ============================\n')
+    lines.append('E   stray error line\n')
+    lines.append(f'========================= {n_failures} failed, 3 passed in 1.23s =========================\n')
+    return lines
+
+
+def test_pack_never_exceeds_the_budget():
+    for seed in range(20):
+        failures, stray, result = extract_failures(fake_log(random.Random(seed).randint(1, 40), seed))
+        for budget in (1, 10, 30, 60, 120, 250, 500, 1000, 4000):
+            text = pack(failures, stray, result, budget=budget)
+            assert len(text) <= budget * CHARS_PER_TOKEN, (seed, budget, len(text))
+
+
+def test_pack_prefers_frequent_failures_and_upgrades_with_budget():
+    failures, stray, result = extract_failures(fake_log(12, seed=3))
+    top = max(failures, key=lambda f: f.count)
+    small = pack(failures, stray, result, budget=len(top.compact()) // CHARS_PER_TOKEN + 40)
+    assert top.header() in small
+    assert result in small
+
+    everything = pack(failures, stray, result, budget=10**6)
+    assert all(f.full() in everything for f in failures)
+    assert 'E   stray error line' in everything
+    assert 'omitted' not in everything
@@ -0,0 +1,81 @@
+import io
+import json
+
+import pytest
+
+from diagnose_failure_llm import simple_rules_based_summary
+from log_rules import RuleSet, load_rules
+
+LOG = b"""collected 3 items
+tests/test_payment.py F
+E   AssertionError: assert 90 == 81
+E   ConnectionError: connection reset
+retrying retrying the request
+ERROR tests/test_ui.py - TimeoutError
+E   ... refused by peer
+"""
+
+
+def make_ruleset(tmp_path, rules):
+    path = tmp_path / 'rules.json'
+    path.write_text(json.dumps({'rules': rules}))
+    return RuleSet(load_rules([path]))
+
+
+def test_rules_fire_on_the_right_lines(tmp_path):
+    ruleset = make_ruleset(tmp_path, [
+        {'id': 'payment_demo', 'enabled': False},
+        {'id': 'grouped', 'any': [r'(error|failure): (\w+)'], 'hint': 'grouped'},
+        # \1 must point at this pattern's group, not at the group of the pattern before it
+        {'id': 'repeated_word', 'any': [r'\b(\w+) \1\b'], 'hint': 'repeated'},
+        {'id': 'numbers', 'any': [r'assert \d+ == \d+'], 'hint': 'numbers'},
+    ])
+    matches = ruleset.scan(io.BytesIO(LOG))
+
+    assert matches['repeated_word'] == {'hits': 1, 'first_lines': [5]}
+    assert matches['grouped'] == {'hits': 2, 'first_lines': [3, 4]}
+    assert matches['numbers'] == {'hits': 1, 'first_lines': [3]}
+    assert matches['assertion']['first_lines'] == [3]
+    # connection_refused needs both words, on any lines
+    assert matches['connection_refused']['first_lines'] == [4, 7]
+    assert matches['timeout']['first_lines'] == [6]
+    assert 'payment_demo' not in matches and 'import_error' not in matches
+
+
+def test_lines_split_across_blocks_are_matched_once(tmp_path, monkeypatch):
+    import log_rules
+    monkeypatch.setattr(log_rules, 'BLOCK_SIZE', 7)
+    ruleset = make_ruleset(tmp_path, [{'id': 'repeated_word', 'any': [r'\b(\w+) \1\b'], 'hint': 'repeated'}])
+    assert ruleset.scan(io.BytesIO(LOG))['repeated_word'] == {'hits': 1, 'first_lines': [5]}
+
+
+def test_summary_takes_log_text():
+    summary = simple_rules_based_summary(LOG.decode())
+    assert 'Parece un fallo de aserción' in summary
+    assert 'test_payment' in summary
+    assert simple_rules_based_summary('all good\n').startswith('- No se detectaron patrones comunes')
+
+
+def test_anchors_match_at_line_boundaries():
+    ruleset = RuleSet([{'id': 'anchored', 'any': [r'^E\s+assert'], 'hint': 'a'},
+                       {'id': 'at_end', 'any': [r'reset$'], 'hint': 'b'},
+                       {'id': 'not_at_start', 'any': [r'^assert'], 'hint': 'c'}])
+    matches = ruleset.scan(io.BytesIO(b'ok\nE   assert 1 == 2\nE   ConnectionError: connection reset\n'))
+    assert matches['anchored'] == {'hits': 1, 'first_lines': [2]}
+    assert matches['at_end'] == {'hits': 1, 'first_lines': [3]}
+    assert 'not_at_start' not in matches
+
+
+def test_inline_global_flags_are_searched_on_their_own():
+    ruleset = RuleSet([{'id': 'flags', 'any': [r'(?s)^E\s+assert'], 'hint': 'a'},
+                       {'id': 'plain', 'any': [r'timeout\w+'], 'hint': 'b'}])
+    matches = ruleset.scan(io.BytesIO(LOG))
+    assert matches['flags']['first_lines'] == [3]
+    assert matches['plain']['first_lines'] == [6]
+
+
+def test_invalid_rules_are_rejected(tmp_path):
+    with pytest.raises(ValueError, match="both 'any' and 'all'"):
+        make_ruleset(tmp_path, [{'id': 'mixed', 'any': ['error'], 'all': ['refused', 'peer']}])
+    with pytest.raises(ValueError, match='invalid rule pattern'):
+        RuleSet([{'id': 'broken', 'any': [r'error (']}])
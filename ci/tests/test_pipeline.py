@@ -0,0 +1,66 @@
+import json
+
+import pipeline
+from pipeline import Pipeline, budget_durations
+
+
+def run_stage(pipe, inputs, output, calls, **kwargs):
+    def fn():
+        calls.append(1)
+        output.write_text(str(len(calls)))
+        return len(calls)
+    return pipe.stage('step', inputs, [output], fn, **kwargs)
+
+
+def test_stage_is_skipped_until_inputs_or_outputs_change(tmp_path):
+    state, calls, out = {}, [], tmp_path / 'out.txt'
+    assert run_stage(Pipeline(state), {'a': 1}, out, calls) == 1
+    assert run_stage(Pipeline(state), {'a': 1}, out, calls) == 1
+    assert run_stage(Pipeline(state), {'a': 2}, out, calls) == 2
+    out.write_text('edited by hand')
+    assert run_stage(Pipeline(state), {'a': 2}, out, calls) == 3
+    assert run_stage(Pipeline(state, force=True), {'a': 2}, out, calls) == 4
+    assert len(calls) == 4
+
+
+def test_stage_reuse_honours_reusable_and_refresh(tmp_path):
+    state, calls, out = {}, [], tmp_path / 'out.txt'
+    run_stage(Pipeline(state), {}, out, calls)
+    # tests stage: only a passing run is reused
+    assert run_stage(Pipeline(state), {}, out, calls, reusable=lambda code: code == 0) == 2
+
+    def refresh(result):
+        out.write_text('refreshed')
+        return result * 10
+    assert run_stage(Pipeline(state), {}, out, calls, refresh=refresh) == 20
+    # the refreshed output is the one recorded: the next run still reuses it
+    assert run_stage(Pipeline(state), {}, out, calls) == 20
+    assert len(calls) == 2
+
+
+def test_budget_durations_are_the_exact_knapsack_inputs(tmp_path):
+    timings = tmp_path / 'timings.json'
+    timings.write_text(json.dumps({'tests': {'t2': {'duration_s': 1.234}, 't1': {'duration_s': 0.5}}}))
+    assert budget_durations(timings, None) is None
+    before = budget_durations(timings, '10')
+    assert before == {'t1': 0.5, 't2': 1.234}
+    # a change far below any rounding unit still changes the key
+    timings.write_text(json.dumps({'tests': {'t2': {'duration_s': 1.235}, 't1': {'duration_s': 0.5}}}))
+    assert pipeline.fingerprint(budget_durations(timings, '10')) != pipeline.fingerprint(before)
+
+
+def test_reused_decision_gets_current_runtime_and_catch_rate(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'files').mkdir()
+    (tmp_path / 'files' / 'test_timings.json').write_text(json.dumps(
+        {'tests': {'tests/a.py': {'duration_s': 3.0}, 'tests/b.py': {'duration_s': 5.0}}}))
+    decision = {'selected_tests': ['tests/a.py'], 'time_budget_s': 4.0,
+                'class_probs': [{'label': 'tests/a.py', 'prob': 0.6}, {'label': 'tests/b.py', 'prob': 0.2}],
+                'expected_catch_rate': 0.0, 'predicted_runtime_s': 1.0, 'over_budget_s': 0.0}
+
+    refreshed = pipeline.refresh_decision(decision)
+    assert refreshed['predicted_runtime_s'] == 3.0
+    assert abs(refreshed['expected_catch_rate'] - 0.75) < 1e-9
+    assert refreshed['over_budget_s'] == 0.0
+    assert json.loads((tmp_path / 'files' / 'selected_tests.json').read_text()) == refreshed
+    assert pipeline.refresh_decision(None) is None
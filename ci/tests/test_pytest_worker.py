@@ -0,0 +1,88 @@
+import gc
+import os
+import stat
+import sys
+import weakref
+
+import pytest
+
+from pytest_worker import Preloaded, WorkerServer, check_args
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    (tmp_path / 'warmpkg').mkdir()
+    (tmp_path / 'warmpkg' / '__init__.py').write_text('')
+    # module ↔ globals cycle: only the cyclic gc can free it, never while it sits in the frozen generation
+    (tmp_path / 'warmpkg' / 'core.py').write_text('import sys\nVALUE = 1\nSELF = sys.modules[__name__]\n')
+    (tmp_path / 'warmdep.py').write_text('LOADED = True\n')
+    (tmp_path / 'tests').mkdir()
+    (tmp_path / 'tests' / 'conftest.py').write_text('import warmpkg\n')
+    (tmp_path / 'tests' / 'helpers.py').write_text('')
+    (tmp_path / 'tests' / 'test_a.py').write_text('import warmdep\nimport helpers\nfrom warmpkg.core import VALUE\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield tmp_path
+    gc.unfreeze()
+    for name in [n for n in sys.modules if n.split('.')[0] in ('warmpkg', 'warmdep', 'helpers', 'test_a')]:
+        del sys.modules[name]
+
+
+def test_test_dependencies_are_preloaded_but_not_the_test_modules(tree):
+    preloaded = Preloaded(packages=('warmpkg',), test_dirs=('tests',), root=tree)
+    preloaded.load()
+    assert preloaded.load_test_deps() == ['warmdep']
+    assert 'warmdep' in sys.modules
+    assert 'test_a' not in sys.modules and 'helpers' not in sys.modules
+    assert preloaded.load_test_deps() == []  # unchanged mtimes: nothing re-scanned
+
+
+def test_reload_releases_replaced_modules_from_the_permanent_generation(tree):
+    preloaded = Preloaded(packages=('warmpkg',), test_dirs=('tests',), root=tree)
+    preloaded.load()
+    gc.freeze()
+    old = weakref.ref(sys.modules['warmpkg.core'])
+
+    (tree / 'warmpkg' / 'core.py').write_text('import sys\nVALUE = 2\nSELF = sys.modules[__name__]\n')
+    assert 'warmpkg.core' in preloaded.refresh()
+    assert sys.modules['warmpkg.core'].VALUE == 2
+    assert old() is None
+    assert gc.get_freeze_count() > 0
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'test_env.py').write_text(
+        "import os\n\ndef test_env():\n    assert 'EVIL' not in os.environ\n    assert os.environ['CI'] == 'yes'\n")
+    (tmp_path / 'test_hang.py').write_text('import time\n\ndef test_hang():\n    time.sleep(60)\n')
+    srv = WorkerServer(str(tmp_path / 'w.sock'), Preloaded(packages=(), test_dirs=()), output_dir='out')
+    yield srv
+    srv.server_close()
+
+
+def test_socket_and_outputs_are_private_to_the_owner(server, tmp_path):
+    assert stat.S_IMODE(os.stat(tmp_path / 'w.sock').st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(tmp_path / 'out').st_mode) == 0o700
+
+
+def test_run_gets_only_whitelisted_env_and_worker_owned_outputs(server, tmp_path, capsys):
+    with capsys.disabled():  # the child writes to fds 1/2, as under a real worker
+        resp = server.dispatch({'args': ['test_env.py', '-q', '-p', 'no:cacheprovider'], 'cwd': str(tmp_path),
+                                'env': {'EVIL': '1', 'CI': 'yes'}, 'stdout': '/etc/passwd'})
+    assert resp['returncode'] == 0 and not resp['timed_out']
+    assert os.path.dirname(resp['stdout']) == str(tmp_path / 'out')
+    assert '1 passed' in open(resp['stdout']).read()
+
+
+def test_foreign_cwd_and_plugins_are_rejected(server, tmp_path):
+    assert 'error' in server.dispatch({'args': [], 'cwd': '/'})
+    for args in (['-p', 'evil'], ['-pevil']):
+        with pytest.raises(ValueError, match='evil'):
+            server.dispatch({'args': args, 'cwd': str(tmp_path)})
+    check_args(['-p', 'risk_order', '-p', 'no:cacheprovider'])
+
+
+def test_wedged_run_is_killed_after_its_timeout(server, tmp_path):
+    resp = server.dispatch({'args': ['test_hang.py', '-q', '-p', 'no:cacheprovider'], 'timeout': 0.5})
+    assert resp['timed_out'] and resp['returncode'] < 0
+    assert resp['elapsed_s'] < 10
@@ -0,0 +1,30 @@
+import result_cache
+
+REPORT = """<?xml version="1.0" encoding="utf-8"?>
+<testsuites><testsuite name="pytest" tests="4" failures="1" errors="0" skipped="0">
+<testcase classname="tests.test_mod.TestA" name="test_x" time="0.1"/>
+<testcase classname="tests.test_mod.TestB" name="test_x" time="0.1"><failure message="boom">E boom</failure></testcase>
+<testcase classname="tests.test_mod" name="test_p[1]" time="0.1"/>
+<testcase classname="tests.test_mod" name="test_p[2]" time="0.1"/>
+</testsuite></testsuites>
+"""
+
+
+def test_store_keeps_same_named_methods_of_different_classes_apart(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'tests').mkdir()
+    (tmp_path / 'tests' / 'test_mod.py').write_text('')
+    (tmp_path / 'report.xml').write_text(REPORT)
+    keys = {
+        'tests/test_mod.py::TestA::test_x': 'a',
+        'tests/test_mod.py::TestB::test_x': 'b',
+        'tests/test_mod.py::TestA': 'class-a',
+        'tests/test_mod.py::test_p': 'p',
+        'tests/test_mod.py': 'file',
+    }
+
+    assert result_cache.store(keys, 'report.xml', cache_dir='cache') == 3
+    hits = result_cache.lookup(keys, cache_dir='cache')
+    assert set(hits) == {'tests/test_mod.py::TestA::test_x', 'tests/test_mod.py::TestA', 'tests/test_mod.py::test_p'}
+    assert [c['classname'] for c in hits['tests/test_mod.py::TestA::test_x']['cases']] == ['tests.test_mod.TestA']
+    assert [c['name'] for c in hits['tests/test_mod.py::test_p']['cases']] == ['test_p[1]', 'test_p[2]']
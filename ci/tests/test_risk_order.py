@@ -0,0 +1,57 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+from risk_order import failure_rate, node_key, order_items
+from run_selected_tests import write_risk_order
+
+CI_DIR = str(Path(__file__).resolve().parent.parent)
+
+
+def ids(items):
+    return [item.nodeid for item in items]
+
+
+def test_files_by_predicted_probability_then_nodes_by_failure_rate():
+    items = [SimpleNamespace(nodeid=n) for n in (
+        'tests/a.py::test_1', 'tests/a.py::test_2', 'tests/a.py::TestX::test_3',
+        'tests/b.py::test_1', 'tests/b.py::test_2', 'tests/c.py::test_1')]
+    files = {'tests/b.py': 0.7, 'tests/a.py': 0.2}
+    # a.py::test_1 reliable, a.py::test_2 unseen (prior 0.5), TestX::test_3 flaky (keyed without the class)
+    nodes = {'tests/a.py::test_1': failure_rate(20, 0), 'tests/a.py::test_3': failure_rate(4, 3),
+             'tests/b.py::test_2': failure_rate(2, 2)}
+    assert ids(order_items(items, files, nodes)) == [
+        'tests/b.py::test_2', 'tests/b.py::test_1',
+        'tests/a.py::TestX::test_3', 'tests/a.py::test_2', 'tests/a.py::test_1',
+        'tests/c.py::test_1']
+    # without data: collection order
+    assert ids(order_items(items, {}, {})) == ids(items)
+    assert node_key('tests/a.py::TestX::test_3[1]') == 'tests/a.py::test_3[1]'
+
+
+def test_risk_order_file_keeps_only_the_selected_files_nodes(tmp_path):
+    path = write_risk_order(['tests/a.py::test_1', 'tests/b.py'],
+                            [{'label': 'tests/a.py', 'prob': 0.4}, {'label': 'tests/b.py', 'prob': 0.1}],
+                            {'tests/a.py::test_1': [8, 2], 'tests/c.py::test_9': [1, 1]},
+                            path=str(tmp_path / 'risk.json'))
+    assert json.loads(Path(path).read_text()) == {
+        'files': {'tests/a.py': 0.4, 'tests/b.py': 0.1}, 'nodes': {'tests/a.py::test_1': 0.3}}
+
+
+def test_plugin_runs_the_riskiest_test_first_and_records_the_first_failure(tmp_path):
+    (tmp_path / 'test_low.py').write_text('def test_ok():\n    pass\n')
+    (tmp_path / 'test_high.py').write_text('def test_ok():\n    pass\n\ndef test_bad():\n    assert False\n')
+    (tmp_path / 'risk.json').write_text(json.dumps({
+        'files': {'test_high.py': 0.9, 'test_low.py': 0.1}, 'nodes': {'test_high.py::test_bad': 0.8}}))
+    proc = subprocess.run(
+        [sys.executable, '-m', 'pytest', 'test_low.py', 'test_high.py', '-v', '-p', 'no:cacheprovider',
+         '-p', 'risk_order', '--risk-order', 'risk.json', '--risk-metrics', 'metrics.json'],
+        cwd=tmp_path, env={**os.environ, 'PYTHONPATH': CI_DIR}, capture_output=True, text=True)
+    order = [ln.split()[0] for ln in proc.stdout.splitlines() if ln.startswith('test_') and '::' in ln]
+    assert order == ['test_high.py::test_bad', 'test_high.py::test_ok', 'test_low.py::test_ok']
+    metrics = json.loads((tmp_path / 'metrics.json').read_text())
+    assert metrics['risk_ordered'] and metrics['first_failure'] == 'test_high.py::test_bad'
+    assert metrics['first_failure_position'] == 1 and metrics['tests_started'] == 3
@@ -0,0 +1,61 @@
+import io
+import os
+import sys
+import time
+from collections import deque
+from pathlib import Path
+
+import run_selected_tests
+from run_selected_tests import plan_shards, run_shards, run_streaming, tee
+
+CI_DIR = str(Path(__file__).resolve().parent.parent)
+
+
+def test_lpt_puts_the_longest_test_on_the_least_loaded_shard(monkeypatch):
+    timings = {'a': 5.0, 'b': 4.0, 'c': 3.0, 'd': 3.0, 'e': 2.0}
+    monkeypatch.setattr(run_selected_tests, 'load_timings',
+                        lambda: {'tests': {t: {'duration_s': d} for t, d in timings.items()}})
+    # a → 0, b → 1, d → 1, c → 0, f (unseen: the median, 3 s) → 1, e → 0
+    assert plan_shards(['e', 'd', 'c', 'b', 'a', 'f'], 2) == [(10.0, ['a', 'c', 'e']), (10.0, ['b', 'd', 'f'])]
+    # the nodes of a file share its time
+    assert plan_shards(['a::x', 'a::y', 'b'], 2) == [(4.0, ['b']), (5.0, ['a::x', 'a::y'])]
+    assert plan_shards(['a', 'b'], 3) == [(5.0, ['a']), (4.0, ['b'])]
+
+
+def test_fail_fast_cancels_the_other_shards(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'test_fails.py').write_text('def test_fails():\n    assert False\n')
+    (tmp_path / 'test_slow.py').write_text('import time\n\ndef test_slow():\n    time.sleep(60)\n')
+    env = {**os.environ, 'PYTHONPATH': CI_DIR}
+    base_args = ['-q', '-x', '-p', 'risk_order', '-p', 'no:cacheprovider']
+
+    t0 = time.perf_counter()
+    code = run_shards([(1.0, ['test_fails.py']), (60.0, ['test_slow.py'])], base_args, env, fail_fast=True,
+                      log_path=str(tmp_path / 'log.txt'))
+    assert code == 1
+    assert time.perf_counter() - t0 < 30
+    log = (tmp_path / 'log.txt').read_text()
+    assert '=== shard 1/2: exit 1 ===' in log and '=== shard 2/2: cancelled (FAIL_FAST) ===' in log
+    assert 'test_fails' in (tmp_path / 'files' / 'report.xml').read_text()
+
+
+def test_tee_keeps_every_line_in_the_sinks_but_only_the_tail_in_memory():
+    lines = [f'line {i}\n' for i in range(1000)]
+    sink, console, tail = io.StringIO(), io.StringIO(), deque(maxlen=5)
+    tee(io.StringIO(''.join(lines)), [sink], tail, console, prefix='[shard 1] ')
+    assert sink.getvalue() == ''.join(lines)
+    assert console.getvalue().splitlines()[-1] == '[shard 1] line 999'
+    assert list(tail) == lines[-5:]
+
+
+def test_streamed_run_writes_the_whole_log_and_returns_a_bounded_tail(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(run_selected_tests, 'TAIL_LINES', 10)
+    script = 'import sys\nfor i in range(500): print(f"out {i}")\nprint("boom", file=sys.stderr)\nsys.exit(3)\n'
+    log = tmp_path / 'log.txt'
+    code, (out_tail, err_tail) = run_streaming([sys.executable, '-c', script], dict(os.environ), log_path=str(log))
+    assert code == 3
+    assert len(out_tail) == 10 and out_tail[-1] == 'out 499\n'
+    assert list(err_tail) == ['boom\n']
+    text = log.read_text()
+    assert text.startswith('out 0\n') and 'out 499\n' in text and text.endswith('--- STDERR ---\nboom\n')
+    assert 'out 250' in capsys.readouterr().out  # also shown live
@@ -0,0 +1,63 @@
+# ci/timing_history.py
+"""Per-test-file duration history built from the JUnit reports pytest writes.
+
+``files/test_timings.json`` keeps an exponentially weighted average per test
+file so ml/predict_tests.py can plan selections under a wall-clock budget.
+"""
+import json
+import os
+from pathlib import Path
+
+from junit_report import iter_cases
+
+TIMINGS_PATH = os.getenv('TIMINGS_PATH', 'files/test_timings.json')
+EWMA_ALPHA = 0.3
+
+
+def file_durations(report_path):
+    """Total testcase time per test file in one JUnit report."""
+    totals = {}
+    for case in iter_cases(report_path, traceback_chars=0):
+        if case['skip_type'] == 'ai-ci-cache':
+            continue  # not run: served from ci/result_cache.py
+        totals[case['file']] = totals.get(case['file'], 0.0) + case['time']
+    return totals
+
+
+def load_timings(timings_path=TIMINGS_PATH):
+    if not os.path.exists(timings_path):
+        return {'tests': {}}
+    with open(timings_path) as f:
+        return json.load(f)
+
+
+def covers(items, test_file):
+    """True if one of the selected ``items`` (files or directories, not node IDs) is ``test_file`` or contains it."""
+    return any(test_file == item or test_file.startswith(item.rstrip('/') + '/') for item in items)
+
+
+def update_timings(report_path='files/report.xml', timings_path=TIMINGS_PATH, alpha=EWMA_ALPHA, items=None):
+    """Fold a report into the averages; with ``items``, only test files run whole by them are recorded."""
+    if not os.path.exists(report_path):
+        return None
+    durations = file_durations(report_path)
+    if items is not None:
+        # un fichero del que sólo corrieron algunos nodos arrastraría la media hacia abajo
+        whole = [item for item in items if '::' not in item]
+        durations = {f: s for f, s in durations.items() if covers(whole, f)}
+    if not durations:
+        return None
+    data = load_timings(timings_path)
+    tests = data.setdefault('tests', {})
+    for test_file, seconds in durations.items():
+        rec = tests.get(test_file)
+        if rec is None:
+            tests[test_file] = {'duration_s': seconds, 'last_s': seconds, 'runs': 1}
+        else:
+            rec['duration_s'] = alpha * seconds + (1 - alpha) * rec['duration_s']
+            rec['last_s'] = seconds
+            rec['runs'] += 1
+    Path(timings_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(timings_path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    return data
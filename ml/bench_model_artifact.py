@@ -0,0 +1,98 @@
+# ml/bench_model_artifact.py
+"""Compare the joblib pickle with the flat (mmap) export of the selector.
+
+Each artifact is loaded in a fresh interpreter so the numbers reflect a cold
+CI step: import + load time, peak RSS, single-row and batch latency. Also
+checks that both produce the same probabilities.
+
+    python ml/bench_model_artifact.py            # MODEL_PATH / BENCH_RUNS / BENCH_BATCH
+"""
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from flat_forest import flat_path_for
+
+ML_DIR = Path(__file__).resolve().parent
+
+CHILD = r'''
+import json, resource, sys, time
+t0 = time.perf_counter()
+import numpy as np
+kind, path, runs, batch = sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4])
+if kind == 'flat':
+    from flat_forest import FlatForest
+else:
+    import joblib
+t1 = time.perf_counter()
+if kind == 'flat':
+    model = FlatForest(path)
+else:
+    model = joblib.load(path)
+    model.n_jobs = 1
+t2 = time.perf_counter()
+
+rng = np.random.default_rng(0)
+n_features = model.n_features_in_
+X = (rng.random((batch, n_features)) < 0.3).astype(np.float32)
+X[:, -2] = rng.integers(10, 120, batch)
+X[:, -1] = rng.integers(0, 7, batch)
+
+single = []
+for i in range(runs):
+    s = time.perf_counter()
+    model.predict_proba(X[i % batch:i % batch + 1])
+    single.append(time.perf_counter() - s)
+s = time.perf_counter()
+proba = model.predict_proba(X)
+batch_s = time.perf_counter() - s
+
+json.dump({
+    'import_s': t1 - t0,
+    'load_s': t2 - t1,
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'single_ms_p50': sorted(single)[len(single) // 2] * 1000,
+    'batch_ms': batch_s * 1000,
+    'proba': proba.tolist(),
+}, sys.stdout)
+'''
+
+
+def run_child(kind, path, runs, batch):
+    out = subprocess.run(
+        [sys.executable, '-c', CHILD, kind, path, str(runs), str(batch)],
+        check=True, text=True, stdout=subprocess.PIPE, cwd=ML_DIR,
+    )
+    return json.loads(out.stdout)
+
+
+def main():
+    model_path = os.path.abspath(os.getenv('MODEL_PATH', 'files/model_rf.pkl'))
+    flat_path = flat_path_for(model_path)
+    runs = int(os.getenv('BENCH_RUNS', '50'))
+    batch = int(os.getenv('BENCH_BATCH', '1000'))
+    if not (os.path.exists(model_path) and os.path.exists(flat_path)):
+        print(f"Need both {model_path} and {flat_path}; run ml/train_test_selector.py first.")
+        return 1
+
+    results = {
+        'joblib': run_child('joblib', model_path, runs, batch),
+        'flat': run_child('flat', flat_path, runs, batch),
+    }
+    same = results['joblib'].pop('proba') == results['flat'].pop('proba')
+
+    print("=== Model artifact benchmark ===")
+    print(f"{'artifact':<8} {'size MB':>8} {'import s':>9} {'load s':>8} {'max RSS MB':>11} "
+          f"{'1-row ms p50':>13} {f'{batch}-row ms':>12}")
+    for kind, path in (('joblib', model_path), ('flat', flat_path)):
+        r = results[kind]
+        print(f"{kind:<8} {os.path.getsize(path) / 2**20:>8.1f} {r['import_s']:>9.3f} {r['load_s']:>8.3f} "
+              f"{r['max_rss_mb']:>11.1f} {r['single_ms_p50']:>13.3f} {r['batch_ms']:>12.1f}")
+    print(f"Identical probabilities: {same}")
+    return 0 if same else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+# ml/benchmark_models.py
+"""Model-selection benchmark for the test selector.
+
+Trains every candidate on the same featurized data in a process pool, then
+measures served single-row and batch latency in the parent, one candidate at
+a time, and reports them with training time, artifact size and
+classification metrics. With ``PROMOTE=1`` the best macro-F1 candidate whose
+single-row latency meets ``LATENCY_SLO_MS`` becomes the artifact
+ml/predict_tests.py loads (and the model later trainings build).
+
+    python ml/benchmark_models.py            # BENCH_WORKERS, BENCH_RUNS, SYNTH_ROWS / SYNTH_SHARDS_DIR
+"""
+import json
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from operator import methodcaller
+from pathlib import Path
+
+from flat_forest import FlatForest, export_forest, flat_path_for, is_flat_exportable
+
+PROMOTED_PATH = 'files/promoted_model.json'
+BENCH_DIR = os.getenv('BENCH_DIR', 'files/bench_models')
+
+
+def _densify():
+    # HistGradientBoosting / GaussianNB need dense input; predict_tests always passes CSR
+    from sklearn.preprocessing import FunctionTransformer
+    return FunctionTransformer(methodcaller('toarray'), accept_sparse=True)
+
+
+def _rf(n_estimators, max_depth):
+    def build():
+        from train_test_selector import make_classifier
+        return make_classifier(n_estimators=n_estimators, max_depth=max_depth, n_jobs=1)
+    return build
+
+
+def _hgb():
+    from sklearn.ensemble import HistGradientBoostingClassifier
+    from sklearn.pipeline import make_pipeline
+    return make_pipeline(_densify(), HistGradientBoostingClassifier(max_iter=200, class_weight='balanced', random_state=7))
+
+
+def _logreg():
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import MaxAbsScaler
+    return make_pipeline(MaxAbsScaler(), LogisticRegression(max_iter=1000, class_weight='balanced'))
+
+
+def _naive_bayes():
+    from sklearn.naive_bayes import GaussianNB
+    from sklearn.pipeline import make_pipeline
+    return make_pipeline(_densify(), GaussianNB())
+
+
+CANDIDATES = {
+    'rf_500_d10': _rf(500, 10),
+    'rf_200_d10': _rf(200, 10),
+    'rf_100_d8': _rf(100, 8),
+    'rf_50_d6': _rf(50, 6),
+    'hist_gb': _hgb,
+    'logreg': _logreg,
+    'naive_bayes': _naive_bayes,
+}
+
+
+def build_candidate(name):
+    return CANDIDATES[name]()
+
+
+def _latency_ms(predict, X, runs):
+    samples = []
+    for i in range(runs):
+        row = X[i % X.shape[0]:i % X.shape[0] + 1]
+        t0 = time.perf_counter()
+        predict(row)
+        samples.append(time.perf_counter() - t0)
+    return sorted(samples)[len(samples) // 2] * 1000
+
+
+def train_candidate(name, X_train, y_train, X_test, y_test, out_dir):
+    """Fit, save and score one candidate (runs in a pool worker; no latency measured here)."""
+    from sklearn.metrics import classification_report
+
+    model = build_candidate(name)
+    t0 = time.perf_counter()
+    model.fit(X_train, y_train)
+    train_s = time.perf_counter() - t0
+
+    path = Path(out_dir) / f'{name}.pkl'
+    with open(path, 'wb') as f:
+        pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+    size = path.stat().st_size
+
+    # served artifact: forests are scored through the flat export, like predict_tests.py does
+    flat = None
+    if is_flat_exportable(model):
+        flat = export_forest(model, flat_path_for(str(path)))
+        size = os.path.getsize(flat)
+
+    y_pred = model.predict(X_test)
+    report = classification_report(y_test, y_pred, digits=3, zero_division=0, output_dict=True)
+    return {
+        'name': name,
+        'path': str(path),
+        'served_path': str(flat) if flat else None,
+        'train_s': train_s,
+        'size_mb': size / 2**20,
+        'accuracy': report['accuracy'],
+        'macro_f1': report['macro avg']['f1-score'],
+        'weighted_f1': report['weighted avg']['f1-score'],
+        'report': classification_report(y_test, y_pred, digits=3, zero_division=0),
+    }
+
+
+def measure_latency(result, X_test, runs):
+    """Single-row and batch latency of a trained candidate's served artifact.
+
+    Called in the parent once the pool has finished, one candidate at a time,
+    so the numbers that gate ``LATENCY_SLO_MS`` do not depend on what else was
+    training on the same cores.
+    """
+    if result['served_path']:
+        served = FlatForest(result['served_path'])
+    else:
+        with open(result['path'], 'rb') as f:
+            served = pickle.load(f)
+    single_ms = _latency_ms(served.predict_proba, X_test, runs)
+    t0 = time.perf_counter()
+    served.predict_proba(X_test)
+    batch_us = (time.perf_counter() - t0) / X_test.shape[0] * 1e6
+    return {**result, 'single_row_ms': single_ms, 'batch_us_per_row': batch_us}
+
+
+def load_dataset():
+    from sklearn.model_selection import train_test_split
+    from features import FileFeatureEncoder, discover_files
+    from train_test_selector import FILES, featurize, load_shards, make_example
+
+    shard_dir = os.getenv('SYNTH_SHARDS_DIR')
+    df = load_shards(shard_dir)[0] if shard_dir else make_example(n=int(os.getenv('SYNTH_ROWS', '20000')))
+    encoder = FileFeatureEncoder(discover_files(os.getenv('APP_DIR', 'app')) or FILES,
+                                 dir_features=os.getenv('DIR_FEATURES') == '1')
+    X, y = featurize(df, encoder), df['failed_test']
+    return encoder, train_test_split(X, y, test_size=0.2, random_state=7, stratify=y)
+
+
+def promote(result, encoder, model_path, mapping_path, slo_ms):
+    import shutil
+    from train_test_selector import TESTS
+
+    shutil.copyfile(result['path'], model_path)
+    flat_src, flat_dest = flat_path_for(result['path']), flat_path_for(model_path)
+    if os.path.exists(flat_src):
+        shutil.copyfile(flat_src, flat_dest)
+    elif os.path.exists(flat_dest):
+        os.remove(flat_dest)  # stale flat export would shadow the promoted pickle
+    with open(mapping_path, 'w') as f:
+        json.dump({**encoder.to_meta(), 'tests': TESTS}, f, indent=2)
+    with open(PROMOTED_PATH, 'w') as f:
+        json.dump({
+            'candidate': result['name'],
+            'latency_slo_ms': slo_ms,
+            **{k: v for k, v in result.items() if k not in ('path', 'served_path', 'report')},
+        }, f, indent=2)
+
+
+def main():
+    names = [n.strip() for n in os.getenv('BENCH_CANDIDATES', ','.join(CANDIDATES)).split(',') if n.strip()]
+    workers = int(os.getenv('BENCH_WORKERS', str(os.cpu_count() or 1)))
+    runs = int(os.getenv('BENCH_RUNS', '50'))
+    slo_ms = float(os.getenv('LATENCY_SLO_MS', '5'))
+
+    encoder, (X_train, X_test, y_train, y_test) = load_dataset()
+    Path(BENCH_DIR).mkdir(parents=True, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=min(workers, len(names))) as pool:
+        futures = [pool.submit(train_candidate, n, X_train, y_train, X_test, y_test, BENCH_DIR)
+                   for n in names]
+        trained = [f.result() for f in futures]
+    # latencia medida después, en serie y con los núcleos libres: es lo que decide el SLO
+    results = [measure_latency(r, X_test, runs) for r in trained]
+
+    print("=== Model selection benchmark ===")
+    print(f"{'candidate':<12} {'train s':>8} {'1-row ms':>9} {'batch us/row':>13} {'size MB':>8} "
+          f"{'accuracy':>9} {'macro F1':>9}")
+    for r in results:
+        print(f"{r['name']:<12} {r['train_s']:>8.2f} {r['single_row_ms']:>9.3f} {r['batch_us_per_row']:>13.1f} "
+              f"{r['size_mb']:>8.2f} {r['accuracy']:>9.3f} {r['macro_f1']:>9.3f}")
+    for r in results:
+        print(f"\n--- {r['name']} ---\n{r['report']}")
+
+    eligible = [r for r in results if r['single_row_ms'] <= slo_ms]
+    if not eligible:
+        print(f"No candidate meets the {slo_ms} ms single-row latency SLO.")
+        return 1
+    best = max(eligible, key=lambda r: r['macro_f1'])
+    print(f"Best under {slo_ms} ms SLO: {best['name']} (macro F1 {best['macro_f1']:.3f}, "
+          f"{best['single_row_ms']:.3f} ms/row)")
+
+    if os.getenv('PROMOTE') == '1':
+        model_path = os.getenv('MODEL_PATH', 'files/model_rf.pkl')
+        promote(best, encoder, model_path, 'files/test_index.json', slo_ms)
+        print(f"Promoted {best['name']} → {model_path} (recorded in {PROMOTED_PATH})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+# ml/features.py
+"""Sparse (CSR) feature encoding shared by training and prediction.
+
+One pass over the changed-file lists: every row costs O(files changed in that
+commit), independent of how many source files the repo has.
+"""
+from pathlib import Path
+
+NUMERIC_FEATURES = ['commit_msg_len', 'weekday']
+
+
+def discover_files(root='app', suffix='.py'):
+    """Source files under ``root`` (posix paths, sorted), skipping package ``__init__`` files."""
+    base = Path(root)
+    if not base.is_dir():
+        return []
+    return sorted(p.as_posix() for p in base.rglob(f'*{suffix}') if p.name != '__init__.py')
+
+
+def parent_dirs(path):
+    """``'app/sub/x.py'`` -> ``['app', 'app/sub']``."""
+    parts = path.split('/')[:-1]
+    return ['/'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+
+class FileFeatureEncoder:
+    """Maps changed-file sets (+ commit metadata) to a CSR matrix.
+
+    Column layout: one column per known file, then (optionally) one per
+    directory, then ``NUMERIC_FEATURES``. A changed file outside the
+    vocabulary still lights up its directory columns.
+    """
+
+    def __init__(self, files, dir_features=False):
+        self.files = list(files)
+        self.dir_features = bool(dir_features)
+        self.dirs = sorted({d for f in self.files for d in parent_dirs(f)}) if self.dir_features else []
+        self.file_index = {f: i for i, f in enumerate(self.files)}
+        self.dir_index = {d: len(self.files) + i for i, d in enumerate(self.dirs)}
+        self.numeric_offset = len(self.files) + len(self.dirs)
+        self.n_features = self.numeric_offset + len(NUMERIC_FEATURES)
+        self._dir_cols = {}
+
+    @classmethod
+    def from_meta(cls, meta):
+        return cls(meta['files'], dir_features=meta.get('dir_features', False))
+
+    def to_meta(self):
+        return {'files': self.files, 'dir_features': self.dir_features}
+
+    @property
+    def feature_names(self):
+        return ([f'file_{f}' for f in self.files] + [f'dir_{d}' for d in self.dirs]
+                + list(NUMERIC_FEATURES))
+
+    def _cols_for_dirs(self, path):
+        cols = self._dir_cols.get(path)
+        if cols is None:
+            cols = [self.dir_index[d] for d in parent_dirs(path) if d in self.dir_index]
+            self._dir_cols[path] = cols
+        return cols
+
+    def encode_row(self, changed, commit_msg_len=50, weekday=2):
+        """Sorted ``(column, value)`` pairs for one commit."""
+        cols = set()
+        for f in changed:
+            i = self.file_index.get(f)
+            if i is not None:
+                cols.add(i)
+            if self.dir_index:
+                cols.update(self._cols_for_dirs(f))
+        entries = [(c, 1) for c in sorted(cols)]
+        for j, value in enumerate((commit_msg_len, weekday)):
+            if value:
+                entries.append((self.numeric_offset + j, int(value)))
+        return entries
+
+    def transform(self, changed_sets, commit_msg_len=None, weekday=None):
+        """CSR matrix with one row per changed-file set.
+
+        ``commit_msg_len``/``weekday`` are per-row sequences; ``None`` uses the
+        prediction defaults (50, 2).
+        """
+        import numpy as np
+        from scipy.sparse import csr_matrix
+
+        indptr, indices, data = [0], [], []
+        for r, changed in enumerate(changed_sets):
+            msg_len = 50 if commit_msg_len is None else commit_msg_len[r]
+            day = 2 if weekday is None else weekday[r]
+            for c, v in self.encode_row(changed, msg_len, day):
+                indices.append(c)
+                data.append(v)
+            indptr.append(len(indices))
+        return csr_matrix(
+            (np.asarray(data, dtype=np.float32), np.asarray(indices, dtype=np.int32), np.asarray(indptr, dtype=np.int64)),
+            shape=(len(indptr) - 1, self.n_features),
+        )
@@ -0,0 +1,237 @@
+# ml/flat_forest.py
+"""Flat, memory-mappable export of a tree ensemble classifier.
+
+File layout (little endian)::
+
+    b'TSFF' | uint32 version | uint32 header_len | header JSON | arrays (8-byte aligned)
+
+The JSON header lists classes, sizes and the offset/dtype/count of each array:
+``roots`` (int32, first node of every tree), ``feature`` (int32, -1 on leaves),
+``threshold`` (float64), ``left``/``right`` (int32, global node ids; leaves
+point to themselves, so a fixed number of steps always lands on a leaf) and ``value`` (float64, n_nodes x n_classes, per-node class
+distribution exactly as ``DecisionTreeClassifier.predict_proba`` returns it).
+Loading is an ``mmap`` plus zero-copy views, so cold start does not depend on
+the size of the forest. A handful of rows can be scored with the standard
+library alone (``FlatForest.predict_proba_rows``), which keeps NumPy and SciPy
+out of a single prediction's startup.
+"""
+import array
+import json
+import mmap
+import struct
+import sys
+
+MAGIC = b'TSFF'
+FORMAT_VERSION = 1
+_PREAMBLE = struct.Struct('<4sII')
+_ALIGN = 8
+_TYPECODES = {'<i4': 'i', '<f8': 'd'}  # dtype del fichero → typecode de memoryview/array
+
+
+def flat_path_for(model_path):
+    """``files/model_rf.pkl`` -> ``files/model_rf.flat``."""
+    base, _, _ = model_path.rpartition('.')
+    return f'{base or model_path}.flat'
+
+
+def is_flat_exportable(model):
+    estimators = getattr(model, 'estimators_', None)
+    return (
+        isinstance(estimators, list) and bool(estimators)
+        and all(hasattr(est, 'tree_') for est in estimators)
+        and getattr(model, 'n_outputs_', 1) == 1
+    )
+
+
+def export_forest(model, path):
+    """Write a fitted forest (RandomForest/ExtraTrees classifier) to ``path``."""
+    import numpy as np
+
+    if not is_flat_exportable(model):
+        raise ValueError(f'{type(model).__name__} is not a single-output tree ensemble')
+
+    roots, feature, threshold, left, right, value = [], [], [], [], [], []
+    offset, max_depth = 0, 0
+    for est in model.estimators_:
+        tree = est.tree_
+        is_leaf = tree.children_left < 0
+        roots.append(offset)
+        feature.append(np.where(is_leaf, -1, tree.feature).astype('<i4'))
+        threshold.append(tree.threshold.astype('<f8'))
+        self_ids = np.arange(tree.node_count)
+        left.append((np.where(is_leaf, self_ids, tree.children_left) + offset).astype('<i4'))
+        right.append((np.where(is_leaf, self_ids, tree.children_right) + offset).astype('<i4'))
+        proba = tree.value[:, 0, :].astype('<f8')
+        normalizer = proba.sum(axis=1)[:, np.newaxis]
+        if not np.allclose(normalizer, 1.0):
+            # older scikit-learn stores weighted counts and normalizes in predict_proba
+            normalizer[normalizer == 0.0] = 1.0
+            proba = proba / normalizer
+        value.append(proba)
+        offset += tree.node_count
+        max_depth = max(max_depth, int(tree.max_depth))
+
+    arrays = {
+        'roots': np.asarray(roots, dtype='<i4'),
+        'feature': np.concatenate(feature),
+        'threshold': np.concatenate(threshold),
+        'left': np.concatenate(left),
+        'right': np.concatenate(right),
+        'value': np.ascontiguousarray(np.concatenate(value)),
+    }
+    classes = [c.item() if hasattr(c, 'item') else c for c in model.classes_]
+    header = {
+        'format_version': FORMAT_VERSION,
+        'model_type': type(model).__name__,
+        'n_trees': len(roots),
+        'n_nodes': offset,
+        'n_features': int(model.n_features_in_),
+        'n_classes': len(classes),
+        'max_depth': max_depth,
+        'classes': classes,
+        'arrays': {},
+    }
+
+    # offsets depend on the header length, which depends on the offsets: iterate to a fixed point
+    header_bytes = b''
+    while True:
+        pos = _align(_PREAMBLE.size + len(header_bytes))
+        for name, arr in arrays.items():
+            header['arrays'][name] = {'dtype': arr.dtype.str, 'shape': list(arr.shape), 'offset': pos}
+            pos = _align(pos + arr.nbytes)
+        new_bytes = json.dumps(header).encode()
+        done = len(new_bytes) == len(header_bytes)
+        header_bytes = new_bytes
+        if done:
+            break
+
+    with open(path, 'wb') as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, arr in arrays.items():
+            f.write(b'\0' * (header['arrays'][name]['offset'] - f.tell()))
+            f.write(arr.tobytes())
+    return path
+
+
+def _align(pos):
+    return (pos + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def read_header(buf):
+    magic, version, header_len = _PREAMBLE.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise ValueError('not a flat forest file')
+    if version != FORMAT_VERSION:
+        raise ValueError(f'unsupported flat forest version {version} (expected {FORMAT_VERSION})')
+    return json.loads(bytes(buf[_PREAMBLE.size:_PREAMBLE.size + header_len]))
+
+
+class FlatForest:
+    """Evaluator with the ``classes_``/``predict_proba`` surface of the sklearn model.
+
+    ``predict_proba`` scores matrices with NumPy; ``predict_proba_rows`` scores
+    sparse ``(column, value)`` rows with the standard library only, through
+    ``memoryview`` casts of the same mapping (no NumPy import at all).
+    """
+
+    def __init__(self, path, chunk_rows=1024):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.header = read_header(self._mm)
+        self.classes_ = list(self.header['classes'])
+        self.n_features_in_ = self.header['n_features']
+        self._arrays = None
+        self._views = None
+
+    def arrays(self):
+        """NumPy views of the arrays (created on first use)."""
+        if self._arrays is None:
+            import numpy as np
+
+            self._arrays = {}
+            for name, spec in self.header['arrays'].items():
+                count = 1
+                for dim in spec['shape']:
+                    count *= dim
+                arr = np.frombuffer(self._mm, dtype=spec['dtype'], count=count, offset=spec['offset'])
+                self._arrays[name] = arr.reshape(spec['shape'])
+        return self._arrays
+
+    def views(self):
+        """Flat standard-library views of the arrays (``value`` row-major)."""
+        if self._views is None:
+            self._views = {}
+            for name, spec in self.header['arrays'].items():
+                code = _TYPECODES[spec['dtype']]
+                count = 1
+                for dim in spec['shape']:
+                    count *= dim
+                buf = memoryview(self._mm)[spec['offset']:spec['offset'] + count * struct.calcsize(code)]
+                if sys.byteorder == 'little':
+                    view = buf.cast(code)
+                else:  # el fichero es little endian: copia con los bytes invertidos
+                    view = array.array(code, bytes(buf))
+                    view.byteswap()
+                self._views[name] = view
+        return self._views
+
+    def predict_proba(self, X):
+        import numpy as np
+
+        out = []
+        for start in range(0, X.shape[0], self.chunk_rows):
+            chunk = X[start:start + self.chunk_rows]
+            if hasattr(chunk, 'toarray'):
+                chunk = chunk.toarray()
+            out.append(self._predict_dense(np.asarray(chunk, dtype=np.float32)))
+        if not out:
+            return np.zeros((0, len(self.classes_)))
+        return np.concatenate(out)
+
+    def predict_proba_rows(self, rows):
+        """``predict_proba`` for sparse rows (iterables of ``(column, value)``), as lists of floats.
+
+        Same float32 feature rounding and tree summation order as the NumPy
+        path, so both return identical probabilities.
+        """
+        v = self.views()
+        roots, feature, threshold, left, right, value = (
+            v['roots'], v['feature'], v['threshold'], v['left'], v['right'], v['value'])
+        n_classes = self.header['n_classes']
+        n_trees = len(roots)
+        out = []
+        for row in rows:
+            cols, values = zip(*row) if row else ((), ())
+            x = dict(zip(cols, array.array('f', values)))
+            acc = [0.0] * n_classes
+            for node in roots:
+                f = feature[node]
+                while f >= 0:
+                    node = right[node] if x.get(f, 0.0) > threshold[node] else left[node]
+                    f = feature[node]
+                base = node * n_classes
+                for j in range(n_classes):
+                    acc[j] += value[base + j]
+            out.append([a / n_trees for a in acc])
+        return out
+
+    def _predict_dense(self, X):
+        import numpy as np
+
+        a = self.arrays()
+        roots, feature, threshold, left, right, value = (
+            a['roots'], a['feature'], a['threshold'], a['left'], a['right'], a['value'])
+        # walk every tree for every row in lock-step: one gather per depth level;
+        # leaves loop onto themselves, so rows that finish early just stay put
+        n, n_features = X.shape
+        node = np.broadcast_to(roots, (n, roots.shape[0])).copy()
+        flat_x = X.astype(np.float64).ravel()
+        row_offset = (np.arange(n) * n_features)[:, None]
+        for _ in range(self.header['max_depth']):
+            go_right = flat_x[row_offset + feature[node]] > threshold[node]
+            node = np.where(go_right, right[node], left[node])
+        # cumulative sum adds trees strictly in order, like the forest's accumulator
+        return np.cumsum(value[node], axis=1)[:, -1] / roots.shape[0]
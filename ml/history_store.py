@@ -0,0 +1,238 @@
+# ml/history_store.py
+"""Append-only CI history store (SQLite) mined from git and test outcomes.
+
+* ``commits``      one row per commit: sha, commit time, message length, weekday
+* ``commit_files`` changed paths per commit (indexed by commit and by path)
+* ``test_results`` one row per test case outcome (indexed by commit and by test file)
+
+Rows are only ever inserted; ``commits.id`` / ``test_results.id`` grow
+monotonically and serve as training watermarks. Git ingestion streams a
+single ``git log --name-only`` and resumes from the last ingested head.
+Test outcomes come from ``files/test_cases.jsonl``, which ci/run_selected_tests.py
+writes from its JUnit report after every run (one JSON object per case).
+
+    python ml/history_store.py                      # ingest git log + files/test_cases.jsonl for HEAD
+    python ml/history_store.py git                  # only git
+    python ml/history_store.py cases PATH [SHA]     # only the outcomes of one run
+    python ml/history_store.py stats
+"""
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+DB_PATH = os.getenv('HISTORY_DB', 'files/history.sqlite')
+CASES_PATH = os.getenv('TEST_CASES_PATH', 'files/test_cases.jsonl')
+FAILED_OUTCOMES = ('failure', 'error')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS commits (
+    id INTEGER PRIMARY KEY,
+    sha TEXT NOT NULL UNIQUE,
+    committed_at INTEGER,
+    msg_len INTEGER,
+    weekday INTEGER
+);
+CREATE TABLE IF NOT EXISTS commit_files (
+    commit_id INTEGER NOT NULL REFERENCES commits(id),
+    path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_commit_files_commit ON commit_files(commit_id);
+CREATE INDEX IF NOT EXISTS idx_commit_files_path ON commit_files(path);
+CREATE TABLE IF NOT EXISTS test_results (
+    id INTEGER PRIMARY KEY,
+    commit_id INTEGER NOT NULL REFERENCES commits(id),
+    run_id TEXT,
+    test_file TEXT NOT NULL,
+    node_id TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    duration REAL
+);
+CREATE INDEX IF NOT EXISTS idx_test_results_commit ON test_results(commit_id);
+CREATE INDEX IF NOT EXISTS idx_test_results_test ON test_results(test_file);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def connect(db_path=DB_PATH):
+    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _meta(conn, key, default=None):
+    row = conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else default
+
+
+def _set_meta(conn, key, value):
+    conn.execute('INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)', (key, value))
+
+
+def iter_git_log(rev_range, cwd='.'):
+    """Stream ``(sha, committed_at, message, [paths])`` oldest first from a single git process."""
+    # %x1e starts a record; %x1f separates header fields from the message and the name list
+    proc = subprocess.Popen(
+        ['git', 'log', '--reverse', '--no-renames', '--name-only', '--format=%x1e%H%x1f%ct%x1f%B%x1f', rev_range],
+        cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, errors='replace', bufsize=1 << 16,
+    )
+    buf = ''
+    try:
+        for chunk in iter(lambda: proc.stdout.read(1 << 16), ''):
+            buf += chunk
+            records = buf.split('\x1e')
+            buf = records.pop()
+            for rec in records:
+                if rec:
+                    yield _parse_record(rec)
+        if buf:
+            yield _parse_record(buf)
+    finally:
+        proc.stdout.close()
+        proc.wait()
+
+
+def _parse_record(rec):
+    sha, ct, message, names = rec.split('\x1f', 3)
+    paths = [ln.strip() for ln in names.splitlines() if ln.strip()]
+    return sha, int(ct), message.strip(), paths
+
+
+def ingest_git(conn, rev='HEAD', cwd='.'):
+    """Add commits reachable from ``rev`` that are not stored yet; returns how many were added."""
+    head = subprocess.run(['git', 'rev-parse', rev], cwd=cwd, text=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.strip()
+    if not head:
+        return 0
+    last = _meta(conn, 'git_head')
+    if last == head:
+        return 0
+    rev_range = head
+    if last and subprocess.run(['git', 'merge-base', '--is-ancestor', last, head], cwd=cwd,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0:
+        rev_range = f'{last}..{head}'  # resume: only commits since the last ingestion
+
+    added = 0
+    with conn:
+        for sha, ct, message, paths in iter_git_log(rev_range, cwd=cwd):
+            cur = conn.execute(
+                'INSERT OR IGNORE INTO commits(sha, committed_at, msg_len, weekday) VALUES (?, ?, ?, ?)',
+                (sha, ct, len(message), time.gmtime(ct).tm_wday),
+            )
+            if cur.rowcount:
+                conn.executemany('INSERT INTO commit_files(commit_id, path) VALUES (?, ?)',
+                                 [(cur.lastrowid, p) for p in paths])
+                added += 1
+        _set_meta(conn, 'git_head', head)
+    return added
+
+
+def _commit_id(conn, sha):
+    conn.execute('INSERT OR IGNORE INTO commits(sha) VALUES (?)', (sha,))
+    return conn.execute('SELECT id FROM commits WHERE sha = ?', (sha,)).fetchone()[0]
+
+
+def iter_case_lines(cases_path):
+    with open(cases_path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def ingest_cases(conn, cases_path, sha, run_id=None):
+    """Record every test case outcome of one run (JSON Lines, see ``CASES_PATH``) against commit ``sha``."""
+    if not os.path.exists(cases_path):
+        return 0
+    run_id = run_id or os.getenv('GITHUB_RUN_ID') or str(int(os.path.getmtime(cases_path)))
+    with conn:
+        commit_id = _commit_id(conn, sha)
+        if conn.execute('SELECT 1 FROM test_results WHERE commit_id = ? AND run_id = ? LIMIT 1',
+                        (commit_id, run_id)).fetchone():
+            return 0  # this run was already ingested
+        rows = ((commit_id, run_id, case['file'], case['nodeid'], case['outcome'], case['time'])
+                for case in iter_case_lines(cases_path))
+        cur = conn.executemany(
+            'INSERT INTO test_results(commit_id, run_id, test_file, node_id, outcome, duration) '
+            'VALUES (?, ?, ?, ?, ?, ?)', rows)
+    return cur.rowcount
+
+
+def snapshot(conn):
+    """Identity of the store's content for the training cache (append-only ⇒ max ids suffice)."""
+    return list(conn.execute('SELECT (SELECT max(id) FROM commits), (SELECT max(id) FROM test_results)').fetchone())
+
+
+def labelled_commits(conn, after=None):
+    """Training rows for commits with test outcomes, in the order their results arrived.
+
+    Yields ``(first_result_id, changed_files, msg_len, weekday, failed_test)``: the label is the
+    test file of the first failing/erroring case, or ``'none'`` if everything passed.
+    ``after`` is a ``test_results.id`` watermark.
+    """
+    placeholders = ','.join('?' for _ in FAILED_OUTCOMES)
+    query = f"""
+        SELECT r.first_id,
+               (SELECT group_concat(path, ',') FROM commit_files f WHERE f.commit_id = c.id),
+               coalesce(c.msg_len, 0), coalesce(c.weekday, 0),
+               coalesce((SELECT t.test_file FROM test_results t
+                         WHERE t.commit_id = c.id AND t.outcome IN ({placeholders})
+                         ORDER BY t.id LIMIT 1), 'none')
+        FROM (SELECT commit_id, min(id) AS first_id FROM test_results GROUP BY commit_id) r
+        JOIN commits c ON c.id = r.commit_id
+        WHERE r.first_id > ?
+        ORDER BY r.first_id
+    """
+    yield from conn.execute(query, (*FAILED_OUTCOMES, after or 0))
+
+
+def node_outcomes(conn, test_files):
+    """{node_id: (runs, failures)} over the stored history of ``test_files`` (skips excluded)."""
+    placeholders = ','.join('?' for _ in test_files)
+    fail = ','.join('?' for _ in FAILED_OUTCOMES)
+    query = f"""
+        SELECT node_id, count(*), sum(outcome IN ({fail}))
+        FROM test_results
+        WHERE test_file IN ({placeholders}) AND outcome != 'skipped'
+        GROUP BY node_id
+    """
+    return {node: (runs, failures) for node, runs, failures in conn.execute(query, (*FAILED_OUTCOMES, *test_files))}
+
+
+def stats(conn):
+    return {
+        'commits': conn.execute('SELECT count(*) FROM commits').fetchone()[0],
+        'changed_paths': conn.execute('SELECT count(*) FROM commit_files').fetchone()[0],
+        'test_results': conn.execute('SELECT count(*) FROM test_results').fetchone()[0],
+        'labelled_commits': conn.execute('SELECT count(DISTINCT commit_id) FROM test_results').fetchone()[0],
+    }
+
+
+def main(argv):
+    conn = connect()
+    cmd = argv[0] if argv else 'all'
+    if cmd in ('all', 'git'):
+        t0 = time.perf_counter()
+        n = ingest_git(conn)
+        print(f"Ingested {n} new commits from git log in {time.perf_counter() - t0:.2f}s")
+    if cmd in ('all', 'cases'):
+        cases = argv[1] if len(argv) > 1 else CASES_PATH
+        sha = argv[2] if len(argv) > 2 else (os.getenv('GITHUB_SHA') or subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], text=True, stdout=subprocess.PIPE).stdout.strip())
+        n = ingest_cases(conn, cases, sha)
+        print(f"Ingested {n} test results from {cases} for {sha[:12]}")
+    print(f"History store {DB_PATH}: {stats(conn)}")
+    conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,180 @@
+# ml/import_graph.py
+"""Static import graph of app/ and tests/ → exactly impacted tests per source file.
+
+Every ``.py`` file under ``IMPORT_ROOTS`` is parsed with ``ast`` for its
+imports; the index maps each file to the test files that import it directly
+or transitively (plus the tests under a changed ``conftest.py``). It is
+persisted in ``files/import_graph.json`` and refreshed incrementally: files
+whose size/mtime or content hash did not change are not re-parsed.
+
+    python ml/import_graph.py            # refresh the index and print the impact map
+"""
+import ast
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+
+INDEX_PATH = os.getenv('IMPORT_GRAPH_PATH', 'files/import_graph.json')
+IMPORT_ROOTS = tuple(r.strip() for r in os.getenv('IMPORT_ROOTS', 'app,tests').split(',') if r.strip())
+INDEX_VERSION = 1
+
+_index_cache = {}
+
+
+def module_name(path):
+    """``app/payment.py`` -> ``app.payment``; ``app/__init__.py`` -> ``app``."""
+    parts = list(Path(path).with_suffix('').parts)
+    if parts[-1] == '__init__':
+        parts.pop()
+    return '.'.join(parts)
+
+
+def is_test_file(path):
+    name = Path(path).name
+    return name.endswith('.py') and (name.startswith('test_') or name.endswith('_test.py'))
+
+
+def parse_imports(source, module, is_package=False):
+    """Every dotted name a module may import (``from a import b`` yields ``a`` and ``a.b``)."""
+    package = module.split('.') if is_package else module.split('.')[:-1]
+    names = set()
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                base = package[:len(package) - (node.level - 1)] if node.level > 1 else package
+                prefix = '.'.join(base + ([node.module] if node.module else []))
+            else:
+                prefix = node.module or ''
+            if prefix:
+                names.add(prefix)
+            names.update(f'{prefix}.{a.name}' if prefix else a.name for a in node.names if a.name != '*')
+    return sorted(names)
+
+
+def iter_sources(roots=IMPORT_ROOTS):
+    for root in roots:
+        if os.path.isdir(root):
+            for p in sorted(Path(root).rglob('*.py')):
+                yield p.as_posix()
+
+
+def load_index(index_path=INDEX_PATH):
+    """Persisted index (re-read only when the file changes); empty if missing or outdated."""
+    if not os.path.exists(index_path):
+        return {'version': INDEX_VERSION, 'files': {}, 'impact': {}}
+    mtime = os.path.getmtime(index_path)
+    cached = _index_cache.get(index_path)
+    if cached is None or cached[0] != mtime:
+        with open(index_path) as f:
+            data = json.load(f)
+        if data.get('version') != INDEX_VERSION:
+            data = {'version': INDEX_VERSION, 'files': {}, 'impact': {}}
+        cached = (mtime, data)
+        _index_cache[index_path] = cached
+    return cached[1]
+
+
+def compute_impact(files):
+    """{source file: sorted test files that (transitively) import it}."""
+    modules = {rec['module']: path for path, rec in files.items()}
+
+    def resolve(name):
+        # ``app.payment.apply_discount`` → ``app/payment.py``; importing a submodule also runs its packages
+        found, parts = [], name.split('.')
+        for end in range(len(parts), 0, -1):
+            path = modules.get('.'.join(parts[:end]))
+            if path:
+                found.append(path)
+        return found
+
+    importers = {path: set() for path in files}
+    for path, rec in files.items():
+        deps = {dep for name in rec['imports'] for dep in resolve(name)}
+        if is_test_file(path):
+            # pytest loads every conftest.py between the rootdir and the test file
+            for parent in Path(path).parents:
+                conftest = (parent / 'conftest.py').as_posix()
+                if conftest in files:
+                    deps.add(conftest)
+        for dep in deps - {path}:
+            importers[dep].add(path)
+
+    impact = {}
+    for path in files:
+        seen, stack, tests = {path}, [path], set()
+        while stack:
+            cur = stack.pop()
+            if is_test_file(cur):
+                tests.add(cur)
+            for nxt in importers[cur] - seen:
+                seen.add(nxt)
+                stack.append(nxt)
+        if tests:
+            impact[path] = sorted(tests)
+    return impact
+
+
+def update_index(roots=IMPORT_ROOTS, index_path=INDEX_PATH):
+    """Re-parse only new/modified files; returns ``(index, n_parsed)`` and persists changes."""
+    old = load_index(index_path)['files']
+    files, parsed, dirty = {}, 0, False
+    for path in iter_sources(roots):
+        st = os.stat(path)
+        rec = old.get(path)
+        if rec and rec['size'] == st.st_size and rec['mtime_ns'] == st.st_mtime_ns:
+            files[path] = rec
+            continue
+        data = Path(path).read_bytes()
+        digest = hashlib.sha1(data).hexdigest()
+        dirty = True
+        if rec and rec['sha1'] == digest:
+            files[path] = {**rec, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}  # touched, same content
+            continue
+        module = module_name(path)
+        try:
+            imports = parse_imports(data, module, is_package=path.endswith('__init__.py'))
+        except SyntaxError:
+            imports = rec['imports'] if rec else []  # keep the last good parse
+        files[path] = {'sha1': digest, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                       'module': module, 'imports': imports}
+        parsed += 1
+
+    if not dirty and files.keys() == old.keys():
+        return load_index(index_path), 0
+    impact = compute_impact(files) if (parsed or files.keys() != old.keys()) else load_index(index_path)['impact']
+    index = {'version': INDEX_VERSION, 'files': files, 'impact': impact}
+    Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+    tmp = f'{index_path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.replace(tmp, index_path)
+    return index, parsed
+
+
+def impacted_tests(changed_files, index_path=INDEX_PATH):
+    """Test files that must run for ``changed_files`` according to the persisted index."""
+    impact = load_index(index_path)['impact']
+    tests = set()
+    for path in changed_files:
+        tests.update(impact.get(path, ()))
+    return sorted(tests)
+
+
+def main():
+    import time
+    t0 = time.perf_counter()
+    index, parsed = update_index()
+    print(f"Import graph: {len(index['files'])} files, {parsed} re-parsed in "
+          f"{time.perf_counter() - t0:.3f}s → {INDEX_PATH}")
+    for path, tests in sorted(index['impact'].items()):
+        if not is_test_file(path):
+            print(f"  {path}: {', '.join(tests)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+# ml/predict_daemon.py
+"""Long-lived local prediction server.
+
+Keeps the model and the feature mapping loaded and answers ``decide_tests``
+queries over a Unix socket (one JSON object per line, one reply per line).
+Both files are re-checked on every request and reloaded when they change.
+
+The model, mapping and import-graph paths are fixed when the daemon starts
+(``MODEL_PATH``, ``files/test_index.json``, ``IMPORT_GRAPH_PATH``). Paths sent
+by a client are only compared with them: a mismatch is refused, never loaded,
+so a client cannot make the daemon unpickle a file of its choice. The socket
+is only accessible to its owner (mode ``0600``).
+
+    python ml/predict_daemon.py &      # then ml/predict_tests.py uses it automatically
+"""
+import json
+import os
+import signal
+import socketserver
+import sys
+import time
+
+import predict_tests
+
+
+# fijadas al arrancar: nunca se cargan rutas que vengan en una petición
+SERVED_PATHS = {
+    'model_path': os.path.abspath(predict_tests.DEFAULT_MODEL),
+    'mapping_path': os.path.abspath(predict_tests.MAPPING_PATH),
+    'graph_path': os.path.abspath(predict_tests.IMPORT_GRAPH_PATH),
+}
+
+
+def path_mismatch(req):
+    for key, served in SERVED_PATHS.items():
+        requested = req.get(key)
+        if requested is not None and os.path.abspath(requested) != served:
+            return f'daemon serves {key}={served}, not {requested}'
+    return None
+
+
+def dispatch(req):
+    op = req.get('op', 'decide')
+    if op == 'ping':
+        return {'ok': True, 'pid': os.getpid()}
+    if op not in ('decide', 'decide_batch'):
+        return {'error': f'unknown op {op!r}'}
+    mismatch = path_mismatch(req)
+    if mismatch:
+        return {'error': mismatch}
+    if op == 'decide':
+        tests, scored = predict_tests.decide_tests_local(
+            req.get('changed_files', []),
+            min_tests=req.get('min_tests', 1),
+            top_k=req.get('top_k'),
+            prob_threshold=req.get('prob_threshold'),
+            model_path=SERVED_PATHS['model_path'],
+            mapping_path=SERVED_PATHS['mapping_path'],
+            time_budget_s=req.get('time_budget_s'),
+            graph_path=SERVED_PATHS['graph_path'],
+        )
+        return {'selected_tests': tests, 'class_probs': scored}
+    decided = predict_tests.decide_tests_batch_local(
+        req.get('changed_sets', []),
+        min_tests=req.get('min_tests', 1),
+        top_k=req.get('top_k'),
+        prob_threshold=req.get('prob_threshold'),
+        model_path=SERVED_PATHS['model_path'],
+        mapping_path=SERVED_PATHS['mapping_path'],
+        time_budget_s=req.get('time_budget_s'),
+        graph_path=SERVED_PATHS['graph_path'],
+    )
+    return {'decisions': [{'selected_tests': t, 'class_probs': s} for t, s in decided]}
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # a client may keep the connection open and send several requests
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                resp = dispatch(json.loads(line))
+            except Exception as e:
+                resp = {'error': f'{type(e).__name__}: {e}'}
+            self.wfile.write(json.dumps(resp).encode() + b'\n')
+            self.wfile.flush()
+
+
+class PredictServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(socket_path=predict_tests.DAEMON_SOCKET):
+    if os.path.exists(socket_path):
+        if predict_tests.query_daemon({'op': 'ping'}, socket_path=socket_path, timeout=0.5):
+            print(f"Prediction daemon already running on {socket_path}")
+            return 1
+        os.unlink(socket_path)  # stale socket from a previous run
+
+    t0 = time.perf_counter()
+    predict_tests.load_model(SERVED_PATHS['model_path'])
+    predict_tests.load_encoder(SERVED_PATHS['mapping_path'])
+    print(f"Loaded {predict_tests.DEFAULT_MODEL} in {time.perf_counter() - t0:.2f}s")
+
+    # sólo el dueño puede conectarse: umask durante el bind y chmod explícito después
+    old_umask = os.umask(0o177)
+    try:
+        server = PredictServer(socket_path, Handler)
+    finally:
+        os.umask(old_umask)
+    os.chmod(socket_path, 0o600)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"Serving predictions on {socket_path} (pid {os.getpid()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(serve())
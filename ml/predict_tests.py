@@ -1,60 +1,351 @@
 import json
 import os
+import sys
+import threading
 from pathlib import Path
 
-import joblib
-import numpy as np
-import pandas as pd
+from features import FileFeatureEncoder
+from flat_forest import FlatForest, flat_path_for
+from import_graph import INDEX_PATH as IMPORT_GRAPH_PATH, impacted_tests
 
 DEFAULT_MODEL = os.getenv('MODEL_PATH', 'files/model_rf.pkl')
 MAPPING_PATH = 'files/test_index.json'
+# resident prediction server (ml/predict_daemon.py); the client falls back to in-process
+DAEMON_SOCKET = os.getenv('PREDICT_SOCKET', 'files/predict.sock')
+DAEMON_TIMEOUT_S = float(os.getenv('PREDICT_DAEMON_TIMEOUT', '2'))
+# per-test-file duration history written by ci/run_selected_tests.py
+TIMINGS_PATH = os.getenv('TIMINGS_PATH', 'files/test_timings.json')
+DEFAULT_TEST_DURATION_S = 1.0
+# per-node outcomes for risk ordering (ci/run_selected_tests.py reads them from the decision)
+HISTORY_DB = os.getenv('HISTORY_DB', 'files/history.sqlite')
+# flat model: up to this many rows are scored without NumPy (~3 ms/row vs ~0.4 s of imports)
+STDLIB_MAX_ROWS = int(os.getenv('STDLIB_PREDICT_MAX_ROWS', '64'))
+# knapsack capacity units per time budget (ci/pipeline.py keys the predict stage on durations in these units)
+BUDGET_RESOLUTION = 1000
 
-def featurize_row(files, commit_msg_len=50, weekday=2):
-    # align with training features
-    training_meta = json.load(open(MAPPING_PATH))
-    FILES = training_meta['files']
+_encoder_cache = {}
+_model_cache = {}
+_durations_cache = {}
+# the daemon serves requests from several threads: one load/reload at a time
+_load_lock = threading.Lock()
 
-    row = {}
-    for f in FILES:
-        row[f'file_{f}'] = int(f in files)
-    row['commit_msg_len'] = int(commit_msg_len)
-    row['weekday'] = int(weekday)
-    return pd.DataFrame([row])
+def resolve_model_path(model_path=DEFAULT_MODEL):
+    # prefer the flat export (mmap, NumPy-only) when it is at least as new as the pickle
+    if model_path.endswith('.flat') or os.getenv('FLAT_MODEL', '1') == '0':
+        return model_path
+    flat = flat_path_for(model_path)
+    if os.path.exists(flat) and (not os.path.exists(model_path)
+                                 or os.path.getmtime(flat) >= os.path.getmtime(model_path)):
+        return flat
+    return model_path
 
-# ml/predict_tests.py  (reemplaza decide_tests)
-def decide_tests(changed_files, min_tests=1, top_k=None, prob_threshold=None):
-    model = joblib.load(DEFAULT_MODEL)
-    df = featurize_row(changed_files)
-    proba = model.predict_proba(df)[0]
-    classes = model.classes_
-
-    scored = sorted(
-        [(c, float(p)) for c, p in zip(classes, proba) if c != 'none'],
-        key=lambda x: x[1], reverse=True
-    )
+def load_model(model_path=DEFAULT_MODEL):
+    # heavy imports (joblib → sklearn) only happen here; reload only when the file changes
+    with _load_lock:
+        path = resolve_model_path(model_path)
+        mtime = os.path.getmtime(path)
+        cached = _model_cache.get(model_path)
+        if cached is None or cached[0] != (path, mtime):
+            if path.endswith('.flat'):
+                model = FlatForest(path)
+            else:
+                import joblib
+                model = joblib.load(path)
+                if hasattr(model, 'n_jobs'):
+                    # single/few-row scoring: thread fan-out costs more than it saves
+                    model.n_jobs = 1
+            cached = ((path, mtime), model)
+            _model_cache[model_path] = cached
+        return cached[1]
+
+def load_encoder(mapping_path=MAPPING_PATH):
+    # align with training features; re-read the mapping only when it changes
+    with _load_lock:
+        mtime = os.path.getmtime(mapping_path)
+        cached = _encoder_cache.get(mapping_path)
+        if cached is None or cached[0] != mtime:
+            training_meta = json.load(open(mapping_path))
+            cached = (mtime, FileFeatureEncoder.from_meta(training_meta))
+            _encoder_cache[mapping_path] = cached
+        return cached[1]
+
+def featurize_row(files, commit_msg_len=50, weekday=2, mapping_path=MAPPING_PATH):
+    return load_encoder(mapping_path).transform([files], commit_msg_len=[commit_msg_len], weekday=[weekday])
+
+def load_durations(timings_path=TIMINGS_PATH):
+    if not os.path.exists(timings_path):
+        return {}
+    with _load_lock:
+        mtime = os.path.getmtime(timings_path)
+        cached = _durations_cache.get(timings_path)
+        if cached is None or cached[0] != mtime:
+            data = json.load(open(timings_path))
+            cached = (mtime, {t: rec['duration_s'] for t, rec in data.get('tests', {}).items()})
+            _durations_cache[timings_path] = cached
+        return cached[1]
+
+def estimate_duration(test, durations):
+    # unseen tests: assume a typical (median) known test, or a default
+    if test in durations:
+        return durations[test]
+    if durations:
+        known = sorted(durations.values())
+        return known[len(known) // 2]
+    return DEFAULT_TEST_DURATION_S
 
+def pick_within_budget(scored, durations, budget_s, resolution=BUDGET_RESOLUTION):
+    # 0/1 knapsack: maximize expected failures caught (sum of probs) under the time budget.
+    # Durations are rounded *up* to budget/resolution units, so the plan never exceeds the budget.
+    import math
+    items = [(c, p, estimate_duration(c, durations)) for c, p in scored if p > 0]
+    if budget_s <= 0 or not items:
+        return []
+    unit = budget_s / resolution
+    costs = [math.ceil(d / unit - 1e-9) for _, _, d in items]
+    best = [0.0] * (resolution + 1)
+    keep = []
+    for (_, p, _), w in zip(items, costs):
+        row = bytearray(resolution + 1)
+        for cap in range(resolution, w - 1, -1):
+            v = best[cap - w] + p
+            if v > best[cap]:
+                best[cap] = v
+                row[cap] = 1
+        keep.append(row)
+    picked, cap = [], resolution
+    for i in range(len(items) - 1, -1, -1):
+        if keep[i][cap]:
+            picked.append(items[i][0])
+            cap -= costs[i]
+    prob = dict(scored)
+    return sorted(picked, key=lambda c: prob[c], reverse=True)
+
+def selection_stats(picked, scored, durations):
+    # expected catch rate = share of the predicted failure mass covered by the selection
+    total = sum(p for _, p in scored)
+    caught = sum(p for c, p in scored if c in picked)
+    return {
+        'expected_catch_rate': caught / total if total > 0 else 0.0,
+        'predicted_runtime_s': sum(estimate_duration(c, durations) for c in picked),
+    }
+
+def pick_tests(scored, min_tests=1, top_k=None, prob_threshold=None, time_budget_s=None, required=()):
+    # `required`: tests impactados según el grafo de imports; siempre se ejecutan,
+    # el modelo sólo añade riesgos indirectos
+    required = list(required)
+    if required:
+        scored = [(c, p) for c, p in scored if c not in required]
+    # Presupuesto de tiempo opcional (TIME_BUDGET_S): tiene prioridad sobre umbral/top-k
+    if time_budget_s is not None:
+        durations = load_durations()
+        remaining = time_budget_s - sum(estimate_duration(t, durations) for t in required)
+        picked = pick_within_budget(scored, durations, remaining)
     # Umbral opcional
-    if prob_threshold is not None:
+    elif prob_threshold is not None:
         picked = [c for c, p in scored if p >= prob_threshold]
     else:
         k = top_k if top_k is not None else 2
         picked = [c for c, _ in scored[:k]]
 
+    picked = required + picked
+    if not picked and scored and time_budget_s is not None:
+        # nunca vacío: el test más probable que quepa en el presupuesto; si ninguno cabe, el
+        # más probable igualmente (make_decision informa del exceso en over_budget_s)
+        fits = [c for c, _ in scored if estimate_duration(c, durations) <= remaining]
+        picked = fits[:1] or [scored[0][0]]
     if not picked:
         picked = [scored[0][0]] if scored else ['tests/test_login.py']
-    return picked, scored
+    return picked
 
+def score_rows(classes, proba):
+    # one (label, prob) list per row, best first, without the 'none' class
+    return [
+        sorted(
+            [(c, float(p)) for c, p in zip(classes, row) if c != 'none'],
+            key=lambda x: x[1], reverse=True
+        )
+        for row in proba
+    ]
 
-# ml/predict_tests.py (solo el main modificado)
-def main():
-    changed = []
-    if os.path.exists('files/changed_files.json'):
-        changed = json.load(open('files/changed_files.json'))
+def decide_tests_batch_local(changed_sets, min_tests=1, top_k=None, prob_threshold=None,
+                             model_path=DEFAULT_MODEL, mapping_path=MAPPING_PATH, time_budget_s=None,
+                             graph_path=IMPORT_GRAPH_PATH):
+    # whole batch → one CSR matrix → one vectorized predict_proba (few rows on a flat model: stdlib)
+    changed_sets = [list(c) for c in changed_sets]
+    if not changed_sets:
+        return []
+    model = load_model(model_path)
+    encoder = load_encoder(mapping_path)
+    if hasattr(model, 'predict_proba_rows') and 'numpy' not in sys.modules and len(changed_sets) <= STDLIB_MAX_ROWS:
+        # pocas filas: sólo standard library (importar NumPy/SciPy cuesta más que recorrer los árboles)
+        proba = model.predict_proba_rows(encoder.encode_row(changed) for changed in changed_sets)
+    else:
+        proba = model.predict_proba(encoder.transform(changed_sets))
+    all_scored = score_rows(model.classes_, proba)
+    return [(pick_tests(scored, min_tests, top_k, prob_threshold, time_budget_s,
+                        required=impacted_tests(changed, graph_path)), scored)
+            for changed, scored in zip(changed_sets, all_scored)]
+
+def decide_tests_local(changed_files, min_tests=1, top_k=None, prob_threshold=None,
+                       model_path=DEFAULT_MODEL, mapping_path=MAPPING_PATH, time_budget_s=None,
+                       graph_path=IMPORT_GRAPH_PATH):
+    return decide_tests_batch_local([changed_files], min_tests, top_k, prob_threshold,
+                                    model_path=model_path, mapping_path=mapping_path,
+                                    time_budget_s=time_budget_s, graph_path=graph_path)[0]
+
+def query_daemon(request, socket_path=DAEMON_SOCKET, timeout=DAEMON_TIMEOUT_S):
+    # None ⇒ daemon not running / unreachable / failed; caller predicts in-process
+    import socket
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(socket_path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            sock.sendall(json.dumps(request).encode() + b'\n')
+            line = sock.makefile('rb').readline()
+        resp = json.loads(line)
+    except (OSError, ValueError):
+        return None
+    return None if 'error' in resp else resp
+
+def _daemon_request(op, **fields):
+    if os.getenv('PREDICT_DAEMON', '1') == '0':
+        return None
+    # the daemon only serves the files it was started with; the paths just let it refuse a mismatch
+    return query_daemon({
+        'op': op,
+        **fields,
+        'model_path': os.path.abspath(DEFAULT_MODEL),
+        'mapping_path': os.path.abspath(MAPPING_PATH),
+        'graph_path': os.path.abspath(IMPORT_GRAPH_PATH),
+    })
+
+# ml/predict_tests.py  (reemplaza decide_tests)
+def decide_tests(changed_files, min_tests=1, top_k=None, prob_threshold=None, time_budget_s=None):
+    resp = _daemon_request('decide', changed_files=list(changed_files), min_tests=min_tests,
+                           top_k=top_k, prob_threshold=prob_threshold, time_budget_s=time_budget_s)
+    if resp is not None:
+        return resp['selected_tests'], [tuple(x) for x in resp['class_probs']]
+    return decide_tests_local(changed_files, min_tests, top_k, prob_threshold, time_budget_s=time_budget_s)
+
+def decide_tests_batch(changed_sets, min_tests=1, top_k=None, prob_threshold=None, time_budget_s=None):
+    """Score many changed-file sets at once; same selection rules as ``decide_tests`` per row.
+
+    Returns one ``(selected_tests, scored)`` pair per input set (empty sets select nothing).
+    """
+    changed_sets = [list(c) for c in changed_sets]
+    non_empty = [i for i, c in enumerate(changed_sets) if c]
+    resp = _daemon_request('decide_batch', changed_sets=[changed_sets[i] for i in non_empty],
+                           min_tests=min_tests, top_k=top_k, prob_threshold=prob_threshold,
+                           time_budget_s=time_budget_s)
+    if resp is not None:
+        decided = [(d['selected_tests'], [tuple(x) for x in d['class_probs']]) for d in resp['decisions']]
     else:
-        env = os.getenv('CHANGED_FILES')
-        if env:
-            changed = [s.strip() for s in env.split(',') if s.strip()]
-        # Si no hay archivo ni env ⇒ lista vacía
+        decided = decide_tests_batch_local([changed_sets[i] for i in non_empty], min_tests, top_k,
+                                           prob_threshold, time_budget_s=time_budget_s)
+    results = [([], [])] * len(changed_sets)
+    for i, d in zip(non_empty, decided):
+        results[i] = d
+    return results
+
+def load_changed(path='files/changed_files.json'):
+    # written by ci/collect_changed_files.py
+    if os.path.exists(path):
+        data = json.load(open(path))
+        # formato antiguo: lista; actual: {"files": [...], "hunks": {...}, "base": ..., "head": ...}
+        return data if isinstance(data, list) else data.get('files', [])
+    # sin archivo: CHANGED_FILES (si tampoco existe ⇒ lista vacía)
+    env = os.getenv('CHANGED_FILES', '')
+    return [s.strip() for s in env.split(',') if s.strip()]
+
+def make_decision(changed, tests, scored, time_budget_s=None):
+    decision = {
+        'changed_files': changed,
+        'selected_tests': tests,
+        'impacted_tests': impacted_tests(changed),
+        'class_probs': [{'label': c, 'prob': float(p)} for c, p in scored],
+        **selection_stats(tests, scored, load_durations()),
+    }
+    if time_budget_s is not None:
+        # los tests impactados (y el mínimo de uno) se ejecutan aunque no quepan: se informa del exceso
+        decision['time_budget_s'] = time_budget_s
+        decision['over_budget_s'] = max(decision['predicted_runtime_s'] - time_budget_s, 0.0)
+    return decision
+
+def refresh_stats(decision, output_path='files/selected_tests.json'):
+    """Recompute the duration-based fields of a reused decision from the current timings and rewrite it."""
+    if not decision or 'expected_catch_rate' not in decision:
+        return decision
+    scored = [(c['label'], c['prob']) for c in decision.get('class_probs', [])]
+    decision.update(selection_stats(decision['selected_tests'], scored, load_durations()))
+    if 'time_budget_s' in decision:
+        decision['over_budget_s'] = max(decision['predicted_runtime_s'] - decision['time_budget_s'], 0.0)
+    with open(output_path, 'w') as f:
+        json.dump(decision, f, indent=2)
+    return decision
+
+def node_history(tests, history_db=HISTORY_DB):
+    """{node: [runs, failures]} of the selected test files in the history store ({} without one)."""
+    if not tests or not os.path.exists(history_db):
+        return {}
+    import history_store
+    conn = history_store.connect(history_db)
+    try:
+        outcomes = history_store.node_outcomes(conn, sorted({t.split('::', 1)[0] for t in tests}))
+    finally:
+        conn.close()
+    return {node: list(counts) for node, counts in outcomes.items()}
+
+def selection_params_from_env():
+    budget = os.getenv('TIME_BUDGET_S')
+    return dict(
+        min_tests=int(os.getenv('MIN_TESTS', '1')),
+        top_k=int(os.getenv('TOP_K', '3')),
+        prob_threshold=float(os.getenv('PROB_THRESHOLD', '0.15')),
+        time_budget_s=float(budget) if budget else None,
+    )
+
+def run_batch(input_path, output_path, min_tests=1, top_k=None, prob_threshold=None, time_budget_s=None):
+    # input: JSONL, each line a list of changed files or {"id": ..., "changed_files": [...]}
+    items = []
+    with open(input_path) as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                items.append(item if isinstance(item, dict) else {'changed_files': item})
+
+    decisions = decide_tests_batch([it.get('changed_files', []) for it in items],
+                                   min_tests=min_tests, top_k=top_k, prob_threshold=prob_threshold,
+                                   time_budget_s=time_budget_s)
+    with open(output_path, 'w') as f:
+        for it, (tests, scored) in zip(items, decisions):
+            decision = {k: v for k, v in it.items() if k != 'changed_files'}
+            decision.update(make_decision(it.get('changed_files', []), tests, scored, time_budget_s))
+            f.write(json.dumps(decision) + '\n')
+    return len(items)
+
+
+# ml/predict_tests.py (solo el main modificado)
+def main(changed=None):
+    # changed: lista ya calculada en memoria (ci/pipeline.py); si no, se lee de disco
+    # Grafo de imports incremental: sólo se re-parsean los archivos modificados
+    import import_graph
+    import_graph.update_index()
+
+    # Modo batch (merge queue): BATCH_INPUT=queue.jsonl ⇒ una decisión por línea
+    batch_input = os.getenv('BATCH_INPUT')
+    if batch_input:
+        import time
+        output = os.getenv('BATCH_OUTPUT', 'files/batch_decisions.jsonl')
+        t0 = time.perf_counter()
+        n = run_batch(batch_input, output, **selection_params_from_env())
+        elapsed = time.perf_counter() - t0
+        print(f"=== AI Test Selection (batch) ===\n{n} decisions in {elapsed:.2f}s → {output}")
+        return
+
+    if changed is None:
+        changed = load_changed()
 
     # Si no hay cambios en app/, NO seleccionar tests
     if not changed:
@@ -68,24 +359,24 @@ def main():
         print(json.dumps(decision, indent=2))
         with open('files/selected_tests.json', 'w') as f:
             json.dump(decision, f, indent=2)
-        return
+        return decision
 
-    tests, scored = decide_tests(
-        changed,
-        min_tests=int(os.getenv('MIN_TESTS', '1')),
-        top_k=int(os.getenv('TOP_K', '3')),
-        prob_threshold=float(os.getenv('PROB_THRESHOLD', '0.15'))
-    )
+    params = selection_params_from_env()
+    tests, scored = decide_tests(changed, **params)
 
-    decision = {
-        'changed_files': changed,
-        'selected_tests': tests,
-        'class_probs': [{'label': c, 'prob': float(p)} for c,p in scored]
-    }
+    decision = make_decision(changed, tests, scored, params['time_budget_s'])
+    if decision.get('over_budget_s'):
+        print(f"Warning: selection exceeds TIME_BUDGET_S by {decision['over_budget_s']:.2f}s "
+              "(impacted tests always run; at least one test is selected).")
     print("=== AI Test Selection ===")
     print(json.dumps(decision, indent=2))
+    history = node_history(tests)
+    if history:
+        decision['node_history'] = history
+        print(f"Node history: {len(history)} test nodes from {HISTORY_DB}")
     with open('files/selected_tests.json', 'w') as f:
         json.dump(decision, f, indent=2)
+    return decision
 
 if __name__ == '__main__':
     main()
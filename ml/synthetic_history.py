@@ -0,0 +1,149 @@
+# ml/synthetic_history.py
+"""Vectorized synthetic CI history.
+
+Same generative rules as the original row-by-row ``make_example()`` loop, but
+whole batches are drawn at once with NumPy so tens of millions of commits can
+be produced (and streamed to shards on disk) with bounded memory.
+"""
+import os
+from pathlib import Path
+
+import numpy as np
+
+SEED = 42
+FILES = ['app/login.py', 'app/payment.py', 'app/ui.py']
+TESTS = ['tests/test_login.py', 'tests/test_payment.py', 'tests/test_ui.py']
+NONE_LABEL = 'none'
+
+# how many files a commit touches (1, 2 or 3)
+K_CHOICES = np.array([1, 2, 3])
+K_PROBS = [0.6, 0.3, 0.1]
+
+
+def labels_for(tests=TESTS):
+    """Label vocabulary used by the ``label`` arrays: one per test plus 'none'."""
+    return list(tests) + [NONE_LABEL]
+
+
+def generate_batch(n, rng, files=FILES, tests=TESTS):
+    """Draw ``n`` synthetic commits at once.
+
+    Returns a dict of arrays: ``mask`` (n x len(files) bool, changed files),
+    ``commit_msg_len``, ``weekday`` and ``label`` (index into ``labels_for(tests)``).
+    """
+    n_files = len(files)
+    k = np.minimum(rng.choice(K_CHOICES, size=n, p=K_PROBS), n_files)
+    # random k-subset per row: rank random keys and keep the k smallest
+    ranks = rng.random((n, n_files)).argsort(axis=1).argsort(axis=1)
+    mask = ranks < k[:, None]
+
+    def changed(path):
+        if path in files:
+            return mask[:, files.index(path)]
+        return np.zeros(n, dtype=bool)
+
+    login, payment, ui = changed('app/login.py'), changed('app/payment.py'), changed('app/ui.py')
+    single = k == 1
+    u = rng.random((n, 6))
+
+    none_idx = len(tests)
+    label = np.full(n, -1, dtype=np.int16)
+
+    # indirect dependencies first: ui.py alone -> login fails, login.py alone -> ui fails
+    label[single & ui & (u[:, 0] < 0.25)] = tests.index('tests/test_login.py')
+    label[(label < 0) & single & login & (u[:, 1] < 0.20)] = tests.index('tests/test_ui.py')
+
+    # direct correlations (primary failure), evaluated like the original elif chain
+    rest = label < 0
+    d_payment = rest & payment & (u[:, 2] < 0.55)
+    d_login = rest & ~d_payment & login & (u[:, 3] < 0.45)
+    d_ui = rest & ~d_payment & ~d_login & ui & (u[:, 4] < 0.35)
+    label[d_payment] = tests.index('tests/test_payment.py')
+    label[d_login] = tests.index('tests/test_login.py')
+    label[d_ui] = tests.index('tests/test_ui.py')
+
+    # otherwise: 'none' 35% of the time, else a random test
+    other = rest & ~(d_payment | d_login | d_ui)
+    ok_build = other & (u[:, 5] < 0.35)
+    label[ok_build] = none_idx
+    flaky = other & ~ok_build
+    label[flaky] = rng.integers(0, len(tests), size=int(flaky.sum()))
+
+    return {
+        'mask': mask,
+        'commit_msg_len': rng.integers(10, 120, size=n, dtype=np.int16),
+        'weekday': rng.integers(0, 7, size=n, dtype=np.int8),
+        'label': label,
+    }
+
+
+def iter_batches(total, batch_size=1_000_000, seed=SEED, files=FILES, tests=TESTS):
+    """Yield ``generate_batch`` dicts until ``total`` rows have been produced."""
+    rng = np.random.default_rng(seed)
+    done = 0
+    while done < total:
+        n = min(batch_size, total - done)
+        yield generate_batch(n, rng, files=files, tests=tests)
+        done += n
+
+
+def batch_to_frame(batch, files=FILES, tests=TESTS):
+    """Convert a batch to the DataFrame layout used by training (``changed_files`` as CSV)."""
+    import pandas as pd
+
+    names = np.array(files, dtype=object)
+    changed = [','.join(names[row]) for row in batch['mask']]
+    return pd.DataFrame({
+        'changed_files': changed,
+        'commit_msg_len': batch['commit_msg_len'].astype(int),
+        'weekday': batch['weekday'].astype(int),
+        'failed_test': np.array(labels_for(tests), dtype=object)[batch['label']],
+    })
+
+
+def write_shards(total, out_dir, batch_size=1_000_000, seed=SEED, fmt='npz', files=FILES, tests=TESTS):
+    """Stream ``total`` rows to ``out_dir`` as numbered shards; only one batch is held in memory.
+
+    Numbering continues after any shards already in ``out_dir``, so repeated runs append history.
+    """
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    start = len(list(out.glob('shard_*.*')))
+    if start:
+        seed = [seed, start]  # fresh stream for appended shards
+    paths = []
+    for i, batch in enumerate(iter_batches(total, batch_size, seed, files, tests), start=start):
+        if fmt == 'parquet':
+            path = out / f'shard_{i:05d}.parquet'
+            batch_to_frame(batch, files, tests).to_parquet(path, index=False)
+        else:
+            path = out / f'shard_{i:05d}.npz'
+            np.savez(path, files=np.array(files), labels=np.array(labels_for(tests)), **batch)
+        paths.append(path)
+    return paths
+
+
+def iter_shards(shard_dir, after=None):
+    """Yield ``(name, files, labels, batch)`` for each ``.npz`` shard in ``shard_dir``, in order.
+
+    ``after`` skips shards up to and including that name (incremental training watermark).
+    """
+    for path in sorted(Path(shard_dir).glob('shard_*.npz')):
+        if after is not None and path.name <= after:
+            continue
+        with np.load(path) as z:
+            batch = {key: z[key] for key in ('mask', 'commit_msg_len', 'weekday', 'label')}
+            yield path.name, z['files'].tolist(), z['labels'].tolist(), batch
+
+
+def main():
+    total = int(os.getenv('SYNTH_ROWS', '20000'))
+    out_dir = os.getenv('SYNTH_SHARDS_DIR', 'files/synth')
+    batch_size = int(os.getenv('SYNTH_BATCH', '1000000'))
+    fmt = os.getenv('SYNTH_FORMAT', 'npz')
+    paths = write_shards(total, out_dir, batch_size=batch_size, fmt=fmt)
+    print(f"Wrote {total} synthetic commits to {len(paths)} shard(s) in {out_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+# ml/tests/conftest.py
+# Tests of the selector tooling (not the demo app suite in tests/): ml/ modules import each other by bare name
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,45 @@
+import itertools
+import random
+
+import predict_tests
+from predict_tests import make_decision, pick_tests, pick_within_budget
+
+
+def best_by_brute_force(items, budget):
+    best = 0.0
+    for r in range(len(items) + 1):
+        for combo in itertools.combinations(items, r):
+            if sum(d for _, _, d in combo) <= budget:
+                best = max(best, sum(p for _, p, _ in combo))
+    return best
+
+
+def test_knapsack_stays_within_budget_and_is_optimal():
+    rng = random.Random(0)
+    for _ in range(40):
+        items = [(f'tests/test_{i}.py', round(rng.random(), 3), round(rng.uniform(0.1, 5), 2)) for i in range(7)]
+        durations = {name: d for name, _, d in items}
+        scored = sorted(((name, p) for name, p, _ in items), key=lambda x: -x[1])
+        budget = rng.uniform(1, 12)
+
+        picked = pick_within_budget(scored, durations, budget)
+        prob = dict(scored)
+        assert sum(durations[t] for t in picked) <= budget
+        # redondear las duraciones hacia arriba puede costar, como mucho, lo que cabe en la resolución
+        assert sum(prob[t] for t in picked) >= best_by_brute_force(items, budget * (1 - len(items) / 1000)) - 1e-9
+
+
+def test_fallback_respects_budget_and_decision_reports_overrun(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)  # sin índice de imports ni historial de duraciones reales
+    durations = {'tests/test_slow.py': 30.0, 'tests/test_fast.py': 2.0}
+    monkeypatch.setattr(predict_tests, 'load_durations', lambda *a, **k: durations)
+    scored = [('tests/test_slow.py', 0.0), ('tests/test_fast.py', 0.0)]  # nada con p > 0: el knapsack no elige
+
+    assert pick_tests(scored, time_budget_s=5) == ['tests/test_fast.py']
+    picked = pick_tests(scored, time_budget_s=1)
+    assert picked == ['tests/test_slow.py']  # nada cabe: el más probable, pero se informa del exceso
+
+    decision = make_decision(['app/x.py'], picked, scored, time_budget_s=1)
+    assert decision['time_budget_s'] == 1
+    assert decision['over_budget_s'] == 29.0
+    assert make_decision(['app/x.py'], ['tests/test_fast.py'], scored, time_budget_s=5)['over_budget_s'] == 0.0
@@ -0,0 +1,27 @@
+import numpy as np
+from sklearn.ensemble import ExtraTreesClassifier, RandomForestClassifier
+
+from flat_forest import FlatForest, export_forest
+
+
+def training_data(n=600, n_features=8, seed=0):
+    rng = np.random.default_rng(seed)
+    X = (rng.random((n, n_features)) < 0.3).astype(np.float32)
+    X[:, -2] = rng.integers(10, 120, n)
+    X[:, -1] = rng.integers(0, 7, n)
+    labels = np.array(['none', 'tests/test_login.py', 'tests/test_payment.py', 'tests/test_ui.py'], dtype=object)
+    y = labels[(X[:, 0] + 2 * X[:, 1] + (X[:, -2] > 60) + rng.integers(0, 2, n)).astype(int) % len(labels)]
+    return X, y
+
+
+def test_flat_export_matches_sklearn_predict_proba(tmp_path):
+    X, y = training_data()
+    for model in (RandomForestClassifier(n_estimators=40, max_depth=6, class_weight='balanced', random_state=1),
+                  ExtraTreesClassifier(n_estimators=25, random_state=2)):
+        model.fit(X, y)
+        flat = FlatForest(export_forest(model, tmp_path / f'{type(model).__name__}.flat'))
+
+        assert list(flat.classes_) == list(model.classes_)
+        assert flat.n_features_in_ == model.n_features_in_
+        # mismo orden de suma que el acumulador de sklearn ⇒ igualdad exacta, no aproximada
+        assert np.array_equal(flat.predict_proba(X), model.predict_proba(X))
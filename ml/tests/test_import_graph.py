@@ -0,0 +1,52 @@
+import os
+
+from import_graph import impacted_tests, update_index
+
+
+def write(path, text=''):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def make_tree(root):
+    write(root / 'app' / '__init__.py')
+    write(root / 'app' / 'money.py', 'ROUND = 2\n')
+    write(root / 'app' / 'payment.py', 'from .money import ROUND\n')
+    write(root / 'app' / 'checkout' / '__init__.py')
+    write(root / 'app' / 'checkout' / 'cart.py', 'from app import payment\n')
+    write(root / 'app' / 'ui.py', 'import app.money\n')
+    write(root / 'app' / 'unused.py', 'X = 1\n')
+    write(root / 'tests' / 'test_cart.py', 'from app.checkout.cart import *\n')
+    write(root / 'tests' / 'test_ui.py', 'import app.ui\n')
+    write(root / 'tests' / 'api' / 'conftest.py', 'from app.payment import ROUND\n')
+    write(root / 'tests' / 'api' / 'test_api.py', 'def test_x():\n    pass\n')
+
+
+def test_impact_follows_transitive_and_conftest_imports(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    make_tree(tmp_path)
+    index, parsed = update_index(roots=('app', 'tests'), index_path='index.json')
+    assert parsed == len(index['files'])
+
+    # money ← payment (relative import) ← cart ← test_cart; payment ← tests/api/conftest.py → test_api
+    assert impacted_tests(['app/money.py'], 'index.json') == [
+        'tests/api/test_api.py', 'tests/test_cart.py', 'tests/test_ui.py']
+    assert impacted_tests(['app/payment.py'], 'index.json') == ['tests/api/test_api.py', 'tests/test_cart.py']
+    # importing app.checkout.cart also runs the app/checkout and app packages
+    assert impacted_tests(['app/checkout/__init__.py'], 'index.json') == ['tests/test_cart.py']
+    assert impacted_tests(['app/unused.py'], 'index.json') == []
+
+
+def test_incremental_update_reparses_only_changed_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    make_tree(tmp_path)
+    update_index(roots=('app', 'tests'), index_path='index.json')
+
+    assert update_index(roots=('app', 'tests'), index_path='index.json')[1] == 0
+    write(tmp_path / 'app' / 'unused.py', 'from app import ui\n')
+    write(tmp_path / 'tests' / 'test_unused.py', 'import app.unused\n')
+    os.utime(tmp_path / 'app' / 'money.py')  # touched, same content: not re-parsed
+    index, parsed = update_index(roots=('app', 'tests'), index_path='index.json')
+    assert parsed == 2
+    assert impacted_tests(['app/money.py'], 'index.json') == [
+        'tests/api/test_api.py', 'tests/test_cart.py', 'tests/test_ui.py', 'tests/test_unused.py']
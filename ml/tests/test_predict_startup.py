@@ -0,0 +1,99 @@
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from features import FileFeatureEncoder
+from flat_forest import FlatForest, export_forest
+
+ML_DIR = Path(__file__).resolve().parent.parent
+
+FILES = ['app/login.py', 'app/payment.py', 'app/ui.py']
+CLASSES = ['none', 'tests/test_login.py', 'tests/test_payment.py', 'tests/test_ui.py']
+HEAVY_MODULES = ('numpy', 'scipy', 'pandas', 'sklearn', 'joblib')
+# importaciones de `python ml/predict_tests.py` con el modelo plano: ~45 ms medidos, presupuesto holgado
+# (runners compartidos son ruidosos) que sigue por debajo de lo que cuesta importar NumPy o sklearn; 0 lo desactiva
+IMPORT_BUDGET_MS = float(os.getenv('PREDICT_IMPORT_BUDGET_MS', '300')) or None
+
+
+def fake_forest(n_trees=20, depth=4, seed=0):
+    # árboles aleatorios con la forma de sklearn (tree_.children_left/…/value), sin entrenar nada
+    rng = random.Random(seed)
+    n_features = len(FILES) + 2
+    estimators = []
+    for _ in range(n_trees):
+        left, right, feature, threshold, value = [], [], [], [], []
+
+        def grow(d):
+            node = len(left)
+            for col in (left, right, feature, threshold, value):
+                col.append(None)
+            if d == depth or rng.random() < 0.2:
+                left[node] = right[node] = feature[node] = -1
+                threshold[node] = -2.0
+                weights = [rng.random() for _ in CLASSES]
+                value[node] = [w / sum(weights) for w in weights]
+            else:
+                f = rng.randrange(n_features)
+                feature[node] = f
+                threshold[node] = 0.5 if f < len(FILES) else rng.uniform(0, 100 if f == len(FILES) else 6)
+                value[node] = [1 / len(CLASSES)] * len(CLASSES)
+                left[node] = grow(d + 1)
+                right[node] = grow(d + 1)
+            return node
+
+        grow(0)
+        estimators.append(SimpleNamespace(tree_=SimpleNamespace(
+            children_left=np.array(left), children_right=np.array(right), feature=np.array(feature),
+            threshold=np.array(threshold), value=np.array(value)[:, None, :],
+            node_count=len(left), max_depth=depth)))
+    return SimpleNamespace(estimators_=estimators, classes_=np.array(CLASSES, dtype=object),
+                           n_features_in_=n_features, n_outputs_=1)
+
+
+def test_stdlib_rows_match_numpy_predict_proba(tmp_path):
+    model = FlatForest(export_forest(fake_forest(), tmp_path / 'model.flat'))
+    encoder = FileFeatureEncoder(FILES)
+    rng = random.Random(1)
+    sets = [rng.sample(FILES, rng.randint(0, len(FILES))) for _ in range(50)]
+    lengths = [rng.randint(1, 120) for _ in sets]
+    days = [rng.randint(0, 6) for _ in sets]
+
+    rows = model.predict_proba_rows(encoder.encode_row(s, n, d) for s, n, d in zip(sets, lengths, days))
+    matrix = model.predict_proba(encoder.transform(sets, commit_msg_len=lengths, weekday=days))
+    assert np.array_equal(np.array(rows), matrix)
+
+
+def run_predict_with_importtime(tmp_path):
+    files = tmp_path / 'files'
+    files.mkdir()
+    export_forest(fake_forest(), files / 'model_rf.flat')
+    (files / 'test_index.json').write_text(json.dumps({'files': FILES, 'dir_features': False, 'tests': CLASSES[1:]}))
+    (files / 'changed_files.json').write_text(json.dumps({'files': ['app/payment.py']}))
+
+    env = {**os.environ, 'PREDICT_DAEMON': '0'}
+    proc = subprocess.run([sys.executable, '-X', 'importtime', str(ML_DIR / 'predict_tests.py')],
+                          cwd=tmp_path, env=env, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    assert json.loads((files / 'selected_tests.json').read_text())['selected_tests']
+    # "import time: self [us] | cumulative | <nombre indentado por nivel>"
+    return [m.groups() for m in re.finditer(r'^import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)', proc.stderr, re.M)]
+
+
+def test_predict_entry_point_imports_no_heavy_modules(tmp_path):
+    names = {name for _, _, name in run_predict_with_importtime(tmp_path)}
+    assert not {n for n in names if n.split('.')[0] in HEAVY_MODULES}
+
+
+@pytest.mark.skipif(IMPORT_BUDGET_MS is None, reason='PREDICT_IMPORT_BUDGET_MS=0 disables the import time check')
+def test_predict_entry_point_import_budget(tmp_path):
+    imports = run_predict_with_importtime(tmp_path)
+    total_ms = sum(int(us) for us, indent, _ in imports if not indent) / 1000
+    assert total_ms <= IMPORT_BUDGET_MS, f'imports took {total_ms:.0f} ms (budget {IMPORT_BUDGET_MS:.0f} ms)'
@@ -0,0 +1,55 @@
+from collections import Counter
+from itertools import combinations
+
+import numpy as np
+
+from synthetic_history import FILES, K_PROBS, TESTS, generate_batch, labels_for
+
+N = 300_000
+TOL = 0.01
+
+
+def expected_labels(changed):
+    """Label distribution of the original row-by-row make_example() for one changed-file set."""
+    login, payment, ui = (f in changed for f in FILES)
+    probs = Counter()
+    rest = 1.0
+    # dependencias indirectas: un único archivo cambiado
+    if changed == ('app/ui.py',):
+        probs['tests/test_login.py'] += 0.25
+        rest = 0.75
+    if changed == ('app/login.py',):
+        probs['tests/test_ui.py'] += 0.20
+        rest = 0.80
+    # cadena if/elif de correlaciones directas
+    for present, test, p in ((payment, 'tests/test_payment.py', 0.55), (login, 'tests/test_login.py', 0.45),
+                             (ui, 'tests/test_ui.py', 0.35)):
+        if present:
+            probs[test] += rest * p
+            rest *= 1 - p
+    probs['none'] += rest * 0.35
+    for test in TESTS:
+        probs[test] += rest * 0.65 / len(TESTS)
+    return probs
+
+
+def test_vectorized_generator_keeps_the_original_distribution():
+    batch = generate_batch(N, np.random.default_rng(0))
+    labels = np.array(labels_for())[batch['label']]
+    sets = [tuple(f for f, hit in zip(FILES, row) if hit) for row in batch['mask']]
+
+    sizes = Counter(len(s) for s in sets)
+    for k, p in zip((1, 2, 3), K_PROBS):
+        assert abs(sizes[k] / N - p) < TOL
+    for k in (1, 2, 3):
+        for changed in combinations(FILES, k):
+            rows = [i for i, s in enumerate(sets) if s == changed]
+            # k-subsets are uniform among themselves
+            assert abs(len(rows) / sizes[k] - 1 / len(list(combinations(FILES, k)))) < TOL
+            got = Counter(labels[rows])
+            for label, p in expected_labels(changed).items():
+                assert abs(got[label] / len(rows) - p) < TOL, (changed, label)
+
+    assert batch['commit_msg_len'].min() >= 10 and batch['commit_msg_len'].max() < 120
+    assert set(np.unique(batch['weekday'])) == set(range(7))
+    assert (batch['label'] >= 0).all()
@@ -0,0 +1,79 @@
+# ml/train_cache.py
+"""Content-addressed cache of training outputs.
+
+The key is a hash of everything that determines the trained model (data
+source snapshot, file/test lists, hyperparameters, training code). On a hit
+the stored artifacts are copied back instead of retraining; entries are
+evicted least-recently-used first.
+"""
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+CACHE_DIR = os.getenv('TRAIN_CACHE_DIR', '.cache/ai-ci/train')
+MAX_ENTRIES = int(os.getenv('TRAIN_CACHE_MAX', '5'))
+
+
+def file_digest(path, chunk=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def shard_snapshot(shard_dir):
+    """Cheap identity of an append-only shard directory: (name, size, mtime) of every shard."""
+    return [
+        (p.name, p.stat().st_size, p.stat().st_mtime_ns)
+        for p in sorted(Path(shard_dir).glob('shard_*.*'))
+    ]
+
+
+def cache_key(inputs):
+    blob = json.dumps(inputs, sort_keys=True, default=str).encode()
+    return hashlib.sha256(blob).hexdigest()[:32]
+
+
+def restore(key, targets, cache_dir=CACHE_DIR, optional=()):
+    """Copy cached artifacts to ``targets`` ({name: destination path}); False on a miss.
+
+    Names in ``optional`` may be absent from the entry; their destination is then removed
+    so a stale file from another model cannot shadow the restored one.
+    """
+    entry = Path(cache_dir) / key
+    if not entry.is_dir() or not all((entry / name).exists() for name in targets if name not in optional):
+        return False
+    for name, dest in targets.items():
+        if not (entry / name).exists():
+            if os.path.exists(dest):
+                os.remove(dest)
+            continue
+        Path(dest).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(entry / name, dest)
+    os.utime(entry)  # mark as recently used
+    return True
+
+
+def store(key, targets, cache_dir=CACHE_DIR, max_entries=MAX_ENTRIES):
+    entry = Path(cache_dir) / key
+    tmp = entry.with_name(f'.{key}.{os.getpid()}.tmp')
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    for name, src in targets.items():
+        if os.path.exists(src):
+            shutil.copy2(src, tmp / name)
+    shutil.rmtree(entry, ignore_errors=True)
+    os.replace(tmp, entry)
+    evict(cache_dir, max_entries)
+    return entry
+
+
+def evict(cache_dir=CACHE_DIR, max_entries=MAX_ENTRIES):
+    entries = [p for p in Path(cache_dir).iterdir() if p.is_dir() and not p.name.startswith('.')]
+    entries.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+    for stale in entries[max_entries:]:
+        shutil.rmtree(stale, ignore_errors=True)
+    return len(entries[max_entries:])
@@ -1,114 +1,299 @@
 import json
 import os
-import random
 from pathlib import Path
 
-import joblib
-import numpy as np
-import pandas as pd
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import classification_report
-
-# Synthetic historical dataset generator
-random.seed(42)
-np.random.seed(42)
-
-FILES = ['app/login.py', 'app/payment.py', 'app/ui.py']
-TESTS = ['tests/test_login.py', 'tests/test_payment.py', 'tests/test_ui.py']
-
-def make_example(n=20000):
-    rows = []
-    for i in range(n):
-        # random subset of changed files
-        k = np.random.choice([1, 2, 3], p=[0.6, 0.3, 0.1])
-        changed = sorted(np.random.choice(FILES, size=k, replace=False).tolist())
-        # label: which test failed (primary failure)
-        # induce correlations with indirect dependencies:
-        # Model learns that file changes can affect multiple related tests
-        
-        failed = None
-        
-        # Simulate indirect dependencies FIRST (before direct correlations)
-        # This teaches the model that single file changes can affect related tests
-        # UI and Login are often related (UI forms, authentication interfaces, etc.)
-        if 'app/ui.py' in changed and len(changed) == 1:
-            if random.random() < 0.25:  # 25% chance of indirect effect
-                # ui.py alone → sometimes login fails (UI changes affect login forms)
-                failed = 'tests/test_login.py'
-        
-        if not failed and 'app/login.py' in changed and len(changed) == 1:
-            if random.random() < 0.20:  # 20% chance
-                # login.py alone → sometimes ui fails (login logic affects UI components)
-                failed = 'tests/test_ui.py'
-        
-        # Direct correlations (primary failure) - only if no indirect dependency
-        if not failed:
-            if 'app/payment.py' in changed and random.random() < 0.55:
-                failed = 'tests/test_payment.py'
-            elif 'app/login.py' in changed and random.random() < 0.45:
-                failed = 'tests/test_login.py'
-            elif 'app/ui.py' in changed and random.random() < 0.35:
-                failed = 'tests/test_ui.py'
-            else:
-                # sometimes nothing fails (ok build); mark "none"
-                failed = 'none' if random.random() < 0.35 else random.choice(TESTS)
-
-        commit_msg_len = np.random.randint(10, 120)
-        weekday = np.random.randint(0, 7)
-
-        rows.append({
-            'changed_files': ','.join(changed),
-            'commit_msg_len': commit_msg_len,
-            'weekday': weekday,
-            'failed_test': failed
-        })
-    return pd.DataFrame(rows)
-
-def featurize(df):
-    # one-hot for files + numeric features
-    X_files = pd.DataFrame({f'file_{f}': df['changed_files'].apply(lambda s: int(f in s.split(','))) for f in FILES})
-    X = pd.concat([
-        X_files,
-        df[['commit_msg_len', 'weekday']].astype(int)
-    ], axis=1)
-    return X
-
-def main(model_path='files/model_rf.pkl', mapping_path='files/test_index.json'):
-    df = make_example()
-    # keep 'none' as a class to learn "likely no failures"
-    y = df['failed_test']
-
-    X = featurize(df)
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=7, stratify=y)
-
-    clf = RandomForestClassifier(
-        n_estimators=500,
-        max_depth=10,
-        class_weight="balanced",
-        min_samples_leaf=1,
-        random_state=7,
-        n_jobs=-1
+# pandas / scikit-learn / joblib se importan donde se usan: un acierto de caché no los necesita
+import train_cache
+from flat_forest import export_forest, flat_path_for, is_flat_exportable
+from features import FileFeatureEncoder, discover_files
+from synthetic_history import FILES, TESTS, NONE_LABEL, SEED, iter_batches, iter_shards, batch_to_frame
+
+def make_example(n=20000, batch_size=1_000_000, seed=SEED):
+    # vectorized: whole batches of commits are drawn at once (see synthetic_history.py)
+    import pandas as pd
+    frames = [batch_to_frame(b) for b in iter_batches(n, batch_size=batch_size, seed=seed)]
+    return pd.concat(frames, ignore_index=True)
+
+def load_shards(shard_dir, after=None):
+    # synthetic history previously streamed to disk with `python ml/synthetic_history.py`;
+    # returns the frame and the name of the last shard read (training watermark)
+    import pandas as pd
+    frames, last = [], after
+    for name, files, labels, batch in iter_shards(shard_dir, after=after):
+        frames.append(batch_to_frame(batch, files, labels[:-1]))
+        last = name
+    if not frames:
+        if after is None:
+            raise FileNotFoundError(f"No shard_*.npz files found in {shard_dir}")
+        return pd.DataFrame(columns=['changed_files', 'commit_msg_len', 'weekday', 'failed_test']), last
+    return pd.concat(frames, ignore_index=True), last
+
+def load_history(db_path, after=None):
+    # real CI history ingested with `python ml/history_store.py` (git log + JUnit reports);
+    # the watermark is the last test_results id already trained on
+    import pandas as pd
+    import history_store
+    conn = history_store.connect(db_path)
+    rows = list(history_store.labelled_commits(conn, after=after))
+    conn.close()
+    columns = ['changed_files', 'commit_msg_len', 'weekday', 'failed_test']
+    if not rows:
+        if after is None:
+            raise FileNotFoundError(f"No commits with test results in {db_path}")
+        return pd.DataFrame(columns=columns), after
+    df = pd.DataFrame([r[1:] for r in rows], columns=columns)
+    df['changed_files'] = df['changed_files'].fillna('')
+    return df, rows[-1][0]
+
+def load_source(history_db=None, shard_dir=None, after=None):
+    if history_db:
+        return load_history(history_db, after=after)
+    return load_shards(shard_dir, after=after)
+
+def featurize(df, encoder):
+    # sparse one-hot for files (+ optional directories) + numeric features, single pass
+    changed = (s.split(',') if s else [] for s in df['changed_files'])
+    return encoder.transform(
+        changed,
+        commit_msg_len=df['commit_msg_len'].to_numpy(),
+        weekday=df['weekday'].to_numpy(),
     )
+
+HYPERPARAMS = dict(
+    n_estimators=500,
+    max_depth=10,
+    class_weight="balanced",
+    min_samples_leaf=1,
+    random_state=7,
+)
+STATE_PATH = 'files/train_state.json'
+ML_DIR = Path(__file__).resolve().parent
+TRAINING_CODE = ['train_test_selector.py', 'features.py', 'synthetic_history.py', 'flat_forest.py', 'benchmark_models.py',
+                 'history_store.py']
+
+PROMOTED_PATH = 'files/promoted_model.json'
+
+def make_classifier(**overrides):
+    from sklearn.ensemble import RandomForestClassifier
+    return RandomForestClassifier(**{'n_jobs': -1, **HYPERPARAMS, **overrides})
+
+def model_candidate():
+    # candidate promoted by ml/benchmark_models.py (or forced with MODEL_CANDIDATE); None ⇒ default RF
+    name = os.getenv('MODEL_CANDIDATE')
+    if not name and os.path.exists(PROMOTED_PATH):
+        with open(PROMOTED_PATH) as f:
+            name = json.load(f).get('candidate')
+    return name or None
+
+def build_model(candidate=None):
+    if candidate is None:
+        return make_classifier()
+    from benchmark_models import build_candidate
+    model = build_candidate(candidate)
+    if hasattr(model, 'n_jobs'):
+        model.n_jobs = -1
+    return model
+
+def fit_and_report(clf, X, y):
+    from sklearn.metrics import classification_report
+    from sklearn.model_selection import train_test_split
+
+    counts = y.value_counts()
+    stratify = y if len(counts) > 1 and counts.min() >= 2 else None
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=7, stratify=stratify)
     clf.fit(X_train, y_train)
 
     y_pred = clf.predict(X_test)
-    report = classification_report(y_test, y_pred, digits=3)
+    report = classification_report(y_test, y_pred, digits=3, zero_division=0)
     print("=== Model Report ===")
     print(report)
+    return clf
+
+def load_state(state_path=STATE_PATH):
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path) as f:
+        return json.load(f)
+
+def save_state(state, state_path=STATE_PATH):
+    with open(state_path, 'w') as f:
+        json.dump(state, f, indent=2)
+
+def balanced_weights(class_counts):
+    # sklearn's "balanced" formula, but over the whole history seen so far
+    total = sum(class_counts.values())
+    return {c: total / (len(class_counts) * n) for c, n in class_counts.items()}
 
+def incremental_update(clf, X_new, y_new, add_trees, max_trees, class_weight):
+    # warm start: keep the fitted trees, grow `add_trees` more on the new records only
+    clf.set_params(warm_start=True, n_estimators=len(clf.estimators_) + add_trees, class_weight=class_weight)
+    fit_and_report(clf, X_new, y_new)
+    if len(clf.estimators_) > max_trees:
+        # sliding window: the oldest trees saw the oldest history
+        clf.estimators_ = clf.estimators_[-max_trees:]
+        clf.n_estimators = max_trees
+    clf.set_params(warm_start=False, class_weight=HYPERPARAMS['class_weight'])
+    return clf
+
+def history_snapshot(db_path):
+    import history_store
+    conn = history_store.connect(db_path)
+    try:
+        return history_store.snapshot(conn)
+    finally:
+        conn.close()
+
+def library_versions():
+    # a pickle is only valid for the scikit-learn/NumPy that wrote it; metadata avoids importing them
+    from importlib import metadata
+    versions = {}
+    for dist in ('scikit-learn', 'numpy', 'scipy', 'joblib'):
+        try:
+            versions[dist] = metadata.version(dist)
+        except metadata.PackageNotFoundError:
+            versions[dist] = None
+    return versions
+
+def training_mode(state_path=STATE_PATH):
+    # an incremental update depends on the knobs and on the model it starts from
+    if os.getenv('INCREMENTAL') != '1':
+        return {'incremental': False}
+    state = load_state(state_path) or {}
+    return {
+        'incremental': True,
+        'increment_trees': int(os.getenv('INCREMENT_TREES', '50')),
+        'max_trees': int(os.getenv('MAX_TREES', str(HYPERPARAMS['n_estimators']))),
+        'previous': [state.get('source'), state.get('watermark'), state.get('n_estimators')],
+    }
+
+def training_inputs(shard_dir, n_rows, encoder, candidate=None, history_db=None, state_path=STATE_PATH):
+    # everything that determines the trained model → content-addressed cache key
+    if history_db:
+        data = {'history': [os.path.abspath(history_db), history_snapshot(history_db)]}
+    elif shard_dir:
+        data = {'shards': train_cache.shard_snapshot(shard_dir)}
+    else:
+        data = {'seed': SEED, 'rows': n_rows}
+    return {
+        'data': data,
+        'features': encoder.to_meta(),
+        'tests': TESTS,
+        'hyperparams': HYPERPARAMS,
+        'candidate': candidate,
+        'mode': training_mode(state_path),
+        'libraries': library_versions(),
+        'code': {name: train_cache.file_digest(ML_DIR / name) for name in TRAINING_CODE},
+    }
+
+def main(model_path='files/model_rf.pkl', mapping_path='files/test_index.json', state_path=STATE_PATH):
+    # data source: real CI history (HISTORY_DB) > synthetic shards (SYNTH_SHARDS_DIR) > make_example()
+    history_db = os.getenv('HISTORY_DB')
+    shard_dir = os.getenv('SYNTH_SHARDS_DIR')
+    source = os.path.abspath(history_db or shard_dir) if (history_db or shard_dir) else None
+
+    # feature space = source files discovered under app/ (falls back to the synthetic file list)
+    files = discover_files(os.getenv('APP_DIR', 'app')) or FILES
+    encoder = FileFeatureEncoder(files, dir_features=os.getenv('DIR_FEATURES') == '1')
+    n_rows = int(os.getenv('SYNTH_ROWS', '20000'))
+    candidate = model_candidate()
+
+    # Cache: mismos inputs ⇒ mismo modelo; restaurar en vez de reentrenar
+    outputs = {
+        'model.pkl': model_path,
+        'model.flat': flat_path_for(model_path),
+        'test_index.json': mapping_path,
+        'train_state.json': state_path,
+    }
+    key = None
+    if os.getenv('TRAIN_CACHE', '1') != '0':
+        key = train_cache.cache_key(training_inputs(shard_dir, n_rows, encoder, candidate, history_db, state_path))
+        if train_cache.restore(key, outputs, optional=('model.flat',)):
+            print(f"Training inputs unchanged (cache {key[:12]}) → restored {model_path} and {mapping_path}")
+            return
+
+    # Modo incremental: sólo historia nueva desde la última marca de agua (watermark)
+    state = load_state(state_path)
+    clf, watermark = None, None
+    if os.getenv('INCREMENTAL') == '1':
+        if not (state and source and state.get('source') == source and os.path.exists(model_path)):
+            print("Incremental training needs a previous model trained from the same "
+                  "HISTORY_DB / SYNTH_SHARDS_DIR → full retrain.")
+        elif state.get('features') != encoder.to_meta():
+            print("Feature space (file list) changed since last training → full retrain.")
+        else:
+            df_new, watermark = load_source(history_db, shard_dir, after=state.get('watermark'))
+            if df_new.empty:
+                print(f"No new history since {state.get('watermark')} → model unchanged.")
+                return
+            import joblib
+            prev = joblib.load(model_path)
+            if not (is_flat_exportable(prev) and hasattr(prev, 'warm_start')):
+                print(f"{type(prev).__name__} cannot be warm-started with extra trees → full retrain.")
+            elif set(df_new['failed_test']) != set(prev.classes_):
+                print("New history does not cover every known label → full retrain.")
+            else:
+                print(f"Incremental update with {len(df_new)} new records (after {state.get('watermark')}).")
+                counts = state.get('class_counts', {})
+                for label, n in df_new['failed_test'].value_counts().items():
+                    counts[label] = counts.get(label, 0) + int(n)
+                state['class_counts'] = counts
+                clf = incremental_update(
+                    prev, featurize(df_new, encoder), df_new['failed_test'],
+                    add_trees=int(os.getenv('INCREMENT_TREES', '50')),
+                    max_trees=int(os.getenv('MAX_TREES', str(HYPERPARAMS['n_estimators']))),
+                    class_weight=balanced_weights(counts),
+                )
+                state['rows_seen'] += len(df_new)
+
+    if clf is None:
+        if source:
+            df, watermark = load_source(history_db, shard_dir)
+        else:
+            df = make_example(n=n_rows)
+        # keep 'none' as a class to learn "likely no failures"
+        if candidate:
+            print(f"Training promoted candidate {candidate}")
+        clf = fit_and_report(build_model(candidate), featurize(df, encoder), df['failed_test'])
+        state = {
+            'source': source,
+            'rows_seen': len(df),
+            'class_counts': {k: int(v) for k, v in df['failed_test'].value_counts().items()},
+        }
+
+    import joblib
     joblib.dump(clf, model_path)
+    # mmap-able flat copy for fast cold loads in predict_tests.py (tree ensembles only)
+    flat_path = flat_path_for(model_path)
+    if is_flat_exportable(clf):
+        export_forest(clf, flat_path)
+    else:
+        if os.path.exists(flat_path):
+            os.remove(flat_path)  # a stale export would shadow the new pickle
+        flat_path = None
 
     # Save mapping/meta if needed
     meta = {
-        'files': FILES,
-        'tests': TESTS
+        **encoder.to_meta(),
+        # real history: whatever test files have actually failed
+        'tests': sorted(str(c) for c in clf.classes_ if c != NONE_LABEL) if history_db else TESTS
     }
     with open(mapping_path, 'w') as f:
         json.dump(meta, f, indent=2)
 
-    print(f"Saved model to {model_path}")
+    state.update({
+        'watermark': watermark,
+        'features': encoder.to_meta(),
+        'n_estimators': len(getattr(clf, 'estimators_', [])) or None,
+    })
+    save_state(state, state_path)
+
+    print(f"Saved model to {model_path} (flat export: {flat_path})")
     print(f"Saved mapping to {mapping_path}")
+    print(f"Saved training state to {state_path} (watermark: {watermark})")
+
+    if key:
+        train_cache.store(key, outputs)
+        print(f"Cached training outputs under {train_cache.CACHE_DIR}/{key}")
 
 if __name__ == '__main__':
     model_path = os.getenv('MODEL_PATH', 'files/model_rf.pkl')
@@ -9,21 +9,12 @@ export MIN_TESTS="1"
 python3 -m venv .venv && source .venv/bin/activate
 pip install -r requirements.txt 2>&1 > /dev/null
 
-# 1) Entrenar el modelo (RF)
-python3 ml/train_test_selector.py
-
-# 2) Simular archivos cambiados y predecir tests
-# export CHANGED_FILES="app/login.py,app/payment.py"
-python ci/collect_changed_files.py
-
-python3 ml/predict_tests.py
-
-# 3) Forzar fallo de demo (opcional para ver diagnóstico)
+# 1) Forzar fallo de demo (opcional para ver diagnóstico)
 export BREAK_PAYMENT=$1
 
-# 4) Ejecutar tests seleccionados y guardar logs
-python3 ci/run_selected_tests.py
-
-# 5) Diagnóstico con LLM (si tienes OPENAI_API_KEY) o fallback por reglas
+# 2) Entrenar, archivos cambiados, predicción, tests y diagnóstico en un único proceso.
+#    Cada paso se salta si sus entradas no cambiaron desde la última ejecución.
+# export CHANGED_FILES="app/login.py,app/payment.py"
+# Diagnóstico con LLM si tienes OPENAI_API_KEY; si no, fallback por reglas
 #export OPENAI_API_KEY=<openai_api_key>
-python3 ci/diagnose_failure_llm.py
+python3 -m ci.pipeline